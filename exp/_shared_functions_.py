@@ -27,6 +27,9 @@ def readout(lab, params):
     lab.dds.turn_on('binA', duration=params.bin_length.v)
     lab.dds.turn_on('binB', duration=params.bin_length.v)
     lab.delay(5*ms)
+    if 'counter_clock' in lab.dds.channels:
+        ## Sample the counts of this shot, for the buffered mode of the counter.
+        lab.dds.turn_on('counter_clock', duration=us, rewind=True)
     lab.dds.turn_off('Xshutter')
     return
 
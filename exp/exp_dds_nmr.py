@@ -57,6 +57,9 @@ def sequence(lab, params, fig, data, ID):
 def launch(lab, params, fig, data, ID):
     lab.counter.clear(0)
     lab.counter.clear(1)
+    if lab.inner_shots is not None:
+        ## One sample of each bin per shot, see get_inner_data().
+        lab.counter.start_buffered(lab.inner_shots)
     lab.dds.start()
     input()
     return
@@ -67,6 +70,11 @@ def get_data(lab, params, fig, data, ID):
     B = lab.counter.read(1)
     return B-A
     
+def get_inner_data(lab, params, fig, data, ID):
+    """ For scan(hardware_inner=True). Needs a 'counter_clock' channel wired to the scan clock of the counter, see _shared_functions_.readout(). """
+    counts = lab.counter.read_buffered()
+    return counts[:,1]-counts[:,0]
+    
 
     
 def create_plot(lab, params, fig, data, ID):
@@ -8,6 +8,7 @@ import exp.exp_dds_nmr
 
 launch = exp.exp_dds_nmr.launch
 get_data = exp.exp_dds_nmr.get_data
+get_inner_data = exp.exp_dds_nmr.get_inner_data
 
 def pre_scan(lab, params, fig, data, ID):
     lab.dds.clear_channel_names()
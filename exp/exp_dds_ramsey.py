@@ -12,6 +12,7 @@ import exp.exp_dds_nmr
 sequence = exp.exp_dds_nmr.sequence
 launch = exp.exp_dds_nmr.launch
 get_data = exp.exp_dds_nmr.get_data
+get_inner_data = exp.exp_dds_nmr.get_inner_data
 create_plot = exp.exp_dds_nmr.create_plot
 
 
@@ -11,6 +11,7 @@ import exp.exp_dds_nmr
 
 launch = exp.exp_dds_nmr.launch
 get_data = exp.exp_dds_nmr.get_data
+get_inner_data = exp.exp_dds_nmr.get_inner_data
 create_plot = exp.exp_dds_nmr.create_plot
 
 def pre_scan(lab, params, fig, data, ID):
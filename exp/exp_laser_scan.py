@@ -22,19 +22,25 @@ def launch(lab, params, fig, data, ID):
     
     
 def get_data(lab, params, fig, data, ID):
+    if USE_WAVEMETER and DETECTOR=='LOCKIN':
+        ## Read the wavemeter and the lockin at the same time.
+        wavelength, result = lab.gather(lab.wavemeter.measure, lab.lockin.get_Y)
+    else:
+        if USE_WAVEMETER:
+            wavelength = lab.wavemeter.measure()
+        else:
+            wavelength = 0
+        
+        if DETECTOR=='LOCKIN':
+            result = lab.lockin.get_Y()
+        elif DETECTOR=='COUNTER':
+            lab.counter.initiate_timer(params.delay.value)
+            while not lab.counter.timer_is_stopped():
+                pass
+            result = lab.counter.read(2)
+            
     if USE_WAVEMETER:
-        wavelength = lab.wavemeter.measure()
         params.wavelength.set_ith_value(wavelength)
-    else:
-        wavelength = 0
-    
-    if DETECTOR=='LOCKIN':
-        result = lab.lockin.get_Y()
-    elif DETECTOR=='COUNTER':
-        lab.counter.initiate_timer(params.delay.value)
-        while not lab.counter.timer_is_stopped():
-            pass
-        result = lab.counter.read(2)
     return result
 
 
@@ -3,15 +3,27 @@ Definition of LabMaster generic classes: Drawer, Lab, Instrument, Params, Parame
 Lab and Params both inherit from the Drawer class.
 Lab classe is designed to hold Instrument classes.
 Params class is designed to hold Parameter classes. 
+Lazy_range class is a Parameter value generating its elements on demand.
+Scan_queue class runs many scans back to back on the same Lab instance.
+Background_writer class saves the files of finished scans in a worker thread.
+Retry_policy class retries the stages of a point when an instrument raises a transient error.
+Sequence_cache, Profiler and Running_stats classes hold what a Lab or Params learns during a scan.
 """
 __author__ =  "Laurent Bergeron <laurent.bergeron4@gmail.com>"
 
 ## Base modules
 import numpy as np
+import time
 import timeit
 import types
+import copy
 import sys
 import importlib
+import threading
+import collections
+import datetime
+import contextlib
+import concurrent.futures
 
 ## Homemade modules
 from . import not_for_user as nfu
@@ -32,9 +44,13 @@ class Drawer():
     Only the attributes corresponding to the specific object type will be considered by methods.
     Though a Drawer can only manage one type of object, any object that inherits from another object is considered to be of that type as well.
     For example, when calling lab.get_objects(), all Intrument instances from lab will be listed, as well as any instance that inherits from Instrument.
+    Matching attributes are kept in a registry, built again only after a matching attribute is set or deleted, so methods don't go through every attribute. See register().
     """
     def __init__(self, type_str):
         """Initialize the drawer. Specify the type of objects that the drawer is meant to hold."""
+        ## Attributes matching the object type, by name. Built again by get_dict() when it is dirty, see register().
+        self.__dict__["_registry"] = collections.OrderedDict()
+        self.__dict__["_dirty"] = False
         self.object_type = type_str ## name of the object type the drawer is meant to hold (as a string)
         return
 
@@ -54,22 +70,28 @@ class Drawer():
                 
         ## If no error, the classic way to set attributes.
         self.__dict__[key] = value 
+        self.register(key)
         return
     
-    
+    def __delattr__(self, key):
+        """Delete an attribute, and forget it in the registry."""
+        del self.__dict__[key]
+        self.register(key)
+        return
 
     def is_object_type(self, value):
-        """Will return True if input argument is the same type as self.object_type, False if not."""
-        try:
-            classes = [str(x).split(".")[-1][:-2] for x in list(all_bases(value.__class__))+[value.__class__]]
-            out = self.object_type in classes
-        except:
-            out = False
-        return out
+        """
+        Will return True if input argument is the same type as self.object_type, False if not.
+        Classes are matched by name, so instances created before a module was reloaded still match.
+        """
+        return self.object_type in [cls.__name__ for cls in type(value).__mro__]
     
     def get_dict(self):
         """Return a dictionary with all attributes matching self.object_type."""
-        return {key:value for key, value in list(self.__dict__.items()) if self.is_object_type(value)}
+        if self.__dict__.get("_dirty", True):
+            ## A matching attribute was set or deleted, or the drawer was pickled before it had a registry.
+            self.rebuild_registry()
+        return dict(self._registry)
         
     def get_names(self):
         """Return a list of names of attributes matching self.object_type."""
@@ -90,6 +112,21 @@ class Drawer():
         namespace.update(self.get_dict())
         return
         
+    def rebuild_registry(self):
+        """Go through every attribute to build the registry again."""
+        self.__dict__["_registry"] = collections.OrderedDict([(key, value) for key, value in list(self.__dict__.items()) if self.is_object_type(value)])
+        self.__dict__["_dirty"] = False
+        return
+        
+    def register(self, key):
+        """
+        Mark the registry dirty if the attribute was registered or matches self.object_type, so that the next lookup builds it again. Other attributes leave it as is.
+        Called by __setattr__() and __delattr__(). Has to be called after setting, replacing or deleting an attribute through __dict__, otherwise methods will list stale objects.
+        """
+        if key in self.__dict__.get("_registry", {}) or (key in self.__dict__ and self.is_object_type(self.__dict__[key])):
+            self.__dict__["_dirty"] = True
+        return
+        
         
         
     
@@ -110,6 +147,30 @@ class Lab(Drawer):
         self.time_launched = 0
         ## each time the delay() function is called, this variable += the duration of delay. It is the time during which no pulse is applied.
         self.free_evolution_time = 0 
+        ## Number of shots in the program loaded by the current point, one per point of the inner sweep_dim, when the inner sweep_dim runs in hardware (see main.scan()). None otherwise.
+        self.inner_shots = None
+        ## Index of the shot being built by experiment.sequence() in a program with one shot per point (see nfu.compile_point()). None otherwise.
+        self.shot = None
+        ## Running_stats of the scan in progress, for the error bars of plotting.update_plot_auto(). The scan itself keeps them in its plan. None otherwise.
+        self.stats = None
+        ##-------------------------------------------- OPTIONS --------------------------------------------##
+        self.end_margin = 20*ms                 ## Safety margin added to total_duration before reading data. Tune it per station with nfu.wakeup_report().
+        self.spin_window = 20*ms                ## Stop sleeping this long before the end of experiment and spin until the end (sleep is only precise to ~16 ms on Windows).
+        self.detect_completion = True           ## End each experiment as soon as memory instruments confirm their sequence is over (see Instrument.is_done()).
+        self.poll_interval = 1*ms               ## Time between two completion polls.
+        self.sequence_cache = Sequence_cache(500e6) ## Compiled sequences of recent points, bounded to 500 MB. Set lab.sequence_cache.max_bytes = 0 to disable.
+        self.checkpoint_interval = 60*s         ## Time between two checkpoints of a running scan. See main.resume_scan().
+        self.background_saving = True           ## Save the files of a finished scan in a worker thread, so the console is free right away. See main.flush().
+        self.retry_policy = None                ## Retry_policy instance to retry stages of a point on transient instrument errors. If None, the first error stops the scan.
+        ##-------------------------------------------------------------------------------------------------##
+        ## Lateness (s) of each wakeup relative to the end of experiment. See nfu.wait_for_end().
+        self.wakeup_lateness = []
+        ## Duration (s) of nfu.compile_point() at each point, in the order of the plan. See nfu.overheads().
+        self.compile_durations = []
+        ## Duration (s) of the first experiment.launch() at each point, in the order of the plan. NaN if the point failed before launching. See nfu.measure_change_costs().
+        self.launch_durations = []
+        ## Time spent in each stage of the scan. See nfu.run_experiment().
+        self.profiler = Profiler()
         
         ## Connect to instruments specified in arguments.
         self.add_instrument(*names)
@@ -179,6 +240,7 @@ class Lab(Drawer):
                     
                 ## init requested instrument
                 self.__dict__[name] = class_(name, self, *opt_args, **opt_keyargs)
+                self.register(name)
                 
             except:
                 print("Can't add "+name+" ->  "+ sys.exc_info()[0].__name__+": "+str(sys.exc_info()[1]))
@@ -200,6 +262,7 @@ class Lab(Drawer):
         try:
             self.__dict__[name].close()
             del self.__dict__[name]
+            self.register(name)
             print(name+" closed.")
             return 0
         except KeyError:
@@ -227,10 +290,44 @@ class Lab(Drawer):
         self.update_time_cursor(duration, None)
         return
         
+    def gather(self, *calls):
+        """
+        Run several instrument calls at the same time, each in its own thread, and return their results in the order of the calls.
+        Meant for get_data(), to read many slow instruments (GPIB, USB) without waiting for each round trip in turn:
+            wavelength, signal, counts = lab.gather(lab.wavemeter.measure, lab.lockin.get_Y, (lab.counter.read, 2))
+        Each call holds the lock of its instrument, so two calls to the same instrument run one after the other.
+        If a call raises an error, the error is raised once every call is over.
+        The time taken, and the time the calls would have taken one after the other, are added to self.profiler.
+        
+        - calls: Methods of instruments, called without arguments, or tuples (method, arg1, arg2, ...).
+        """
+        calls = [call if isinstance(call, tuple) else (call,) for call in calls]
+        
+        def run(function, *args):
+            """Call the function while holding the lock of its instrument. Return its output and its duration."""
+            instrument = getattr(function, "__self__", None)
+            with instrument.lock if isinstance(instrument, Instrument) else contextlib.ExitStack():
+                started = timeit.default_timer()
+                output = function(*args)
+                return output, timeit.default_timer()-started
+                
+        started = timeit.default_timer()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(calls), 1)) as pool:
+            futures = [pool.submit(run, *call) for call in calls]
+            concurrent.futures.wait(futures)
+        self.profiler.add_gather(timeit.default_timer()-started, sum([future.result()[1] for future in futures if future.exception() is None]))
+        return [future.result()[0] for future in futures]
+        
     def get_memory_instruments(self):
         """Return connected instruments which have memory capacity."""
         return [instr for instr in self.get_objects() if instr.use_memory]
         
+    def get_spec(self, name):
+        """Return the name to give to add_instrument() to connect again to the specified instrument."""
+        if str(type(self.__dict__[name])).split('.')[-1]=="Default_visa'>":
+            return "VISA, "+name+", "+self.__dict__[name].visa_ID
+        return name
+        
     def print_connected(self, as_string=False):
         """Print connected instruments to the console."""
         string = ""
@@ -246,17 +343,45 @@ class Lab(Drawer):
         return
         
 
+    def reconnect(self, name):
+        """
+        Close the instrument and connect to it again with the same specification, then restore its settings (see Instrument.get_settings()).
+        Meant for an instrument which stopped answering during a scan (ex: a USB counter enumerated again, a GPIB controller reset). See Retry_policy.
+        The time taken is added to the "reconnect <name>" stage of self.profiler.
+        Raise a LabMasterError if the instrument can't be connected again. The old instance is then kept, so it can be reconnected later.
+        """
+        if name not in self.get_names():
+            raise nfu.LabMasterError(name+" was not found in lab's instruments.")
+        instrument = self.__dict__[name]
+        with self.profiler.time("reconnect "+name):
+            ## Wait for the worker of nfu.sweep_pipelined() to be done with the instrument.
+            with instrument.lock:
+                spec = self.get_spec(name)
+                settings = instrument.get_settings()
+                try:
+                    instrument.close()
+                except:
+                    ## The connection is likely gone already.
+                    print(name+" failed to close. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+                del self.__dict__[name]
+                self.register(name)
+                self.add_instrument(spec)
+                if name not in self.get_names():
+                    self.__dict__[name] = instrument
+                    self.register(name)
+                    raise nfu.LabMasterError("Can't reconnect "+name+".")
+                self.__dict__[name].restore_settings(settings)
+        print(name+" reconnected.")
+        return
+        
     def reload(self, name):
         """
         Close and reinitialize the instrument. 
         Avoids to restart the Ipython console on UnboundLocalError class autoreload bug.
         """
-        if str(type(self.__dict__[name])).split('.')[-1]=="Default_visa'>":
-            self.close(name)
-            self.add_instrument("VISA, "+name+", "+self.__dict__[name].visa_ID)
-        else:
-            self.close(name)
-            self.add_instrument(name)
+        spec = self.get_spec(name)
+        self.close(name)
+        self.add_instrument(spec)
         return
         
     def reset_instructions(self):
@@ -302,6 +427,12 @@ class Instrument():
     """
     Contains general attributes and methods that every instrument should have.
     """
+    ## Attributes copied to the new instance by Lab.reconnect(). Instruments keeping settings in the device itself should also overwrite restore_settings().
+    cached_settings = ()
+    ## True if the instructions of experiment.sequence() and compile_memory() leave the device alone, so they can run while it plays a sequence. 
+    ## Required from every memory instrument by nfu.sweep_pipelined(). Reads that don't change the state of the device are fine.
+    pipeline_safe = False
+    
     def __init__(self, name, parent, use_memory=False):
         """ 
         Initialize generic attributes of an instrument.
@@ -312,11 +443,25 @@ class Instrument():
         self.lab = parent
         self.name = name
         self.use_memory = use_memory
+        ## Held by a thread while it talks to the instrument from outside the main thread. See nfu.sweep_pipelined() and Lab.gather().
+        self.lock = threading.RLock()
         if self.use_memory:
             ## A list of instructions to fill during experiment.sequence().
             self.instructions = []
         return
 
+    def is_done(self):
+        """
+        Return True if the sequence loaded in memory is over, False if it's still running.
+        Return None if the instrument can't tell, which is the default. In this case, nfu.wait_for_end() relies on lab.total_duration.
+        Memory instruments able to tell should overwrite this method.
+        """
+        return None
+        
+    def get_settings(self):
+        """Return a copy of the attributes listed in cached_settings, by name. See Lab.reconnect()."""
+        return {key:copy.deepcopy(self.__dict__[key]) for key in self.cached_settings if key in self.__dict__}
+
     def reload(self):
         """
         Close and reinitialize the instrument. 
@@ -324,21 +469,260 @@ class Instrument():
         """
         self.lab.reload(self.name)
         return
+        
+    def restore_settings(self, settings):
+        """Set back the settings returned by get_settings() before Lab.reconnect()."""
+        for key, value in settings.items():
+            setattr(self, key, value)
+        return
 
 
+class Sequence_cache():
+    """
+    Least recently used cache of sequences compiled by memory instruments. See nfu.compile_point().
+    Keys are (instrument name, instrument.memory_key()). The memory used by cached sequences is bounded by max_bytes.
+    Counters of hits, misses and skipped uploads are saved with each scan.
+    """
+    def __init__(self, max_bytes):
+        """
+        Initialize an empty cache.
+        - max_bytes: Maximum memory used by cached sequences (bytes). The least recently used sequences are evicted first.
+        """
+        self.max_bytes = max_bytes
+        ## Cached sequences and their size in bytes, from least to most recently used.
+        self.entries = collections.OrderedDict()
+        ## Memory used by cached sequences (bytes).
+        self.size = 0
+        self.reset_counters()
+        return
+        
+    def __str__(self):
+        """String representation of the cache counters."""
+        requests = self.hits + self.misses
+        string = "Compiled-sequence cache: "+str(self.hits)+" hits, "+str(self.misses)+" misses"
+        if requests > 0:
+            string += " ("+str(int(100*self.hits/requests))+"% hit rate)"
+        string += ", "+str(self.uploads_skipped)+" uploads skipped, "+str(len(self.entries))+" sequences using "+nfu.auto_unit(self.size, "B", decimal=1)+"."
+        return string
+    
+    def clear(self):
+        """Forget every cached sequence."""
+        self.entries.clear()
+        self.size = 0
+        return
+        
+    def get(self, key):
+        """Return the cached sequence for key, or None if it's not cached. A None key is never cached."""
+        if key is None:
+            return None
+        if key in self.entries:
+            self.hits += 1
+            ## Most recently used goes last.
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        self.misses += 1
+        return None
+        
+    def put(self, key, compiled):
+        """Cache a compiled sequence, then evict the least recently used ones until the cache fits in max_bytes."""
+        if key is None or compiled is None:
+            return
+        size = nfu.size_of(compiled)
+        if size > self.max_bytes:
+            ## Would evict everything else for nothing.
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (compiled, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+        return
+        
+    def reset_counters(self):
+        """Reset hits, misses and skipped uploads to zero."""
+        self.hits = 0
+        self.misses = 0
+        self.uploads_skipped = 0
+        return
+        
+        
+class Profiler():
+    """
+    Time spent in each stage of a scan, measured with high-resolution timers. See nfu.run_experiment().
+    Stages are "sequence", "compile <instrument>", "load_memory <instrument>", "launch", "wait", "get_data", "update_plot", "set_point" and "checkpoint".
+    Calls of Lab.gather() are timed as a whole, and compared with the time they would have taken one after the other.
+    The duty cycle is the fraction of the scan wall time during which the hardware was running a sequence.
+    With nfu.sweep_pipelined(), "sequence" and "compile" stages run in a worker thread while the hardware runs, so the stages can add up to more than the wall time.
+    Reset before each scan by nfu.get_ready() and saved with each scan.
+    """
+    def __init__(self):
+        """Initialize an empty profiler."""
+        ## Stages can be timed from the worker of nfu.sweep_pipelined().
+        self.lock = threading.Lock()
+        self.reset()
+        return
+        
+    def __str__(self):
+        """String representation of the profile: one line per stage, then the duty cycle."""
+        wall_time = self.get_wall_time()
+        lines = ["Profile:"]
+        width = max([len(stage) for stage in self.stages]+[5])
+        if len(self.stages) > 0:
+            lines.append("    "+"stage".ljust(width)+"      calls        total         mean          max   % of wall")
+        for stage, (total, calls, longest) in self.stages.items():
+            lines.append("    "+stage.ljust(width)+str(calls).rjust(11)+nfu.auto_unit(total, "s", decimal=2).rjust(13)+nfu.auto_unit(total/calls, "s", decimal=2).rjust(13)+nfu.auto_unit(longest, "s", decimal=2).rjust(13)+("%.1f" % (100*total/wall_time) if wall_time > 0 else "-").rjust(12))
+        if self.gathers > 0:
+            lines.append("    Gather: "+str(self.gathers)+" calls of lab.gather() took "+nfu.auto_unit(self.gather_time, "s", decimal=1)+", against "+nfu.auto_unit(self.gather_serial_time, "s", decimal=1)+" one call after the other ("+"%.1f" % (self.gather_serial_time/max(self.gather_time, 1e-12))+" times faster).")
+        if self.compile_time > 0:
+            lines.append("    Pipeline: compiled in the worker for "+nfu.auto_unit(self.compile_time, "s", decimal=1)+", "+nfu.auto_unit(self.overlap_time, "s", decimal=1)+" ("+str(int(100*self.overlap_time/self.compile_time))+"%) overlapped with running sequences.")
+        if wall_time > 0:
+            lines.append("    Duty cycle: "+"%.1f" % (100*self.get_duty_cycle())+"% ("+nfu.auto_unit(self.running_time, "s", decimal=1)+" of hardware running over "+nfu.auto_unit(wall_time, "s", decimal=1)+" of wall time).")
+        return "\n".join(lines)
+        
+    def add(self, stage, duration):
+        """Add the duration (s) of one call to the specified stage."""
+        with self.lock:
+            total, calls, longest = self.stages.get(stage, (0, 0, 0))
+            self.stages[stage] = (total+duration, calls+1, max(longest, duration))
+        return
+        
+    def add_gather(self, duration, serial_duration):
+        """Add the duration (s) of one call of Lab.gather(), and the sum of the durations of its calls."""
+        with self.lock:
+            self.gathers += 1
+            self.gather_time += duration
+            self.gather_serial_time += serial_duration
+        return
+        
+    def add_running(self, duration):
+        """Add the duration (s) during which the hardware was running a sequence."""
+        with self.lock:
+            self.running_time += duration
+        return
+        
+    def get_duty_cycle(self):
+        """Return the fraction of wall time during which the hardware was running a sequence."""
+        wall_time = self.get_wall_time()
+        return self.running_time/wall_time if wall_time > 0 else 0
+        
+    def get_wall_time(self):
+        """Return the time (s) between start() and stop(), or until now if the profiler wasn't stopped."""
+        if self.started is None:
+            return 0
+        ended = self.ended if self.ended is not None else timeit.default_timer()
+        return ended-self.started
+        
+    def reset(self):
+        """Forget every measurement."""
+        ## Total duration (s), number of calls and longest call of each stage, in order of first call.
+        self.stages = collections.OrderedDict()
+        ## Time (s) during which the hardware was running a sequence.
+        self.running_time = 0
+        ## Time (s) spent compiling in the worker of nfu.sweep_pipelined(), and the part of it during which a sequence was running.
+        self.compile_time = 0
+        self.overlap_time = 0
+        ## Number of calls of Lab.gather(), time (s) they took, and time (s) their calls would have taken one after the other.
+        self.gathers = 0
+        self.gather_time = 0
+        self.gather_serial_time = 0
+        self.started = None
+        self.ended = None
+        return
+        
+    def start(self):
+        """Start measuring the wall time of the scan."""
+        self.started = timeit.default_timer()
+        self.ended = None
+        return
+        
+    def stop(self):
+        """Stop measuring the wall time of the scan."""
+        if self.started is not None:
+            self.ended = timeit.default_timer()
+        return
+        
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Context manager adding the time spent in its block to the specified stage:
+        with lab.profiler.time("get_data"):
+            ...
+        """
+        started = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add(stage, timeit.default_timer()-started)
+        
+        
 class Params(Drawer):
     """
     The main purpose of this class is to keep track of every parameter. It's a Drawer class with "Parameter" as type.
+    The sweep layout (parameters of each sweep_dim) is compiled once and reused at every point of a scan. See compile_layout().
     """
     def __init__(self, *args):
         """Initialize a Params instance. Arguments will be passed on to Parameter declarations."""
         Drawer.__init__(self, "Parameter")
+        ## Compiled sweep layout, None until needed. See compile_layout().
+        self._layout = None
+        ## Names of the parameters set from a table of points, by sweep_dim. See set_points().
+        self.point_lists = {}
         self.add_parameter(*args)
         return 
 
+    def __delattr__(self, key):
+        """Delete an attribute. The layout is compiled again if it was a parameter."""
+        Drawer.__delattr__(self, key)
+        self.__dict__["_layout"] = None
+        self.register("_layout")
+        return
+        
+    def __getstate__(self):
+        """Pickle everything but the compiled layout, which is only valid in the current session."""
+        state = self.__dict__.copy()
+        state["_layout"] = None
+        return state
+        
+    def __setattr__(self, key, value):
+        """Same as Drawer.__setattr__(). The layout is compiled again if a parameter is added."""
+        Drawer.__setattr__(self, key, value)
+        if self.is_object_type(value):
+            self.__dict__["_layout"] = None
+            self.register("_layout")
+        return
+        
     def __str__(self):
         """String representation of the sweep."""
         return self.print_sweep(as_string=True)
+        
+    def set_points(self, names, table, sweep_dim=1):
+        """
+        Sweep many parameters together through an explicit list of points, instead of the full grid of their values.
+        Each parameter gets a column of the table as its value, and they all go on the same sweep_dim, so the data array has a single dimension of len(table) points for them.
+        The table is saved with the sweep under 'POINT_LIST', and the names of its columns under 'POINT_LIST_NAMES'.
+        ex: params.set_points(["tau", "dds_freq"], [(1*us, 10*MHz), (2*us, 10*MHz), (2*us, 12*MHz)])
+        
+        - names: Names of the parameters, one per column of the table.
+        - table: Array of shape (number of points, len(names)), list of tuples, or generator of tuples.
+        - sweep_dim: Sweep dimension of the points. Other sweep dimensions are still swept as a grid around them. 
+                     A single sweep_dim can hold a table: calling set_points() again replaces the previous table.
+        """
+        names = list(names)
+        for name in names:
+            if not self.is_object_type(self.__dict__.get(name)):
+                raise nfu.LabMasterError(str(name)+" is not a parameter of this Params instance.")
+        table = list(table) if not isinstance(table, np.ndarray) else table
+        if len(table)==0:
+            raise nfu.LabMasterError("The table of points is empty.")
+        if any([len(np.shape(row))!=1 or len(row)!=len(names) for row in table]):
+            raise nfu.LabMasterError("Each point of the table must have one value for each of the "+str(len(names))+" parameters: "+", ".join(names)+".")
+        for k, name in enumerate(names):
+            self.__dict__[name].value = np.array([row[k] for row in table])
+            self.__dict__[name].sweep_dim = sweep_dim
+        self.point_lists = {sweep_dim:tuple(names)}
+        return
 
         
     def add_parameter(self, *args):
@@ -355,32 +739,79 @@ class Params(Drawer):
             except IndexError:
                 unit = ""
             self.__dict__[name] = Parameter(name, unit)
+            self.register(name)
+        self.__dict__["_layout"] = None
+        self.register("_layout")
         return
         
+    def compile_layout(self):
+        """
+        Compile the sweep layout: the swept parameters, the constants and the parameters of each sweep_dim, in the order of self.get_objects().
+        get_sweeps(), get_constants(), get_current_sweeps(), get_dimension() and get_data_indices() read the layout instead of going through every attribute.
+        Called by main.check_params(). The layout is compiled again as soon as the value or the sweep_dim of a parameter changes (see Parameter.generation), or when a parameter is added or deleted.
+        """
+        parameters = self.get_objects()
+        sweeps = [param for param in parameters if param.is_not_const() and param.sweep_dim > 0]
+        dimension = max([0]+[param.sweep_dim for param in sweeps])
+        ## Parameters of each sweep_dim. Index 0 (not swept) stays empty.
+        by_dim = [[] for i in range(dimension+1)]
+        for param in sweeps:
+            by_dim[param.sweep_dim].append(param)
+        self.__dict__["_layout"] = {"generation":Parameter.generation, 
+                                    "sweeps":sweeps, 
+                                    "constants":[param for param in parameters if param.is_const()],
+                                    "dimension":dimension, 
+                                    "by_dim":by_dim,
+                                    ## The index of each sweep_dim is read from its first parameter.
+                                    "first":[params[0] if params!=[] else None for params in by_dim[1:]]}
+        self.register("_layout")
+        return self._layout
+        
     def get_constants(self):
         """Return parameters with a constant as their value attribute."""
-        return [param for param in self.get_objects() if param.is_const()]
+        return list(self.get_layout()["constants"])
         
     def get_current_sweeps(self, current_sweep_dim):
         """Return list/array parameters that match current_sweep_dim."""
-        return [param for param in self.get_sweeps() if param.sweep_dim==current_sweep_dim] 
+        by_dim = self.get_layout()["by_dim"]
+        if 0 < current_sweep_dim < len(by_dim):
+            return list(by_dim[current_sweep_dim])
+        return []
     
     def get_data_indices(self):
         """Return a list of indices to place the current point in the data array."""
-        indices = []
-        for i in range(1, self.get_dimension()+1):
-            select_params = [y for y in self.get_sweeps() if y.sweep_dim==i]
-            indices.append(select_params[0].i)
-        return tuple(indices)
+        return tuple([param.i for param in self.get_layout()["first"]])
             
     def get_dimension(self):
         """Return the maximum sweep_dim."""
-        return max([0]+[param.sweep_dim for param in self.get_sweeps()])
+        return self.get_layout()["dimension"]
     
+    def get_layout(self):
+        """Return the compiled sweep layout, compiled again if it's outdated. See compile_layout()."""
+        layout = self.__dict__.get("_layout")
+        if layout is None or layout["generation"]!=Parameter.generation:
+            layout = self.compile_layout()
+        return layout
+        
     def get_sweeps(self):
         """Return parameters with a list or array as their value attribute."""
-        return [param for param in self.get_objects() if param.is_not_const() and param.sweep_dim > 0]
+        return list(self.get_layout()["sweeps"])
     
+    def get_point_list(self, sweep_dim):
+        """
+        Return the names of the parameters set by set_points() on the specified sweep_dim, and their table of points (one row per point, one column per parameter).
+        Return None if set_points() wasn't used on this sweep_dim, or if one of its parameters was changed since then.
+        """
+        names = getattr(self, "point_lists", {}).get(sweep_dim)
+        if names is None:
+            return None
+        params = [self.__dict__.get(name) for name in names]
+        if any([param is None or not self.is_object_type(param) or param.sweep_dim!=sweep_dim or param.is_const() for param in params]):
+            return None
+        if len(set([len(param.value) for param in params])) > 1:
+            return None
+        return names, np.column_stack([param.value for param in params])
+        
     def print_sweep(self, as_string=False):
         """ 
         Print the scheduled run in the most human readable way. 
@@ -398,7 +829,14 @@ class Params(Drawer):
         ## Print sweeps.
         for i in range(1, self.get_dimension()+1):
             string +=  str(i)+nfu.number_suffix(i)+" sweep:\n"
+            if self.get_point_list(i) is not None:
+                names, table = self.get_point_list(i)
+                string += "   "+str(len(table))+" points of ("+", ".join(names)+") from a table.\n\n"
+                continue
             for _, param in sorted([(x.name, x) for x in self.get_current_sweeps(i)]):
+                if isinstance(param.value, Lazy_range) and param.value.log:
+                    string +=  "   "+param.name+" from "+nfu.auto_unit(param.value[0],param.unit)+" to "+nfu.auto_unit(param.value[-1],param.unit)+" in "+str(len(param.value))+" log-spaced steps.\n"
+                    continue
                 string +=  "   "+param.name+" from "+nfu.auto_unit(param.value[0],param.unit)+" to "+nfu.auto_unit(param.value[-1],param.unit)+" with "+nfu.auto_unit(param.get_step(), param.unit)+" step size.\n"
             string +=  "\n"
         
@@ -417,11 +855,14 @@ class Parameter():
     """
     The Parameter class holds information about a parameter (that's right).
     Important attributes:
-    - value: Constant or array. Arrays will be swept according to their sweep_dim
+    - value: Constant, array or Lazy_range. Arrays and ranges will be swept according to their sweep_dim
     - i: Current index in the swept array. 
     - v: Current element of the array being swept. v = value[i] (v = value for a constant)
     - sweep_dim: Dimension of the scan on which to sweep the parameter. If sweep_dim=0, the parameter will not be swept.
     """
+    ## Incremented each time the value or the sweep_dim of any parameter is set, which outdates the compiled layout of Params. See Params.compile_layout().
+    generation = 0
+    
     def __init__(self, name, unit=""):
         """
         Initialize a Parameter instance.
@@ -432,10 +873,18 @@ class Parameter():
         self.value = 0
         self.sweep_dim = 1 ## Dimension of the scan on which to sweep the parameter. If sweep_dim=0, the parameter will not be swept.
         self.unit = unit
+        self.change_cost = None ## Time spent each time the value changes during a scan (s). If None, use the cost measured in previous scans. See nfu.change_costs().
         self.v = None ## Current element of the array being swept. v = value[i] (v = value for a constant)
         self.i = None ## Current index in the swept array. 
         return
         
+    def __setattr__(self, key, value):
+        """The classic way to set attributes, but setting value or sweep_dim outdates the compiled layout of every Params instance."""
+        if key in ("value", "sweep_dim"):
+            Parameter.generation += 1
+        self.__dict__[key] = value
+        return
+        
     def auto_unit(self, i=None):
         """
         Automatic unit format.
@@ -458,7 +907,7 @@ class Parameter():
         
     def is_not_const(self):
         """Return True if the '.value' attribute is indexable, False instead."""
-        if isinstance(self.value, (list, np.ndarray)):
+        if isinstance(self.value, (list, np.ndarray, Lazy_range)):
             out = True
         else:
             out = False
@@ -483,7 +932,9 @@ class Parameter():
     
     
     def get_step(self):
-        """Return step size of array (assuming it's constant)."""
+        """Return step size of array (assuming it's constant). None for a log-spaced Lazy_range."""
+        if isinstance(self.value, Lazy_range):
+            return self.value.get_step()
         try:
             step = self.value[1]-self.value[0]
         except (IndexError, TypeError):
@@ -538,3 +989,580 @@ class Parameter():
         return 
            
         
+            
+class Lazy_range():
+    """
+    Parameter value generating its elements on demand instead of holding them in an array, for very long sweeps.
+    It works like a read-only 1D array: len(), indexing (integers, slices and integer arrays), iteration and np.asarray(), which builds the full array.
+    A linear range goes from start to stop included by step, like main.orange(). A log range has num points from start to stop included, evenly spaced on a log scale.
+    Unlike arrays, a range can be longer than 10^6 points. The plan and the data array of a scan still hold every point, so a scan is limited to 10^7 points in total (see main.check_params()).
+    ex: params.tau.value = Lazy_range(0, 10*s, 1*ns)
+        params.tau.value = Lazy_range(1*us, 1*ms, num=100, log=True)
+    """
+    ndim = 1
+    
+    def __init__(self, start, stop, step=None, num=None, log=False):
+        """
+        Initialize a range. Nothing is computed until values are requested.
+        
+        - start, stop: First and last values.
+        - step: Step of a linear range. Ignored for a log range.
+        - num: Number of points of a log range. Ignored for a linear range.
+        - log: If True, the range is evenly spaced on a log scale.
+        """
+        self.start = start
+        self.stop = stop
+        self.log = log
+        if log:
+            if num is None or int(num)!=num or num < 1:
+                raise nfu.LabMasterError("A log range needs a positive integer number of points (num), instead of "+str(num)+".")
+            if start*stop <= 0:
+                raise nfu.LabMasterError("A log range can't go through zero: start="+str(start)+", stop="+str(stop)+".")
+            self.step = None
+            self.num = int(num)
+        else:
+            if step is None or step==0:
+                raise nfu.LabMasterError("A linear range needs a non-zero step.")
+            if (stop-start)/step < 0:
+                raise nfu.LabMasterError("A step of "+str(step)+" never goes from "+str(start)+" to "+str(stop)+".")
+            self.step = step
+            ## Relative tolerance on float division, so that stop is included when it's on the grid, without the extra point main.orange() sometimes gives.
+            quotient = (stop-start)/step
+            if np.isclose(quotient, np.round(quotient), rtol=1e-10, atol=0):
+                quotient = np.round(quotient)
+            self.num = int(np.floor(quotient)) + 1
+        return
+        
+    def __array__(self, dtype=None, copy=None):
+        """Return every value as a numpy array."""
+        values = self.get_values(np.arange(self.num))
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+        
+    def __getitem__(self, index):
+        """Return the value at an integer index, or an array of values for a slice or an array of indices."""
+        if isinstance(index, slice):
+            return self.get_values(np.arange(*index.indices(self.num)))
+        if isinstance(index, (int, np.integer)):
+            if not -self.num <= index < self.num:
+                raise IndexError("index "+str(index)+" is out of bounds for a range of "+str(self.num)+" points.")
+            return self.get_values(np.array(index%self.num))[()]
+        indices = np.asarray(index)
+        if indices.dtype==bool:
+            indices = np.flatnonzero(indices)
+        if np.any(indices >= self.num) or np.any(indices < -self.num):
+            raise IndexError("index out of bounds for a range of "+str(self.num)+" points.")
+        return self.get_values(indices%self.num)
+        
+    def __iter__(self):
+        """Iterate over values, one at a time."""
+        for i in range(self.num):
+            yield self[i]
+            
+    def __len__(self):
+        """Number of points."""
+        return self.num
+        
+    def __setitem__(self, index, value):
+        """Values of a range can't be changed."""
+        raise nfu.LabMasterError("A Lazy_range is read-only. Use materialize() to get an array: param.value = param.value.materialize()")
+        
+    def __str__(self):
+        """String representation of the range."""
+        if self.log:
+            return "Lazy_range("+str(self.start)+", "+str(self.stop)+", num="+str(self.num)+", log=True)"
+        return "Lazy_range("+str(self.start)+", "+str(self.stop)+", "+str(self.step)+")"
+        
+    __repr__ = __str__
+    
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a range from the output of to_record(), as found in a saved sweep."""
+        if record["log"]:
+            return cls(record["start"], record["stop"], num=int(record["num"]), log=True)
+        return cls(record["start"], record["stop"], record["step"])
+        
+    def get_step(self):
+        """Return the step of a linear range, None for a log range."""
+        return self.step
+        
+    def get_values(self, indices):
+        """Return the values at an array of non-negative indices."""
+        indices = np.asarray(indices)
+        if not self.log:
+            return self.start + indices*self.step
+        if self.num==1:
+            return np.full(indices.shape, self.start, dtype=float)
+        return self.start*(self.stop/self.start)**(indices/(self.num-1))
+        
+    def materialize(self):
+        """Return every value as a numpy array. Same as np.asarray()."""
+        return np.asarray(self)
+        
+    @property
+    def shape(self):
+        """Shape of the equivalent array."""
+        return (self.num,)
+        
+    def to_record(self):
+        """Return the range as a numpy record (start, stop, step, num, log), which is how it's saved by main.save_sweep(). See from_record()."""
+        dtype = [("start", float), ("stop", float), ("step", float), ("num", int), ("log", bool)]
+        return np.array((self.start, self.stop, np.nan if self.step is None else self.step, self.num, self.log), dtype=dtype)
+        
+        
+class Retry_policy():
+    """
+    How to retry the stages of a point when an instrument raises a transient error (ex: a VISA timeout on a flaky GPIB bus), instead of stopping the scan. Give it to lab.retry_policy.
+    The stages are "load_memory", "launch" and "get_data" (experiment.get_inner_data() included). See nfu.run_stage().
+    Retry n of a stage waits backoff*factor**(n-1), up to max_backoff, then runs the stage again.
+    When a stage still fails after its retries, the point is marked failed: NaN in the data array, and a reason code under 'FAILED' in the sweep file (see nfu.acquire()). The scan goes on with the next point.
+    Only errors of the listed types are retried. Others, such as KeyboardInterrupt or a bug in the experiment module, still stop the scan.
+    Some errors need a full reconnection (ex: a USB counter enumerated again). When a stage still fails after its retries, the instruments listed for it in reconnect are reconnected with Lab.reconnect() and the stage gets its retries again.
+    Retries, reconnections and failed points are reported at the end of the scan.
+    ex: lab.retry_policy = Retry_policy(get_data=3, launch=1, backoff=0.5*s, reconnect={"get_data":("counter",)})
+    """
+    def __init__(self, get_data=3, load_memory=1, launch=1, backoff=100*ms, factor=2, max_backoff=10*s, errors=None, reconnect=None, max_reconnects=1):
+        """
+        - get_data, load_memory, launch: Maximum number of retries of each stage. With 0, the point is marked failed at the first error.
+        - backoff: Wait before the first retry (s).
+        - factor: Each retry waits factor times longer than the previous one.
+        - max_backoff: Longest wait before a retry (s).
+        - errors: Tuple of error types to retry. 
+                  Default is LabMasterError (raised by LabMaster instruments), OSError (timeouts included) and VisaIOError.
+        - reconnect: Dictionary of the instruments to reconnect for each stage, ex: {"get_data":("counter", "lockin")}. A tuple of names is used for every stage.
+        - max_reconnects: Maximum number of reconnections of a stage at each point. Reconnection n waits backoff*factor**(n-1), up to max_backoff, so the device has time to come back.
+        """
+        self.max_retries = collections.OrderedDict([("load_memory", load_memory), ("launch", launch), ("get_data", get_data)])
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        if errors is None:
+            errors = (nfu.LabMasterError, OSError)
+            ## Only if the visa module is loaded (see main).
+            visa_error = getattr(sys.modules.get("visa"), "VisaIOError", None)
+            if isinstance(visa_error, type):
+                errors += (visa_error,)
+        self.errors = tuple(errors)
+        if reconnect is None:
+            reconnect = {}
+        elif not isinstance(reconnect, dict):
+            reconnect = {stage:reconnect for stage in self.max_retries}
+        self.reconnect = {stage:tuple(names) for stage, names in reconnect.items()}
+        self.max_reconnects = max_reconnects
+        self.reset()
+        return
+        
+    def __str__(self):
+        """String representation of the retries: for each stage, the retries, the ones that recovered, and the points that failed."""
+        lines = []
+        for stage in self.max_retries:
+            if self.retries[stage] > 0 or self.failures[stage] > 0:
+                lines.append("    "+stage+": "+str(self.retries[stage])+" retries, "+str(self.recovered[stage])+" recovered, "+str(self.failures[stage])+" failed (max "+str(self.max_retries[stage])+" retries).")
+        for name, (reconnected, failed) in self.reconnects.items():
+            lines.append("    "+name+": reconnected "+str(reconnected)+" times, "+str(failed)+" failed reconnections.")
+        if lines==[]:
+            return "Retries: none."
+        return "\n".join(["Retries:"]+lines)
+        
+    def get_backoff(self, retry):
+        """Return the wait before the specified retry (s), starting at 1."""
+        return min(self.backoff*self.factor**(retry-1), self.max_backoff)
+        
+    def reset(self):
+        """Forget the counts of retries, recoveries, failures and reconnections. Done before each scan by nfu.get_ready()."""
+        self.retries = collections.OrderedDict([(stage, 0) for stage in self.max_retries])
+        self.recovered = collections.OrderedDict([(stage, 0) for stage in self.max_retries])
+        self.failures = collections.OrderedDict([(stage, 0) for stage in self.max_retries])
+        ## Successful and failed reconnections of each instrument.
+        self.reconnects = collections.OrderedDict()
+        return
+        
+    def reconnect_all(self, lab, stage, reconnect):
+        """Wait for the backoff of the specified reconnection, starting at 1, then reconnect the instruments listed for the stage. Errors will be printed, not raised."""
+        names = self.reconnect[stage]
+        print("Reconnecting "+", ".join(names)+" in "+nfu.auto_unit(self.get_backoff(reconnect), "s", decimal=1)+" (reconnection "+str(reconnect)+" of "+str(self.max_reconnects)+").")
+        time.sleep(self.get_backoff(reconnect))
+        for name in names:
+            counts = self.reconnects.setdefault(name, [0, 0])
+            try:
+                lab.reconnect(name)
+                counts[0] += 1
+            except:
+                counts[1] += 1
+                print(name+" reconnection failed; ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+        return
+        
+    def run(self, lab, stage, function, *args):
+        """
+        Return function(*args), retrying it on the listed errors. 
+        Once the retries of the stage are exhausted, reconnect the instruments listed for it, and start the retries over (up to max_reconnects times).
+        Raise a nfu.PointFailedError once the retries and the reconnections of the stage are exhausted.
+        """
+        retry = 0
+        reconnect = 0
+        while True:
+            try:
+                result = function(*args)
+                if retry > 0 or reconnect > 0:
+                    self.recovered[stage] += 1
+                return result
+            except self.errors as error:
+                if retry >= self.max_retries[stage]:
+                    if reconnect >= self.max_reconnects or len(self.reconnect.get(stage, ()))==0:
+                        self.failures[stage] += 1
+                        raise nfu.PointFailedError(stage, error)
+                    print(stage+" failed ("+type(error).__name__+": "+str(error)+") after "+str(retry)+" retries.")
+                    reconnect += 1
+                    retry = 0
+                    self.reconnect_all(lab, stage, reconnect)
+                    continue
+                retry += 1
+                self.retries[stage] += 1
+                print(stage+" failed ("+type(error).__name__+": "+str(error)+"), retry "+str(retry)+" of "+str(self.max_retries[stage])+" in "+nfu.auto_unit(self.get_backoff(retry), "s", decimal=1)+".")
+                time.sleep(self.get_backoff(retry))
+        
+        
+class Running_stats():
+    """
+    Running mean, variance and count of repeated measurements at each point of a scan, updated one shot at a time with Welford's algorithm.
+    The mean is kept in the data array itself, so experiments and plots see averaged data without changes. No array dimension is added for repeats.
+    Optionally, the last shots of each point are kept in a ring buffer.
+    A point can stop early, as soon as its signal reaches a target standard error or signal to noise ratio. See is_done().
+    A structured data array (see nfu.data_dtype()) is handled field by field, and variances and errors are returned as structured arrays of the same fields.
+    """
+    def __init__(self, data, dimension, repeats=1, keep_shots=0, min_repeats=None, target_error=None, target_snr=None):
+        """
+        Initialize statistics for an empty scan.
+        
+        - data: Data array of the scan, as returned by nfu.zeros(). It will hold the mean.
+        - dimension: Number of sweep dimensions, params.get_dimension(). The remaining axes of data hold the values returned by get_data.
+        - repeats: Number of shots at each point. If a target is given, maximum number of shots at each point, at least 2.
+        - keep_shots: Number of raw shots kept for each point. The oldest shots are overwritten. 0 keeps none.
+        - min_repeats: Minimum number of shots at each point before a target can stop it. If None, 2 if a target is given (a variance needs 2 shots), else repeats.
+        - target_error: Stop a point once the standard error of its signal is this low or lower.
+        - target_snr: Stop a point once the signal to noise ratio (|mean|/standard error) of its signal is this high or higher.
+        The signal is the first value returned by get_data.
+        """
+        self.repeats = repeats
+        self.keep_shots = keep_shots
+        self.target_error = target_error
+        self.target_snr = target_snr
+        if self.has_target() and repeats < 2:
+            raise nfu.LabMasterError("repeats must be at least 2 with a target error or SNR, to estimate the variance. It is the maximum number of shots at each point.")
+        if min_repeats is None:
+            min_repeats = 2 if self.has_target() else repeats
+        if self.has_target() and min_repeats < 2:
+            raise nfu.LabMasterError("min_repeats must be at least 2 with a target error or SNR, to estimate the variance.")
+        self.min_repeats = min(min_repeats, repeats)
+        ## Fields of a structured data array, updated one by one. None stands for a plain data array.
+        self.fields = list(data.dtype.names) if data.dtype.names is not None else [None]
+        ## Mean of the shots at each point.
+        self.mean = data
+        ## Number of shots at each point.
+        self.count = np.zeros(data.shape[:dimension], dtype=int)
+        ## Sum of squared differences from the mean. A single shot has no variance, so it's not allocated for repeats=1.
+        if repeats > 1:
+            self.m2 = np.zeros(data.shape, dtype=nfu.float_dtype(data.dtype, np.float64))
+        else:
+            self.m2 = None
+        ## Last shots of each point. Shot n of a point is stored at shots[n%keep_shots].
+        if keep_shots > 0:
+            self.shots = nfu.nans((keep_shots,)+data.shape, nfu.float_dtype(data.dtype))
+        else:
+            self.shots = None
+        return
+        
+    def add(self, indices, value):
+        """
+        Add a shot to the statistics of a point.
+        
+        - indices: Indices of the point in the data array, params.get_data_indices().
+        - value: Output of experiment.get_data().
+        """
+        if self.fields==[None]:
+            value = np.asarray(value, dtype=float)
+        else:
+            value = nfu.as_record(value, self.mean.dtype)
+        slot = self.count[indices]%self.keep_shots if self.shots is not None else None
+        self.count[indices] += 1
+        count = self.count[indices]
+        for name in self.fields:
+            shot = nfu.field(value, name)
+            mean = nfu.field(self.mean, name)
+            if self.shots is not None:
+                nfu.field(self.shots, name)[(slot,)+indices] = shot
+            if count==1:
+                mean[indices] = shot
+                if self.m2 is not None:
+                    nfu.field(self.m2, name)[indices] = 0
+            else:
+                delta = shot - mean[indices]
+                mean[indices] += delta/count
+                nfu.field(self.m2, name)[indices] += delta*(shot - mean[indices])
+        return
+        
+    def __str__(self):
+        """String representation of the number of shots taken."""
+        measured = self.count[self.count > 0]
+        if len(measured)==0:
+            return "Repeats: no point measured."
+        string = "Repeats: "+"%0.1f"%np.mean(measured)+" shots per point on average (min "+str(np.min(measured))+", max "+str(np.max(measured))+")"
+        if self.has_target():
+            string += ", "+str(int(100*np.sum(measured)/(self.repeats*len(measured))))+"% of the "+str(self.repeats)+" allowed"
+        return string+"."
+        
+    def __getstate__(self):
+        """Pickle everything but a memory-mapped mean, which is already on disk (see main.scan()). It has to be put back after unpickling."""
+        state = self.__dict__.copy()
+        if isinstance(self.mean, np.memmap):
+            state["mean"] = None
+        return state
+        
+    def get_count(self):
+        """Return the number of shots at each point, broadcast to the shape of the data array."""
+        return self.count.reshape(self.count.shape+(1,)*(self.mean.ndim-self.count.ndim))*np.ones(self.mean.shape, dtype=int)
+        
+    def get_error(self):
+        """Return the standard error of the mean at each point. NaN where there are less than 2 shots."""
+        error = self.get_variance()
+        count = self.get_count()
+        for name in self.fields:
+            variance = nfu.field(error, name)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                variance[...] = np.sqrt(variance/count.reshape(count.shape+(1,)*(variance.ndim-count.ndim)))
+        return error
+        
+    def get_shots(self, indices):
+        """Return the kept shots of a point, from the oldest to the newest. The first axis is the shot."""
+        if self.shots is None:
+            raise nfu.LabMasterError("Shots are not kept. Use the keep_shots option of scan().")
+        count = self.count[indices]
+        kept = min(count, self.keep_shots)
+        order = [(count-kept+n)%self.keep_shots for n in range(kept)]
+        return self.shots[(order,)+indices]
+        
+    def has_target(self):
+        """Return True if points can stop before repeats shots."""
+        return self.target_error is not None or self.target_snr is not None
+        
+    def is_done(self, indices):
+        """
+        Return True if the point needs no more shots:
+        - It has repeats shots, or
+        - It has at least min_repeats shots, and its signal reached target_error or target_snr.
+        """
+        count = self.count[indices]
+        if count >= self.repeats:
+            return True
+        if count < self.min_repeats or not self.has_target():
+            return False
+        mean = nfu.first_value(self.mean[indices])
+        error = np.sqrt(nfu.first_value(self.m2[indices])/(count-1)/count)
+        if self.target_error is not None and error <= self.target_error:
+            return True
+        if self.target_snr is not None and np.abs(mean) >= self.target_snr*error:
+            return True
+        return False
+        
+    def get_variance(self):
+        """Return the sample variance of the shots at each point. NaN where there are less than 2 shots."""
+        variance = nfu.nans(self.mean.shape, nfu.float_dtype(self.mean.dtype, np.float64))
+        if self.m2 is None:
+            return variance
+        count = self.get_count()
+        for name in self.fields:
+            m2 = nfu.field(self.m2, name)
+            m2_count = count.reshape(count.shape+(1,)*(m2.ndim-count.ndim))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                nfu.field(variance, name)[...] = np.where(m2_count > 1, m2/(m2_count-1), np.nan)
+        return variance
+            
+            
+class Background_writer():
+    """
+    Run saving functions one after the other in a worker thread, so the console is free while files are written. See main.run_sweep().
+    Jobs run in the order they were submitted. Saving functions print their errors instead of raising them, and so does the writer for the others.
+    ex: writer.submit(save_sweep, params, data, ID, callback=lambda: print("saved"))
+        writer.flush()
+    """
+    def __init__(self):
+        """Initialize a writer with no jobs. The worker thread starts with the first job."""
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        ## Jobs submitted and not known to be done yet.
+        self.futures = []
+        self.lock = threading.Lock()
+        return
+        
+    def flush(self, timeout=None):
+        """
+        Wait until every job submitted so far is done. 
+        Return True if they are, False if the timeout (s) ran out first. If timeout is None, wait as long as needed.
+        """
+        with self.lock:
+            futures = list(self.futures)
+        not_done = concurrent.futures.wait(futures, timeout)[1]
+        with self.lock:
+            self.futures = [future for future in self.futures if not future.done()]
+        return len(not_done)==0
+        
+    def is_busy(self):
+        """Return True if some jobs are not done yet."""
+        with self.lock:
+            return any([not future.done() for future in self.futures])
+            
+    def submit(self, function, *args, callback=None, **kwargs):
+        """
+        Run function(*args, **kwargs) in the worker thread, after the jobs already submitted. 
+        Arguments must not change until the job is done: give copies of objects still in use (see nfu.snapshot() and nfu.copy_figure()).
+        
+        - callback: Function called without arguments in the worker thread once the job is done, even if it failed. 
+        """
+        def job():
+            """Run the function, print its error if any, then call the callback."""
+            try:
+                function(*args, **kwargs)
+            except:
+                print(function.__name__+"() failed in the background. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+            if callback is not None:
+                callback()
+            return
+        with self.lock:
+            self.futures = [future for future in self.futures if not future.done()]
+            self.futures.append(self.worker.submit(job))
+        return
+        
+        
+class Scan_queue():
+    """
+    Run a list of scans back to back on the same Lab instance, for overnight runs. Instruments stay connected and warm between scans.
+    Each job is a scan with its own ID and saved files. A failed job is reported and the queue goes on with the next one. KeyboardInterrupt stops the queue.
+    Jobs added without an estimate are estimated once, by estimate_jobs(), at the start of run(). Printing the queue only reads these estimates.
+    ex: queue = Scan_queue(lab)
+        queue.add(exp_dds_rabi, rabi_params, estimate=20*60)
+        queue.add(exp_dds_t1, t1_params, order="snake", repeats=10)
+        queue.run()
+    """
+    def __init__(self, lab, setup=None):
+        """
+        Initialize an empty queue.
+        
+        - lab: Lab instance with required instruments connected. Shared by every job.
+        - setup: Function called as setup(lab) once, before the first job. For setup shared by every job, such as warming up a laser.
+        """
+        self.lab = lab
+        self.setup = setup
+        ## Each job is a dictionary with keys experiment, params, options, estimate, estimated, status, ID, duration and error.
+        self.jobs = []
+        return
+        
+    def __str__(self):
+        """String representation of the queue, one job per line."""
+        if self.jobs==[]:
+            return "Empty scan queue."
+        string = "Scan queue:\n"
+        for n, job in enumerate(self.jobs):
+            string += "   "+str(n+1)+". "+job["experiment"].__name__+": "+job["status"]
+            if job["ID"] is not None:
+                string += ", ID "+job["ID"]
+            if job["duration"] is not None:
+                string += ", took "+nfu.format_duration(job["duration"])
+            elif job["estimate"] is not None:
+                string += ", about "+nfu.format_duration(job["estimate"])
+            if job["error"] is not None:
+                string += " ("+job["error"]+")"
+            string += "\n"
+        if any([job["status"] in ["pending", "running"] for job in self.jobs]):
+            eta = self.get_eta()
+            if eta is not None:
+                string += "ETA: "+eta.strftime("%Y-%b-%d %H:%M")
+            else:
+                string += "ETA: unknown"
+        return string
+        
+    def add(self, experiment, params, estimate=None, **options):
+        """
+        Add a job at the end of the queue.
+        
+        - experiment: Experiment module, as for scan().
+        - params: Params instance of this job. Use a different Params instance for each job.
+        - estimate: Expected duration of the job (s), for the ETA of the queue. If None, it's estimated by a dry run (see estimate_jobs()).
+        - **options: Keyword arguments passed to scan(), such as fig, order or repeats. quiet is always True.
+        """
+        options.pop("quiet", None)
+        self.jobs.append({"experiment":experiment, "params":params, "options":options, "estimate":estimate, "estimated":estimate is not None, "status":"pending", "ID":None, "duration":None, "error":None})
+        return
+        
+    def estimate_jobs(self):
+        """
+        Estimate the duration of each pending job which has no estimate yet, once, by a dry run (see nfu.estimate_duration()). Called by run() before the first job.
+        The dry runs reset the lab state (see nfu.get_ready()), so they are never done between jobs. Errors will be printed, not raised.
+        experiment.pre_scan() isn't called for the dry run, so it may fail for experiments that need it.
+        """
+        for job in self.jobs:
+            if job["estimated"] or job["status"]!="pending":
+                continue
+            job["estimated"] = True
+            options = job["options"]
+            try:
+                nfu.get_ready(self.lab, job["params"])
+                plan = nfu.sweep_plan(job["params"], options.get("order", "ascending"), options.get("seed"), None, options.get("budget"))
+                plan["hardware_inner"] = options.get("hardware_inner", False)
+                estimate = nfu.estimate_duration(self.lab, job["params"], job["experiment"], plan, options.get("repeats", 1))
+                if estimate is not None:
+                    job["estimate"] = estimate["duration"]
+            except:
+                print("Job "+job["experiment"].__name__+" could not be estimated. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+        return
+        
+    def get_eta(self):
+        """Return the expected end of the queue as a datetime, or None if the duration of a pending job is unknown. Only reads the estimates, see estimate_jobs()."""
+        remaining = 0
+        for job in self.jobs:
+            if job["status"] in ["pending", "running"]:
+                if job["estimate"] is None:
+                    return None
+                remaining += job["estimate"]
+        return datetime.datetime.now()+datetime.timedelta(seconds=remaining)
+        
+    def run(self):
+        """
+        Run every pending job in order. The setup function is called first, once, then jobs without an estimate are estimated (see estimate_jobs()).
+        Print the state of the queue before each job and at the end.
+        """
+        ## Import here, main imports this module.
+        from . import main
+        if self.setup is not None:
+            self.setup(self.lab)
+            ## Don't run it again if the queue is extended and run again.
+            self.setup = None
+        self.estimate_jobs()
+        for n, job in enumerate(self.jobs):
+            if job["status"]!="pending":
+                continue
+            job["status"] = "running"
+            print("\n############################################\n Job "+str(n+1)+" of "+str(len(self.jobs))+"\n############################################")
+            print(self)
+            ## ID that scan() will give to this job.
+            ID = nfu.pad_ID(nfu.detect_experiment_ID())
+            started = timeit.default_timer()
+            try:
+                main.scan(self.lab, job["params"], job["experiment"], quiet=True, **job["options"])
+                job["status"] = "done"
+            except KeyboardInterrupt:
+                job["status"] = "aborted"
+                job["error"] = "Experiment aborted."
+                print("Scan queue stopped.")
+                raise
+            except:
+                ## Keep going with the next job.
+                job["status"] = "failed"
+                job["error"] = main.error_manager(as_string=True, all=True)
+                print("Job "+str(n+1)+" failed: "+job["error"])
+            finally:
+                job["duration"] = timeit.default_timer()-started
+                if nfu.lastID()==ID:
+                    ## Files were saved under this ID. A job that fails before it starts has none.
+                    job["ID"] = ID
+        print(self)
+        return
@@ -33,6 +33,9 @@ class Awg_M8190A(Instrument):
     1) Good luck.*
     *Seriously, contact Keysight (or Kevin Morse if he's still around) to help you with that. The chassis drivers need to be up to date as well as the actual instrument drivers.
     """
+    ## Instructions only query the AWG. Segments are only written by load_memory(). See nfu.sweep_pipelined().
+    pipeline_safe = True
+    
     def __init__(self, name, parent, resource):
         """
         Inherit from Instrument. 
@@ -74,6 +77,13 @@ class Awg_M8190A(Instrument):
         self.error_message = (vt.ViChar*256)()
         ## Reset show_warning attributes to True.
         self.reset_warnings()
+        ## For each channel, True if the sequencer was seen running since the last self.initiate_generation().
+        self.seen_running = {}
+        ## Key of the sequence held in AWG memory (see self.memory_key()). None if unknown.
+        self.loaded_key = None
+        ## Sample rate and amplitude of each channel, as last set or read, so self.memory_key() doesn't query the AWG at every point. None or missing if unknown.
+        self.sample_rate_cache = None
+        self.amplitude_cache = {}
         ## Initialize instrument drivers.
         current_dir = os.getcwd()
         status = self.AgM8190.init(resource, True, True, ct.byref(self.session))
@@ -217,6 +227,7 @@ class Awg_M8190A(Instrument):
             amp = self.get_ViReal64_attribute(channel, self.AgM8190.ATTR_ARBITRARY_DC_AMPLITUDE)
         elif channel_route=="AC":
             amp = self.get_ViReal64_attribute(channel, self.AgM8190.ATTR_ARBITRARY_AC_AMPLITUDE)
+        self.amplitude_cache[channel] = amp
         return amp
 
     def get_arm_mode(self, channel=None):
@@ -297,6 +308,7 @@ class Awg_M8190A(Instrument):
     def get_sample_rate(self):
         """Return current sample rate (Sa/s)."""
         sample_rate = self.get_ViReal64_attribute("", self.AgM8190.ATTR_ARB_SAMPLE_RATE)
+        self.sample_rate_cache = sample_rate
         return sample_rate
 
     def get_sample_clock_source_route(self, channel=None):
@@ -311,6 +323,13 @@ class Awg_M8190A(Instrument):
             route = "external"
         return route
 
+    def get_sequencer_state(self, channel=None):
+        """Return the execution state of the sequencer ('idle', 'waiting for trigger', 'running' or 'waiting for advancement')."""
+        channel = self.channel_format(channel)
+        result = self.get_ViInt32_attribute(channel, self.AgM8190.ATTR_SEQUENCE_STATE)
+        ## Bits 0 to 18 are the index of the sequence table entry being played, bits 19 and 20 are the execution state.
+        return ("idle", "waiting for trigger", "running", "waiting for advancement")[(result >> 19) & 0b11]
+
     def get_trigger_mode(self, channel=None):
         """Return current trigger mode ('auto' or 'trig')."""
         channel = self.channel_format(channel)
@@ -350,15 +369,60 @@ class Awg_M8190A(Instrument):
         self.check_error(status)
         ## It's required to let some time to initiate. This time is related to trigger latency according to Keysight. I put 2 times the latency just to be sure.
         time.sleep(2*10240/self.get_sample_rate()) 
+        ## The sequencer waits for its trigger, it was not seen running yet (see self.is_done()).
+        self.seen_running[channel] = False
         return
 
-    def load_memory(self, is_cw=False):
+    def is_done(self):
+        """
+        Return True if the sequencer of each channel from self.channels_to_load went back to idle or to waiting for trigger after running, False if it's still running.
+        Return None if a sequencer was not seen running since self.initiate_generation(), because a sequence that is over can't be told apart from one that was not triggered yet.
+        """
+        done = True
+        for channel in self.channels_to_load:
+            channel = str(channel)
+            state = self.get_sequencer_state(channel=channel)
+            if state in ("running", "waiting for advancement"):
+                self.seen_running[channel] = True
+                done = False
+            elif not self.seen_running.get(channel, False):
+                return None
+        return done
+
+    def compile_memory(self, is_cw=False):
+        """
+        For each channel specified in self.channels_to_load with instructions, convert the instructions from self.instructions to segments using self.preprocess().
+        Return a dictionary with channels as keys and segments as values, ready for self.load_memory(compiled=...).
+        Does not change AWG memory, so it can run while the AWG is playing.
+        """
+        compiled = {}
+        for channel in self.channels_to_load:
+            channel = str(channel)
+            if [inst for inst in self.instructions if inst[1]==channel]==[]:
+                continue
+            segments = {}
+            self.preprocess(channel, segments, is_cw)
+            compiled[channel] = segments
+        return compiled
+
+    def load_memory(self, is_cw=False, compiled=None, key=None):
         """
         For each channel specified in self.channels_to_load:
             Convert the instructions from self.instructions to segments using self.preprocess().
             Load each segment into AWG memory.
         By default, use the scenario sequencing mode. If is_cw is True, use arbitrary sequencing mode instead (single segment mode).
+        
+        - compiled: Result of self.compile_memory() for the current instructions. Channels found in compiled are not preprocessed again.
+        - key: Result of self.memory_key() for the current instructions. If AWG memory already holds the sequence with this key, only generation is aborted.
         """
+        if key is not None and key==self.loaded_key and not is_cw:
+            ## AWG memory already holds this sequence. Abort generation so that it can be initiated again.
+            for channel in self.channels_to_load:
+                if self.get_trigger_mode(channel=channel)!="auto":
+                    self.abort_generation(channel=channel)
+            return
+        ## Memory is unknown until loading is over.
+        self.loaded_key = None
         for channel in self.channels_to_load:
             channel = str(channel)
             if self.get_trigger_mode(channel=channel)=="auto":
@@ -387,8 +451,11 @@ class Awg_M8190A(Instrument):
                     continue
                 
             ## Preprocess: Merge pulses and markers into blocks, detect delays.
-            segments={}
-            self.preprocess(channel, segments, is_cw)
+            if compiled is not None and channel in compiled:
+                segments = compiled[channel]
+            else:
+                segments={}
+                self.preprocess(channel, segments, is_cw)
                     
             ## Check if number of New sequence match the number of End sequence.
             if not is_cw:
@@ -499,7 +566,8 @@ class Awg_M8190A(Instrument):
             status = self.AgM8190.SetAttributeViBoolean(self.session, channel, self.AgM8190.ATTR_OUTPUT_ENABLED, True)
             self.check_error(status)
 
-
+        if not is_cw:
+            self.loaded_key = key
         return
 
 
@@ -557,6 +625,17 @@ class Awg_M8190A(Instrument):
 
         return
 
+    def memory_key(self):
+        """
+        Return a digest of everything self.compile_memory() and self.load_memory() depend on: instructions, total duration, channels to load, options, sample rate and amplitudes.
+        Points with the same key compile to the same sequence. See nfu.compile_point().
+        The sample rate and amplitudes are taken from the cache kept by their setters and getters, so the AWG is only queried when they are unknown.
+        """
+        channels = [str(channel) for channel in self.channels_to_load]
+        amplitudes = [self.amplitude_cache[channel] if channel in self.amplitude_cache else self.get_amplitude(channel=channel) for channel in channels]
+        sample_rate = self.sample_rate_cache if self.sample_rate_cache is not None else self.get_sample_rate()
+        return nfu.digest([self.instructions, self.lab.total_duration, channels, self.adjust_trig_latency, sample_rate, amplitudes])
+
     def marker(self, channel=None):
         """Instruction to add a marker at current time cursor."""
         channel = self.channel_format(channel)
@@ -1066,6 +1145,9 @@ class Awg_M8190A(Instrument):
                     self.set_ViReal64_attribute(channel, self.AgM8190.ATTR_ARBITRARY_AC_AMPLITUDE, amp)
                 else:
                     raise AgM8190Error("Channel "+channel+" amplitude is not in the permitted range: "+nfu.auto_unit(min_amp, unit="V")+" to "+nfu.auto_unit(max_amp, unit="V")+".")
+            ## Coupled channels may follow, they are read again when needed.
+            self.amplitude_cache.clear()
+            self.amplitude_cache[channel] = amp
             print("awg channel "+channel+" amplitude set to "+nfu.auto_unit(amp, unit="V")+".")
         return
 
@@ -1096,6 +1178,7 @@ class Awg_M8190A(Instrument):
                 self.set_ViInt32_attribute("", self.AgM8190.ATTR_INSTRUMENT_CHANNEL_COUPLING_ENABLED, self.AgM8190.VAL_CHANNEL_COUPLING_STATE_OFF)
             else:
                 raise AgM8190Error(str(query)+" is not a valid input.")
+            self.amplitude_cache.clear()
             print("awg channel coupling set to "+str(query)+".")
         return
 
@@ -1113,6 +1196,8 @@ class Awg_M8190A(Instrument):
                 self.set_ViInt32_attribute(channel, self.AgM8190.ATTR_OUTPUT_ROUTE, self.AgM8190.VAL_OUTPUT_ROUTE_DAC)
             else:
                 raise AgM8190Error(str(query)+" is not a valid input.")
+            ## Each route has its own amplitude.
+            self.amplitude_cache.pop(channel, None)
             print("awg channel "+channel+" route set to "+str(query)+".")
         return
 
@@ -1224,6 +1309,7 @@ class Awg_M8190A(Instrument):
                 raise AgM8190Error("Requested sample rate is higher than maximum allowed, "+nfu.auto_unit(max_sample_rate, "Hz")+".")
             else:
                 self.set_ViReal64_attribute("", self.AgM8190.ATTR_ARB_SAMPLE_RATE, rate)
+                self.sample_rate_cache = rate
                 print("awg sample rate set to "+nfu.auto_unit(rate, "Sa/s")+".")
         return
 
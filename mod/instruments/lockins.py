@@ -20,6 +20,9 @@ nfu = not_for_user
         
 class Lockin_SR844(Default_visa):
     """Class allowing to control a model 5210 lock-in amplifier."""
+    ## Kept by Lab.reconnect().
+    cached_settings = ("sensitivity", "time_constant")
+    
     def __init__(self, name, parent, visa_ID):
         """
         Inherit from Default_visa and open a VISA device handle.
@@ -28,6 +31,9 @@ class Lockin_SR844(Default_visa):
         - visa_ID: Connection address. 
         """
         Default_visa.__init__(self, name, parent, visa_ID) 
+        ## Last sensitivity (V) and time constant (s) set, None until set. See restore_settings().
+        self.sensitivity = None
+        self.time_constant = None
         print('connected to lock-in model SR844.')
         return
     
@@ -79,6 +85,15 @@ class Lockin_SR844(Default_visa):
         code = self.device_handle.query('SENS?').rstrip()
         return self.sensitivity_chart.get(str(int(code)), "failed")
         
+    def restore_settings(self, settings):
+        """Set back the cached settings, then send the last sensitivity and time constant set to the device. See Lab.reconnect()."""
+        Default_visa.restore_settings(self, settings)
+        if self.sensitivity is not None:
+            self.set_sensitivity(self.sensitivity)
+        if self.time_constant is not None:
+            self.set_time_constant(self.time_constant)
+        return
+        
     def set_time_constant(self, time_cst):
         """Set time constant. Input the requested time constant in seconds."""
         code = None
@@ -87,6 +102,7 @@ class Lockin_SR844(Default_visa):
                 code = key
         if code==None:
             raise Lockin5210Error("Requested time constant not available.")
+        self.time_constant = time_cst
         return self.device_handle.write('OFLT'+code)
 
     def set_sensitivity(self, sensitivity):
@@ -97,6 +113,7 @@ class Lockin_SR844(Default_visa):
                 code = key
         if code==None:
             raise Lockin5210Error("Requested sensitivity not available.")
+        self.sensitivity = sensitivity
         return self.device_handle.write('SENS'+code)
         
         
@@ -142,6 +159,9 @@ class Lockin_SR844(Default_visa):
         
 class Lockin_5210(Default_visa):
     """Class allowing to control a model 5210 lock-in amplifier."""
+    ## Kept by Lab.reconnect().
+    cached_settings = ("convert_reading", "sensitivity", "time_constant")
+    
     def __init__(self, name, parent, visa_ID):
         """
         Inherit from Default_visa and open a VISA device handle.
@@ -152,6 +172,9 @@ class Lockin_5210(Default_visa):
         Default_visa.__init__(self, name, parent, visa_ID) 
         ### Options ###
         self.convert_reading = False ## True is not fully tested.
+        ## Last sensitivity (V) and time constant (s) set, None until set. See restore_settings().
+        self.sensitivity = None
+        self.time_constant = None
         print('connected to lock-in model 5210.')
         return
     
@@ -217,6 +240,15 @@ class Lockin_5210(Default_visa):
         code = self.device_handle.query('SEN')
         return self.sensitivity_chart.get(str(int(code)), "failed")
         
+    def restore_settings(self, settings):
+        """Set back the cached settings, then send the last sensitivity and time constant set to the device. See Lab.reconnect()."""
+        Default_visa.restore_settings(self, settings)
+        if self.sensitivity is not None:
+            self.set_sensitivity(self.sensitivity)
+        if self.time_constant is not None:
+            self.set_time_constant(self.time_constant)
+        return
+        
     def set_time_constant(self, time_cst):
         """Set time constant. Input the requested time constant in seconds."""
         code = None
@@ -225,6 +257,7 @@ class Lockin_5210(Default_visa):
                 code = key
         if code==None:
             raise Lockin5210Error("Requested time constant not available.")
+        self.time_constant = time_cst
         return self.device_handle.write('TC '+code)
 
     def set_sensitivity(self, sensitivity):
@@ -235,6 +268,7 @@ class Lockin_5210(Default_visa):
                 code = key
         if code==None:
             raise Lockin5210Error("Requested sensitivity not available.")
+        self.sensitivity = sensitivity
         return self.device_handle.write('SEN '+code)
         
         
@@ -15,6 +15,7 @@ import matplotlib.pyplot as plt
 import importlib
 import time
 import textwrap
+import copy
 
 ## Homemade modules
 from ..classes import Instrument
@@ -29,6 +30,10 @@ class Pulse_blaster_DDSII300(Instrument):
     Installation procedure: 
     1) Install 64-bit spinapi drivers. http://www.spincore.com/support/spinapi/SpinAPI_Main.shtml
     """
+    ## Kept by Lab.reconnect(). Default pulses are loaded into the registers with the next sequence.
+    cached_settings = ("verbose", "adjust_trig_latency", "stop_at_end", "channels", "default_rf_channel", "default_delay", "default_length", "default_freq", "default_phase", "default_amp")
+    ## Instructions and registers are only programmed on the board by load_memory() and cw(). See nfu.sweep_pipelined().
+    pipeline_safe = True
 
     def __init__(self, name, parent):
         """
@@ -43,6 +48,7 @@ class Pulse_blaster_DDSII300(Instrument):
         self.verbose = False                    ## Print the status of each driver function call.
         self.adjust_trig_latency = False        ## Adjust first duration to remove the 8 clock cycles trigger latency (needs a time buffer at the start of sequence).
         self.ref_freq = 75*MHz                  ## Recommended to run at 75 MHz
+        self.stop_at_end = False                ## End the loaded sequence with a STOP opcode instead of looping zeros forever. Required by self.is_done().
         ##-------------------------------------------------------------------------------------------------##
         ## Inherit from Instrument
         Instrument.__init__(self, name, parent, use_memory=True)
@@ -50,10 +56,14 @@ class Pulse_blaster_DDSII300(Instrument):
         self.reset_warnings()
         ## spinapi wrapper
         self.spinapi = importlib.import_module("mod.instruments.wrappers.dll_spinapi") ## dll wrapper
+        ## Key of the sequence held in board memory (see self.memory_key()). None if unknown.
+        self.loaded_key = None
         ## Dictionary with channel names as keys and their respective channel as values.
         self.channels = {}
         ## Dictionary with registers for RF1 (DDS0) and RF2 (DDS1) (leave empty at this point)
         self.registers = {'RF1':{'freq':[], 'phase':[], 'amp':[]}, 'RF2':{'freq':[], 'phase':[], 'amp':[]}}
+        ## Registers programmed on the board (see self.program_registers()). None if unknown.
+        self.loaded_registers = None
         ## Set default rf_channel (to use when rf_channel is not specified in a function call).
         self.default_rf_channel = 'RF1'
         ## Default values are dictionaries with values defined below in set_default_pulse. Key of the dictionary is the channel.
@@ -73,6 +83,7 @@ class Pulse_blaster_DDSII300(Instrument):
         self.spinapi.pb_core_clock(self.ref_freq/1e6)
         ## Clear registers and add default pulses to registers.
         self.reset_registers()
+        self.program_registers()
         ## Turn all channels off.
         self.all_channels_off()
         print('connected to PulseBlasterDDSII300.')
@@ -200,39 +211,27 @@ class Pulse_blaster_DDSII300(Instrument):
     def clear_freq_register(self, rf_channel=None):
         """
         Empties the frequency register of specified rf channel.
+        The board is programmed by self.load_memory() or self.cw() (see self.program_registers()).
         """
         rf_channel = self.rf_channel_format(rf_channel)
-        status = self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        self.check_error(status)
         self.registers[rf_channel]['freq'] = []
-        status = self.spinapi.pb_start_programming(self.spinapi.FREQ_REGS)
-        self.check_error(status)
-        status = self.spinapi.pb_stop_programming()
-        self.check_error(status)
         return
         
     def clear_phase_register(self, rf_channel=None):
         """
         Empties the phase register of specified rf channel.
+        The board is programmed by self.load_memory() or self.cw() (see self.program_registers()).
         """
         rf_channel = self.rf_channel_format(rf_channel)
-        status = self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        self.check_error(status)
         self.registers[rf_channel]['phase'] = []
-        status = self.spinapi.pb_start_programming(self.spinapi.TX_PHASE_REGS)
-        self.check_error(status)
-        status = self.spinapi.pb_stop_programming()
-        self.check_error(status)
         return
         
     def clear_amp_register(self, rf_channel=None):
         """
         Empties the amplitude register of specified rf channel.
-        Actually doesn't clear anything on the board (amplitude register works differently than phase and frequency registers), but makes LabMaster think it's empty, so it's equivalent.
+        The board is programmed by self.load_memory() or self.cw() (see self.program_registers()).
         """
         rf_channel = self.rf_channel_format(rf_channel)
-        status = self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        self.check_error(status)
         self.registers[rf_channel]['amp'] = []
         return
     
@@ -249,7 +248,12 @@ class Pulse_blaster_DDSII300(Instrument):
     def reset_registers(self):
         """
         Clear registers and add default pulses to registers.
+        Does not talk to the board, so it can be called in experiment.sequence().
+        In a program with one shot per point (see main.scan(hardware_inner=True)), only the first shot resets the registers. 
+        Later shots add theirs, so that the instructions of earlier shots keep pointing to their own registers.
         """
+        if self.lab.shot not in (None, 0):
+            return
         self.clear_registers()
         for rf_channel in ('RF1','RF2'):
             self.add_freq_to_register(rf_channel, self.default_freq[rf_channel])
@@ -267,19 +271,8 @@ class Pulse_blaster_DDSII300(Instrument):
             raise PulseBlasterDDSII300Error('Frequency added to register should be between 5 kHz and 100 MHz.')
         if len(self.registers[rf_channel]['freq']) > 15:
             raise PulseBlasterDDSII300Error('Maximum number of frequency registers reached ('+rf_channel+').')
-        ## Select RF channel for programming registers
-        self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        ## Update registers dictionary
+        ## Update registers dictionary. The board is programmed by self.load_memory() or self.cw().
         self.registers[rf_channel]['freq'].append(freq_to_add)
-        ## Program frequency register
-        status = self.spinapi.pb_start_programming(self.spinapi.FREQ_REGS)
-        self.check_error(status)
-        for freq in self.registers[rf_channel]['freq']:
-            ## pb_set_freq uses MHz
-            status = self.spinapi.pb_set_freq(freq*1e-6)
-            self.check_error(status)
-        status = self.spinapi.pb_stop_programming()
-        self.check_error(status)
         return
    
     def add_phase_to_register(self, rf_channel, phase_to_add):
@@ -292,19 +285,8 @@ class Pulse_blaster_DDSII300(Instrument):
             raise PulseBlasterDDSII300Error('Phase added to register should be between 0 and 360.')
         if len(self.registers[rf_channel]['phase']) > 7:
             raise PulseBlasterDDSII300Error('Maximum number of phase registers reached ('+rf_channel+').')
-        ## Select RF channel for programming registers
-        self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        ## Update registers dictionary
+        ## Update registers dictionary. The board is programmed by self.load_memory() or self.cw().
         self.registers[rf_channel]['phase'].append(phase_to_add)
-        status = self.spinapi.pb_start_programming(self.spinapi.TX_PHASE_REGS)
-        ## Program phase register
-        self.check_error(status)
-        for phase in self.registers[rf_channel]['phase']:
-            ## pb_set_phase uses degrees
-            status = self.spinapi.pb_set_phase(phase)
-            self.check_error(status)
-        status = self.spinapi.pb_stop_programming()
-        self.check_error(status)
         return
         
     def add_amp_to_register(self, rf_channel, amp_to_add):
@@ -317,14 +299,50 @@ class Pulse_blaster_DDSII300(Instrument):
             raise PulseBlasterDDSII300Error('Amplitude added to register should be between 0.0 and 1.0.')
         if len(self.registers[rf_channel]['amp']) > 3:
             raise PulseBlasterDDSII300Error('Maximum number of amplitude registers reached ('+rf_channel+').')
-        ## Select RF channel for programming registers
-        self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
-        ## Update registers dictionary
+        ## Update registers dictionary. The board is programmed by self.load_memory() or self.cw().
         self.registers[rf_channel]['amp'].append(amp_to_add)
-        ## Program frequency register. For some reason it works differently than frequency and phase programming (there is no need for pb_start_programming and pb_stop_programming function calls.
-        register_address = len(self.registers[rf_channel]['amp']) - 1
-        status = self.spinapi.pb_set_amp(amp_to_add, register_address)
-        self.check_error(status)
+        return
+        
+    def program_registers(self, registers=None):
+        """
+        Program the frequency, phase and amplitude registers of both rf channels on the board. Skipped if the board already holds them.
+        Called by self.load_memory() and self.cw(), so that registers filled during experiment.sequence() never touch a board that is playing a sequence.
+        
+        - registers: Dictionary shaped like self.registers. Default is self.registers.
+        """
+        if registers is None:
+            registers = self.registers
+        if registers==self.loaded_registers:
+            return
+        ## Registers are unknown until programming is over.
+        self.loaded_registers = None
+        for rf_channel in ('RF1','RF2'):
+            ## Select RF channel for programming registers
+            status = self.spinapi.pb_select_dds(self.rf_channel_str2int(rf_channel)-1)
+            self.check_error(status)
+            ## Program frequency register
+            status = self.spinapi.pb_start_programming(self.spinapi.FREQ_REGS)
+            self.check_error(status)
+            for freq in registers[rf_channel]['freq']:
+                ## pb_set_freq uses MHz
+                status = self.spinapi.pb_set_freq(freq*1e-6)
+                self.check_error(status)
+            status = self.spinapi.pb_stop_programming()
+            self.check_error(status)
+            ## Program phase register
+            status = self.spinapi.pb_start_programming(self.spinapi.TX_PHASE_REGS)
+            self.check_error(status)
+            for phase in registers[rf_channel]['phase']:
+                ## pb_set_phase uses degrees
+                status = self.spinapi.pb_set_phase(phase)
+                self.check_error(status)
+            status = self.spinapi.pb_stop_programming()
+            self.check_error(status)
+            ## Program amplitude register. For some reason it works differently than frequency and phase programming (there is no need for pb_start_programming and pb_stop_programming function calls.
+            for register_address, amp in enumerate(registers[rf_channel]['amp']):
+                status = self.spinapi.pb_set_amp(amp, register_address)
+                self.check_error(status)
+        self.loaded_registers = copy.deepcopy(registers)
         return
     
     def clear_channel_names(self):
@@ -366,6 +384,8 @@ class Pulse_blaster_DDSII300(Instrument):
         ## Start a PULSE_PROGRAM (usual stuff).
         status = self.spinapi.pb_start_programming(self.spinapi.PULSE_PROGRAM)
         self.check_error(status)
+        ## The sequence loaded by self.load_memory() is overwritten.
+        self.loaded_key = None
         ## Branch two instructions to loop zeros.
         self.flags = "1"*12
         start = self.spinapi.pb_inst_dds2(0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
@@ -391,6 +411,8 @@ class Pulse_blaster_DDSII300(Instrument):
         ## Start a PULSE_PROGRAM (usual stuff).
         status = self.spinapi.pb_start_programming(self.spinapi.PULSE_PROGRAM)
         self.check_error(status)
+        ## The sequence loaded by self.load_memory() is overwritten.
+        self.loaded_key = None
         ## Branch two instructions to loop zeros.
         self.flags = "0"*12
         start = self.spinapi.pb_inst_dds2(0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
@@ -476,12 +498,25 @@ class Pulse_blaster_DDSII300(Instrument):
         
         
         
-    def load_memory(self):
+    def compile_memory(self):
+        """
+        Return the instructions translated to Pulse Blaster language by self.preprocess(), with a copy of the registers they index, ready for self.load_memory(compiled=...).
+        Does not talk to the board, so it can run while the board is busy. Return None if no instructions are detected.
+        """
+        if self.instructions==[]:
+            return None
+        return {"registers":copy.deepcopy(self.registers), "program":self.preprocess()}
+        
+    def load_memory(self, compiled=None, key=None):
         """
         Call self.preprocess() which translates instructions to Pulse Blaster language.
+        Program the registers used by the instructions (see self.program_registers()).
         Load PulseBlasterUSB memory using the spinapi.pb_inst_dds2() function.
         After the programmed sequence, all channels are looped to zero ad infinitum.
         
+        - compiled: Result of self.compile_memory() for the current instructions. If None, self.compile_memory() is called.
+        - key: Result of self.memory_key() for the current instructions. If the board already holds the sequence with this key, loading is skipped.
+        
         TODO: Add frequencies
         """
         if self.instructions==[]:
@@ -489,15 +524,23 @@ class Pulse_blaster_DDSII300(Instrument):
                 print("PulseBlasterDDS-II-300: No instructions detected. self.load_memory() skipped.")
                 self.show_warning_no_inst = False
             return
+        if key is not None and key==self.loaded_key:
+            ## The board already holds this sequence.
+            return
+        if compiled is None:
+            compiled = self.compile_memory()
+        ## Memory is unknown until programming is over.
+        self.loaded_key = None
         ## Stop previous generation.
         status = self.spinapi.pb_stop() 
         self.check_error(status)
+        self.program_registers(compiled["registers"])
         ## Start programming memory.
         status = self.spinapi.pb_start_programming(self.spinapi.PULSE_PROGRAM)
         self.check_error(status)
         
         ## Load results from self.preprocess() using spinapi.pb_inst_dds2 commands.
-        for TTL_params, RF1_params, RF2_params in self.preprocess():
+        for TTL_params, RF1_params, RF2_params in compiled["program"]:
             flags, opcode, data_field, duration = TTL_params
             status = self.spinapi.pb_inst_dds2(*RF1_params, \
                                                *RF2_params, \
@@ -510,17 +553,32 @@ class Pulse_blaster_DDSII300(Instrument):
                                           0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
                                           int(self.flags,2), self.spinapi.Inst.CONTINUE, 0, self.spinapi.ms)
         self.check_error(start)
-        status = self.spinapi.pb_inst_dds2(0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
-                                          0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
-                                          int(self.flags,2), self.spinapi.Inst.BRANCH, start, self.spinapi.ms)
+        if self.stop_at_end:
+            ## Stop, so that the board reports it's done (see self.is_done()).
+            status = self.spinapi.pb_inst_dds2(0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
+                                              0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
+                                              int(self.flags,2), self.spinapi.Inst.STOP, 0, self.spinapi.ms)
+        else:
+            ## Loop zeros ad infinitum.
+            status = self.spinapi.pb_inst_dds2(0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
+                                              0, 0, 0, self.spinapi.TX_DISABLE, self.spinapi.NO_PHASE_RESET, \
+                                              int(self.flags,2), self.spinapi.Inst.BRANCH, start, self.spinapi.ms)
         self.check_error(status)
         ## Stop programming memory.
         status = self.spinapi.pb_stop_programming()
         self.check_error(status)
+        self.loaded_key = key
         
         ## Waiting for pb.start() to be called.
         return
     
+    def memory_key(self):
+        """
+        Return a digest of everything self.compile_memory() and self.load_memory() depend on: instructions, total duration, registers and options.
+        Points with the same key compile to the same sequence. See nfu.compile_point().
+        """
+        return nfu.digest([self.instructions, self.lab.total_duration, self.registers, self.adjust_trig_latency, self.ref_freq, self.stop_at_end])
+        
     def loop_start(self, num_loops, ref, duration=0):
         """
         LOOP opcode.
@@ -870,10 +928,13 @@ class Pulse_blaster_DDSII300(Instrument):
             if not (amp in self.registers[rf_channel]['amp']):
                 self.add_amp_to_register(rf_channel, amp)
                 stop
+        self.program_registers()
         
         ## Start programming memory.
         status = self.spinapi.pb_start_programming(self.spinapi.PULSE_PROGRAM)
         self.check_error(status)
+        ## The sequence loaded by self.load_memory() is overwritten.
+        self.loaded_key = None
 
 
         if rf_channel=='BOTH':
@@ -945,20 +1006,38 @@ class Pulse_blaster_DDSII300(Instrument):
             self.keep_going()
         return
     
+    def get_status(self):
+        """
+        Return status of the PulseBlaster as a dictionary of booleans, with keys 'stopped', 'reset', 'running' and 'waiting'.
+        'reset' appears at times when it should be 'stopped' (bug).
+        """
+        code = self.spinapi.pb_read_status()
+        str_code = bin(code)[2:].zfill(4)
+        return {"stopped":str_code[-1]=='1', "reset":str_code[-2]=='1', "running":str_code[-3]=='1', "waiting":str_code[-4]=='1'}
+        
+    def is_done(self):
+        """
+        Return True if the loaded sequence is over, False if it's still running.
+        Return None if self.stop_at_end is False, because the sequence then loops zeros forever and never stops.
+        """
+        if not self.stop_at_end:
+            return None
+        status = self.get_status()
+        return (status["stopped"] or status["reset"]) and not (status["running"] or status["waiting"])
+    
     def read_status(self):
         """
         Reads status of the PulseBlaster. 
         Buggy.
         """
-        code = self.spinapi.pb_read_status()
-        str_code = bin(code)[2:].zfill(4)
-        if str_code[-1]=='1':
+        status = self.get_status()
+        if status["stopped"]:
             print('Stopped')
-        if str_code[-2]=='1':
+        if status["reset"]:
             print('Reset (or stopped? bug)') ## Appears at times when it should be Stopped. 
-        if str_code[-3]=='1':
+        if status["running"]:
             print('Running')
-        if str_code[-4]=='1':
+        if status["waiting"]:
             print('Waiting')
         return 
     
@@ -1060,6 +1139,10 @@ class Pulse_blaster_USB(Instrument):
     Installation procedure: 
     1) Install 32-bit spinapi drivers. http://www.spincore.com/support/spinapi/SpinAPI_Main.shtml
     """
+    ## Kept by Lab.reconnect().
+    cached_settings = ("verbose", "adjust_trig_latency", "channels")
+    ## Instructions are only programmed on the board by load_memory(). See nfu.sweep_pipelined().
+    pipeline_safe = True
 
     def __init__(self, name, parent):
         """
@@ -28,7 +28,13 @@ class USB_counter_CTR04(Instrument):
     First use procedure: 
     1) Install instaCal from Measurement Computing Corporation. http://www.mccdaq.com/daq-software/instacal.aspx
     2) Run inscal32.exe and detect the USB counter device.
+    
+    Buffered mode (see start_buffered()): the counters are sampled, then cleared, on each edge of the external scan clock, and every sample is read back in one transfer. 
+    With a clock pulse at the end of each shot, a program with many shots is read at once (see main.scan(hardware_inner=True)).
     """
+    ## Kept by Lab.reconnect().
+    cached_settings = ("verbose", "buffered_rate")
+    
     def __init__(self, name, parent, board_num):
         """
         Inherit from Instrument class.
@@ -40,11 +46,15 @@ class USB_counter_CTR04(Instrument):
         """
         ##----------------------------------------------- OPTIONS -----------------------------------------------##
         self.verbose = False
+        self.buffered_rate = 1000       ## Expected rate of the external scan clock (Hz), required by the driver in buffered mode.
         ##-------------------------------------------------------------------------------------------------------##
         Instrument.__init__(self, name, parent)
         self.cbw64 = importlib.import_module("mod.instruments.wrappers.dll_cbw64")
         self.error_msg = ct.create_string_buffer(1000)
         self.board_num = board_num
+        ## Memory handle and settings of the buffered scan in progress. See start_buffered().
+        self.buffer = None
+        self.buffered = None
         for counter_num in (0,1,2):
             ## counter 0 is bin A
             ## counter 1 is bin B
@@ -57,6 +67,7 @@ class USB_counter_CTR04(Instrument):
     
     def abort(self):
         """To be executed when scan raises on error (Ctrl-C included)."""
+        self.stop_buffered()
         return
     
     def check_status(self, status):
@@ -85,6 +96,87 @@ class USB_counter_CTR04(Instrument):
         self.check_status(status)
         return value.value
     
+    def start_buffered(self, num_shots, first_counter=0, last_counter=1):
+        """
+        Start a buffered scan of the specified counters in the background, for num_shots samples of each counter.
+        Each counter is gated by its gate input, and sampled then cleared on each edge of the external scan clock: sample n holds the counts of shot n.
+        Read the samples with read_buffered().
+        - num_shots: Number of scan clock edges expected.
+        - first_counter, last_counter: Range of counters sampled (0 is bin A, 1 is bin B).
+        """
+        self.stop_buffered()
+        gating_on = 0x10
+        clear_on_read = 0x1
+        for counter_num in range(first_counter, last_counter+1):
+            status = self.cbw64.cbCConfigScan(self.board_num, counter_num, gating_on|clear_on_read, 16, 0, 0, 0, counter_num)
+            self.check_status(status)
+            self.clear(counter_num)
+        count = num_shots*(last_counter-first_counter+1)
+        self.buffer = self.cbw64.cbWinBufAlloc32(count)
+        if not self.buffer:
+            self.buffer = None
+            raise USBCounterError("Failed to allocate a buffer of "+str(count)+" samples.")
+        self.buffered = (num_shots, first_counter, last_counter)
+        rate = ct.c_long(self.buffered_rate)
+        background = 0x1
+        ext_clock = 0x4
+        status = self.cbw64.cbCInScan(self.board_num, first_counter, last_counter, count, ct.byref(rate), ct.c_void_p(self.buffer), background|ext_clock)
+        self.check_status(status)
+        return
+        
+    def read_buffered(self, timeout=1*s):
+        """
+        Wait until the buffered scan started by start_buffered() has all its samples, then stop it.
+        Return an array of counts with one row per shot and one column per counter.
+        - timeout: Time to wait for missing samples (s). A USBCounterError is raised after that.
+        """
+        if self.buffered is None:
+            raise USBCounterError("No buffered scan was started. See start_buffered().")
+        num_shots, first_counter, last_counter = self.buffered
+        num_counters = last_counter-first_counter+1
+        count = num_shots*num_counters
+        ctr_function = 5
+        running = ct.c_short()
+        cur_count = ct.c_long()
+        cur_index = ct.c_long()
+        deadline = time.time()+timeout
+        while True:
+            status = self.cbw64.cbGetStatus(self.board_num, ct.byref(running), ct.byref(cur_count), ct.byref(cur_index), ctr_function)
+            self.check_status(status)
+            if cur_count.value >= count or running.value==0:
+                break
+            if time.time() > deadline:
+                self.stop_buffered()
+                raise USBCounterError("Buffered scan timed out with "+str(cur_count.value)+" of "+str(count)+" samples. Is the scan clock pulsed once per shot?")
+            time.sleep(1*ms)
+        if cur_count.value < count:
+            self.stop_buffered()
+            raise USBCounterError("Buffered scan stopped with "+str(cur_count.value)+" of "+str(count)+" samples.")
+        values = (ct.c_ulong*count)()
+        status = self.cbw64.cbWinBufToArray32(ct.c_void_p(self.buffer), values, 0, count)
+        self.check_status(status)
+        self.stop_buffered()
+        return np.array(values, dtype=np.int64).reshape(num_shots, num_counters)
+        
+    def stop_buffered(self):
+        """Stop the buffered scan started by start_buffered(), if any, free its buffer and configure the counters for read() again."""
+        if self.buffered is None:
+            return
+        num_shots, first_counter, last_counter = self.buffered
+        self.buffered = None
+        ctr_function = 5
+        try:
+            status = self.cbw64.cbStopBackground(self.board_num, ctr_function)
+            self.check_status(status)
+        finally:
+            if self.buffer is not None:
+                self.cbw64.cbWinBufFree(ct.c_void_p(self.buffer))
+                self.buffer = None
+            for counter_num in range(first_counter, last_counter+1):
+                status = self.cbw64.cbCConfigScan(self.board_num, counter_num, 0x10, 16, 0, 0, 0, counter_num)
+                self.check_status(status)
+        return
+        
     def initiate_timer(self, freq):
         timer_num = 0
         duty_cycle = 0.5
@@ -97,6 +97,72 @@ dll.cbGetErrMsg.argtype = (c_int,
                            ARRAY(c_char)
                            )
 
+
+def cbCInScan(*args):
+    """
+    Scans a range of scan counter channels, and stores the samples in an array.
+    With the BACKGROUND option, the function returns right away and the scan runs in the background. See cbGetStatus().
+    """
+    return dll.cbCInScan(*args)
+dll.cbCInScan.restype = c_int # Error code
+dll.cbCInScan.argtype = (c_int, # BoardNum
+                         c_int, # FirstCtr
+                         c_int, # LastCtr
+                         c_long, # Count
+                         POINTER(c_long), # Rate
+                         c_void_p, # MemHandle
+                         c_int # Options
+                         )
+
+
+def cbGetStatus(*args):
+    """Returns the status of a background operation, with the number of samples collected so far."""
+    return dll.cbGetStatus(*args)
+dll.cbGetStatus.restype = c_int # Error code
+dll.cbGetStatus.argtype = (c_int, # BoardNum
+                           POINTER(c_short), # Status (RUNNING = 1, IDLE = 0)
+                           POINTER(c_long), # CurCount
+                           POINTER(c_long), # CurIndex
+                           c_int # FunctionType (CTRFUNCTION = 5)
+                           )
+
+
+def cbStopBackground(*args):
+    """Stops a background operation started with the BACKGROUND option."""
+    return dll.cbStopBackground(*args)
+dll.cbStopBackground.restype = c_int # Error code
+dll.cbStopBackground.argtype = (c_int, # BoardNum
+                                c_int # FunctionType (CTRFUNCTION = 5)
+                                )
+
+
+def cbWinBufAlloc32(*args):
+    """Allocates a Windows global memory buffer for 32-bit samples, and returns its handle (0 on failure)."""
+    return dll.cbWinBufAlloc32(*args)
+dll.cbWinBufAlloc32.restype = c_void_p # MemHandle
+dll.cbWinBufAlloc32.argtype = (c_long, # NumPoints
+                               )
+
+
+def cbWinBufFree(*args):
+    """Frees a Windows global memory buffer allocated with cbWinBufAlloc32()."""
+    return dll.cbWinBufFree(*args)
+dll.cbWinBufFree.restype = c_int # Error code
+dll.cbWinBufFree.argtype = (c_void_p, # MemHandle
+                            )
+
+
+def cbWinBufToArray32(*args):
+    """Copies 32-bit samples from a Windows global memory buffer to an array."""
+    return dll.cbWinBufToArray32(*args)
+dll.cbWinBufToArray32.restype = c_int # Error code
+dll.cbWinBufToArray32.argtype = (c_void_p, # MemHandle
+                                 POINTER(c_ulong), # DataArray
+                                 c_long, # FirstPoint
+                                 c_long # Count
+                                 )
+
+
                                    
 # def cbACalibrateData(*args):
     # return dll.cbACalibrateData(*args)
@@ -257,12 +323,6 @@ dll.cbGetErrMsg.argtype = (c_int,
 # dll.cbCIn64.argtype = (
                                # )
 
-# def cbCInScan(*args):
-    # return dll.cbCInScan(*args)
-# dll.cbCInScan.restype = None
-# dll.cbCInScan.argtype = (
-                                 # )
-
 # def cbClaimNetworkDevice(*args):
     # return dll.cbClaimNetworkDevice(*args)
 # dll.cbClaimNetworkDevice.restype = None
@@ -570,12 +630,6 @@ dll.cbGetErrMsg.argtype = (c_int,
 # dll.cbGetSignal.argtype = (
                                    # )
 
-# def cbGetStatus(*args):
-    # return dll.cbGetStatus(*args)
-# dll.cbGetStatus.restype = None
-# dll.cbGetStatus.argtype = (
-                                   # )
-
 # def cbGetTCValues(*args):
     # return dll.cbGetTCValues(*args)
 # dll.cbGetTCValues.restype = None
@@ -828,12 +882,6 @@ dll.cbGetErrMsg.argtype = (c_int,
 # dll.cbSetTrigger.argtype = (
                                     # )
 
-# def cbStopBackground(*args):
-    # return dll.cbStopBackground(*args)
-# dll.cbStopBackground.restype = None
-# dll.cbStopBackground.argtype = (
-                                        # )
-
 # def cbStopIOBackground(*args):
     # return dll.cbStopIOBackground(*args)
 # dll.cbStopIOBackground.restype = None
@@ -918,24 +966,12 @@ dll.cbGetErrMsg.argtype = (c_int,
 # dll.cbWinBufAlloc.argtype = (
                                      # )
 
-# def cbWinBufAlloc32(*args):
-    # return dll.cbWinBufAlloc32(*args)
-# dll.cbWinBufAlloc32.restype = None
-# dll.cbWinBufAlloc32.argtype = (
-                                       # )
-
 # def cbWinBufAlloc64(*args):
     # return dll.cbWinBufAlloc64(*args)
 # dll.cbWinBufAlloc64.restype = None
 # dll.cbWinBufAlloc64.argtype = (
                                        # )
 
-# def cbWinBufFree(*args):
-    # return dll.cbWinBufFree(*args)
-# dll.cbWinBufFree.restype = None
-# dll.cbWinBufFree.argtype = (
-                                    # )
-
 # def cbWinBufFromEngUnits(*args):
     # return dll.cbWinBufFromEngUnits(*args)
 # dll.cbWinBufFromEngUnits.restype = None
@@ -948,12 +984,6 @@ dll.cbGetErrMsg.argtype = (c_int,
 # dll.cbWinBufToArray.argtype = (
                                        # )
 
-# def cbWinBufToArray32(*args):
-    # return dll.cbWinBufToArray32(*args)
-# dll.cbWinBufToArray32.restype = None
-# dll.cbWinBufToArray32.argtype = (
-                                         # )
-
 # def cbWinBufToArray64(*args):
     # return dll.cbWinBufToArray64(*args)
 # dll.cbWinBufToArray64.restype = None
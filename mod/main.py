@@ -14,6 +14,7 @@ import time             ## Pause script with time.sleep
 import timeit           ## Better timer than time
 import datetime         ## Includes datetime objects to handle dates.
 import importlib        ## More flexible imports
+import copy             ## Deep copies of python objects
 import visa             ## Control visa instruments
 import textwrap         ## Auto format documentation strings
 import types            ## better type handling
@@ -33,13 +34,16 @@ from . import instruments
 from . import available_instruments
 
 ## Import useful objects to user from other modules
-from .classes import Lab, Params
+from .classes import Lab, Params, Scan_queue, Lazy_range
 from .not_for_user import LabMasterError, today, lastID, auto_unit, saving_folders
 from .units import *
 from pydoc import help
 
+## Saves the files of finished scans in a worker thread. See run_sweep() and flush().
+writer = classes.Background_writer()
+
     
-def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True):
+def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True, pipeline=False, order="ascending", seed=None, nesting="propose", budget=None, repeats=1, keep_shots=0, min_repeats=None, target_error=None, target_snr=None, memmap=False, hardware_inner=False, deadline=None):
     """
     The holy grail of LabMaster.
     Scan parameters value attribute in the order imposed by their sweep_dim.
@@ -48,10 +52,42 @@ def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True):
 
     - lab: Lab instance with required instruments connected.
     - params: Params instance with required parameters.
-    - experiment: Module that will rule what is going on during experiment.
+    - experiment: Module that will rule what is going on during experiment. 
+                  It can declare the values returned by get_data in a DATA_SCHEMA, to get a compact structured data array (see nfu.data_dtype()).
     - fig: Give a matplotlib figure object to plot a live result of the scan.
     - quiet: If True, won't ask user if everything is ok. Enable this for overnight runs or if you are overconfident.
     - update_plot: If a figure object is given by the fig argument, update_plot=False will update the figure only once, at the end of the scan.
+    - pipeline: If True, compile the next point while the current one is running (see nfu.sweep_pipelined()). 
+                experiment.sequence() must then only depend on params, not on data or on the result of the previous point.
+                Every memory instrument must be pipeline_safe (see classes.Instrument).
+    - order: Order in which points are visited: "ascending", "snake", "interleaved", "random" or "adaptive" (see nfu.sweep_plan()). 
+             The data array is the same whatever the order. Use "snake" when a setter is slow to make large moves.
+             "adaptive" measures only budget points, where the signal changes the most (see nfu.sweep_adaptive()). Other points stay NaN. 1D and 2D scans only.
+    - seed: Seed of the "random" order. If None, a seed is drawn. It is saved in the sweep file either way.
+    - nesting: Which sweep_dim is the outer loop and which is the inner loop, based on the time spent changing each parameter value (see nfu.change_costs()). 
+               The data array and the sweep_dim numbering are the same whatever the nesting.
+               "propose": Keep the sweep_dim order, but print the nesting that would minimize the time spent changing parameter values.
+               "apply": Use the nesting that minimizes the time spent changing parameter values.
+               A list of sweep_dims from the outer loop to the inner loop, ex: [2, 1, 3].
+    - budget: Maximum number of points measured by the "adaptive" order.
+    - repeats: Number of shots at each point. The data array holds the mean, and the variance is saved as well (see classes.Running_stats). 
+               Memory is loaded once per point, so experiment.sequence() runs once per point.
+    - keep_shots: Number of raw shots kept for each point (the last ones), saved under 'SHOTS'. 0 keeps none.
+    - target_error, target_snr: Stop the shots of a point once the standard error of its signal (first value returned by get_data) is target_error or lower, 
+                                or once its signal to noise ratio is target_snr or higher. repeats is then the maximum number of shots, at least 2.
+                                The number of shots at each point is saved under 'COUNT'.
+    - min_repeats: Minimum number of shots at each point before a target can stop it. Default is 2.
+    - memmap: If True, the data array is a memory map of a file in the sweep/ folder of the first saving location, named like the sweep file with a "_live" suffix (see nfu.live_filename()).
+              Each point is on disk as soon as it is stored, RAM use doesn't grow with the size of the scan, and another process can read the scan in progress with np.load(filename, mmap_mode="r").
+              Checkpoints only hold the name of the file. The sweep file is still saved at the end, and the live file is kept.
+    - hardware_inner: If True, each pass of the inner sweep_dim (sweep_dim #max, or the last of the nesting) is compiled into one program with one shot per point, 
+                      launched once and read back in one transfer (see nfu.sweep_hardware_inner()). 
+                      The experiment module must then define get_inner_data(lab, params, fig, data, ID), returning the result of each shot of the pass, in order.
+                      The program must fit in the memory of the instruments. Only the "ascending" and "snake" orders can be used, and it can't be pipelined.
+    - deadline: When the scan must be over, as a datetime, a number of seconds from now, or a "HH:MM" string (the next time it is on the clock). For shared station bookings.
+                The number of shots at each point is lowered to fit (repeats is then the maximum), first from the estimated duration, then from the pace measured as the scan goes.
+                If even one shot at each point doesn't fit, points are visited coarse to fine ("interleaved" order) instead of the ascending, snake or random orders.
+                The scan stops at the deadline, and can be resumed later with resume_scan(). See nfu.fit_deadline().
     """
             
     ## ID is the number indicated after the date in file names.
@@ -72,16 +108,64 @@ def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True):
     check_lab(lab)
 
     print("ID:",ID,"\n")
-    ## data is an array full of zeros matching good dimensions imposed by params.
-    data = nfu.zeros(params, experiment)
+    ## Time spent each time a sweep_dim changes, declared or measured in previous scans.
+    costs, unknown_costs = nfu.change_costs(params, experiment)
+    best_nesting, best_cost = nfu.best_nesting(nfu.sweep_shape(params), order, costs)
+    if nesting=="propose":
+        nested = None
+    elif nesting=="apply":
+        nested = best_nesting
+    else:
+        nested = tuple([dim-1 for dim in nesting])
+    ## Every point of the scan, in the order they will be visited.
+    plan = nfu.sweep_plan(params, order, seed, nested, budget)
+    if order=="adaptive" and pipeline:
+        raise LabMasterError("The adaptive order can't be pipelined: the next point depends on the result of the current one.")
+    if pipeline:
+        check_pipeline(lab)
+    if hardware_inner:
+        check_hardware_inner(experiment, plan, pipeline)
+        plan["hardware_inner"] = True
     ## Create folders for today if they don't exist.
     nfu.create_todays_folder()
+    ## data is an array full of zeros matching good dimensions imposed by params.
+    if memmap:
+        data = nfu.zeros(params, experiment, averaged=repeats > 1, filename=nfu.live_filename(saving_folders()[0], plan["date"], ID, plan["script"]))
+    else:
+        data = nfu.zeros(params, experiment, averaged=repeats > 1)
+    ## Running mean, variance and count of the shots at each point. The mean is kept in data.
+    plan["stats"] = classes.Running_stats(data, params.get_dimension(), repeats, keep_shots, min_repeats, target_error, target_snr)
+    ## Reason code of each point that failed despite lab.retry_policy, by data indices. See nfu.acquire().
+    plan["failed"] = {}
     if fig != None:
         ## Initialize the plot on the figure.
         experiment.create_plot(lab, params, fig, data, ID)
 
     print("\n--------------------------------------------\n", experiment.__name__, "\n--------------------------------------------") 
     print(params) 
+    if nfu.plan_description(plan)!="ascending":
+        print("Order:", nfu.plan_description(plan), "\n")
+    if hardware_inner:
+        print("Hardware inner loop: "+str(plan["shape"][plan["nesting"][-1]])+" shots per program, along sweep_dim #"+str(plan["nesting"][-1]+1)+".\n")
+    if repeats > 1 and plan["stats"].has_target():
+        targets = []
+        if target_error is not None:
+            targets.append("standard error <= "+str(target_error))
+        if target_snr is not None:
+            targets.append("SNR >= "+str(target_snr))
+        print("Repeats: "+str(plan["stats"].min_repeats)+" to "+str(repeats)+" shots at each point, until "+" or ".join(targets)+".\n")
+    elif repeats > 1:
+        print("Repeats:", repeats, "shots at each point.\n")
+    if nfu.nesting_report(plan, costs, unknown_costs, best_nesting, best_cost)!="":
+        print(nfu.nesting_report(plan, costs, unknown_costs, best_nesting, best_cost))
+    if deadline is not None:
+        ## Fewer shots, or coarse to fine, to be done by the deadline.
+        plan, report = nfu.fit_deadline(lab, params, experiment, plan, deadline, fig, data)
+        print(report)
+        if plan["order"]!=order:
+            print("Order:", nfu.plan_description(plan), "\n")
+    ## Dry run of experiment.sequence() and overheads of the last scan of this experiment.
+    print(nfu.duration_report(nfu.estimate_duration(lab, params, experiment, plan, plan["stats"].repeats, fig, data), plan["stats"].has_target()))
     
     if quiet:
         ## No time for questions.
@@ -91,19 +175,63 @@ def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True):
             raise KeyboardInterrupt
 
     ## Up to this point, results will be saved whatever happens.
+    run_sweep(lab, params, experiment, fig, data, plan, ID, update_plot, pipeline)
+    return
+                    
+def run_sweep(lab, params, experiment, fig, data, plan, ID, update_plot, pipeline):
+    """
+    Run the points of the plan from plan["position"], then save everything, whatever happens. Called by scan() and resume_scan().
+    A checkpoint is saved every lab.checkpoint_interval, and when the sweep is interrupted, so that it can be resumed with resume_scan(). 
+    The checkpoint is deleted once the scan is completed.
+    """
+    ## Original file names, for resumed scans.
+    date = plan["date"]
+    script = plan["script"]
+    ## Points done before this run, for nfu.measure_change_costs().
+    plan["start"] = plan["position"]
+    ## Error bars of the automatic plot, see plotting.update_plot_auto().
+    lab.stats = plan["stats"]
     try:
         ## Save what we know about the experiment so far in experiment/ folder. 
-        save_experiment(None, None, None, ID, "first_time")
+        save_experiment(None, None, None, ID, "first_time", date, script)
+        ## Save the starting point, in case the computer dies before the first periodic checkpoint.
+        nfu.save_checkpoint(lab, params, experiment, data, plan, ID, force=True)
         ## Start the sweep! data will be filled with science
-        nfu.sweep(lab, params, experiment, data, fig, 1, ID, update_plot)
-        error_message = "Scan completed."
+        lab.profiler.start()
+        if plan["order"]=="adaptive":
+            nfu.sweep_adaptive(lab, params, experiment, data, fig, ID, update_plot, plan)
+        elif plan.get("hardware_inner"):
+            nfu.sweep_hardware_inner(lab, params, experiment, data, fig, ID, update_plot, plan)
+        elif pipeline:
+            nfu.sweep_pipelined(lab, params, experiment, data, fig, ID, update_plot, plan)
+        else:
+            nfu.sweep(lab, params, experiment, data, fig, ID, update_plot, plan)
+        if plan.get("stopped"):
+            error_message = "Scan stopped at the deadline."
+        else:
+            error_message = "Scan completed."
     except:        
         error_message = error_manager(as_string=True, all=True)
         raise
     finally:
         ##-------------------------------- All executions in the finally statement should be fail-proof. --------------------------------##
-        ## Save experiment info, as well as experiment source code.
-        save_experiment(lab, params, experiment, ID, error_message+"\n")
+        lab.profiler.stop()
+        if "max_repeats" in plan:
+            ## Shots were fitted to a deadline. Save and report against the repeats asked for.
+            plan["stats"].repeats = plan["max_repeats"]
+        if error_message=="Scan completed.":
+            ## Nothing left to resume.
+            nfu.remove_checkpoint(plan, ID)
+        else:
+            ## Save the last point done, to resume from there.
+            nfu.save_checkpoint(lab, params, experiment, data, plan, ID, force=True)
+            print("Resume with resume_scan('"+date+"', "+str(int(ID))+").")
+        ## What save_experiment() writes, before lab and params change.
+        try:
+            summary = nfu.experiment_summary(lab, params, experiment, error_message+"\n", plan["stats"])
+        except:
+            summary = None
+            print("experiment_summary() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
         try:
             ## Call the post_scan function of experiment module
             experiment.post_scan(lab, params, fig, data, ID)
@@ -111,26 +239,159 @@ def scan(lab, params, experiment, fig=None, quiet=False, update_plot=True):
             print("end function from "+experiment.__name__+" failed.", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
         ## Call the abort method from every instrument connected to the Lab instance.
         lab.abort_all()
+        ## Show how precise the waiting was, to tune lab.end_margin.
+        print(nfu.wakeup_report(lab))
+        print(lab.sequence_cache)
+        ## Show where the time went.
+        print(lab.profiler)
+        if lab.retry_policy is not None:
+            print(lab.retry_policy)
+        if plan["stats"].repeats > 1:
+            print(plan["stats"])
+        ## Learn how long each parameter takes to change, for the nesting of future scans.
+        nfu.measure_change_costs(lab, params, experiment, plan)
+        ## Learn the overheads of this experiment, for the duration estimates of future scans.
+        nfu.measure_overheads(lab, experiment)
+        ##------------------ Files are written in the background, from copies. The next scan can start meanwhile. ------------------##
+        saved_params, saved_data, saved_plan, saved_fig = params, data, plan, fig
+        if lab.background_saving:
+            try:
+                saved_params, saved_data, saved_plan = nfu.snapshot(params, data, plan)
+                saved_fig = nfu.copy_figure(fig) if fig!=None else None
+            except:
+                print("Copies for saving in the background failed, saving now. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+                saved_params, saved_data, saved_plan, saved_fig = params, data, plan, fig
+        ## Save experiment info, as well as experiment source code.
+        writer.submit(save_experiment, None, None, None, ID, error_message+"\n", date, script, summary=summary)
         ## Save params in params/ folder. 
-        save_params(params, ID)
+        writer.submit(save_params, saved_params, ID, date, script)
         ## Save parameters values and data in sweep/ folder. 
-        save_sweep(params, data, ID)
+        writer.submit(save_sweep, saved_params, saved_data, ID, saved_plan, date, script)
         ## Save fig as pdf in fig/ folder
-        save_fig(fig, ID)
+        writer.submit(save_fig, saved_fig, ID, date=date, script=script)
         ## Save the script which was started by the %irun magic.
-        save_script(ID)
+        writer.submit(save_script, ID, date, script, callback=lambda: print("\nsaved as",ID,"\n"))
+        if saved_params is params:
+            ## Not copied: wait for the files before anything changes.
+            flush()
         if fig!=None and update_plot==False:
             try:
                 ## Update the figure one last time.
                 experiment.update_plot(lab, params, fig, data, ID)
             except:
                 print("update_plot from "+experiment.__name__+" failed.", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
-        print("\nsaved as",ID,"\n")
+    return
+    
+def resume_scan(date, ID, lab=None, experiment=None, fig=None, quiet=False, update_plot=True, pipeline=False, deadline=None):
+    """
+    Resume an interrupted scan from its last checkpoint (see nfu.save_checkpoint()), starting at the first point that was not done.
+    Data, params, order, repeat and hardware_inner settings are those of the checkpoint. Results are saved under the same date and ID as the interrupted scan.
+    experiment.pre_scan() is called again, to bring instruments back to their state, but the changes it makes to params are discarded.
+    
+    - date: Date of the interrupted scan. Has to follow this datetime format: %Y-%m-%d
+    - ID: Number indicated after the date in file name.
+    - lab: Lab instance. If None, a Lab is created with the instruments of the interrupted scan. Missing instruments are added to a given lab.
+    - experiment: Experiment module. If None, the module of the interrupted scan is imported.
+    - fig, quiet, update_plot, pipeline: Same as scan().
+    - deadline: Same as scan(). The deadline of the interrupted scan is not kept. Shots are fitted up to the repeats of the interrupted scan, but the order is kept.
+    """
+    ID = nfu.pad_ID(ID)
+    checkpoint = load_checkpoint(date, ID)
+    data = checkpoint["data"]
+    ## Points are not saved in the checkpoint, see nfu.plan_without_points().
+    plan = nfu.restore_points(checkpoint["plan"])
+    params = checkpoint["params"]
+    if data is None:
+        ## Memory-mapped data array, see scan().
+        data = np.lib.format.open_memmap(checkpoint["data_file"], mode="r+")
+        plan["stats"].mean = data
+    if experiment is None:
+        experiment = importlib.import_module(checkpoint["experiment"])
+    elif experiment.__name__!=checkpoint["experiment"]:
+        print("Warning: scan "+date+" "+ID+" was run with "+checkpoint["experiment"]+", not "+experiment.__name__+".")
+    if lab is None:
+        lab = Lab(*checkpoint["instruments"])
+    else:
+        lab.add_instrument(*[name for name in checkpoint["instruments"] if name not in lab.get_names()])
+        
+    ## Replace missing functions from experiment module
+    fill_experiment_functions(experiment)
+    ## pre_scan brings instruments back to their state, but params are kept as they were saved.
+    pre_scan_params = copy.deepcopy(params)
+    nfu.get_ready(lab, pre_scan_params)
+    experiment.pre_scan(lab, pre_scan_params, fig, None, ID)
+    nfu.get_ready(lab, params)
+    
+    ## Check if inputs are conform to a bunch of restrictions
+    check_params(params)
+    check_lab(lab)
+    if plan["order"]=="adaptive" and pipeline:
+        raise LabMasterError("The adaptive order can't be pipelined: the next point depends on the result of the current one.")
+    if pipeline:
+        check_pipeline(lab)
+    if plan.get("hardware_inner"):
+        check_hardware_inner(experiment, plan, pipeline)
+    
+    print("ID:",ID,"\n")
+    ## Create folders for today if they don't exist.
+    nfu.create_todays_folder()
+    if fig != None:
+        ## Initialize the plot on the figure, with the points already done.
+        experiment.create_plot(lab, params, fig, data, ID)
+        try:
+            experiment.update_plot(lab, params, fig, data, ID)
+        except:
+            print("update_plot from "+experiment.__name__+" failed.", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+            
+    print("\n--------------------------------------------\n", experiment.__name__, "(resumed)\n--------------------------------------------") 
+    print(params) 
+    if nfu.plan_description(plan)!="ascending":
+        print("Order:", nfu.plan_description(plan), "\n")
+    total = plan["budget"] if plan["order"]=="adaptive" else len(plan["points"])
+    print("Resuming at point "+str(plan["position"]+1)+" of "+str(total)+".\n")
+    ## A new deadline, or none.
+    for key in ["deadline", "stopped"]:
+        plan.pop(key, None)
+    plan["stats"].repeats = plan.pop("max_repeats", plan["stats"].repeats)
+    if deadline is not None:
+        ## Fewer shots to be done by the deadline. Points already done keep the order.
+        plan, report = nfu.fit_deadline(lab, params, experiment, plan, deadline, fig, data, reorder=False)
+        print(report)
+    print(nfu.duration_report(nfu.estimate_duration(lab, params, experiment, plan, plan["stats"].repeats, fig, data), plan["stats"].has_target()))
+    
+    if quiet:
+        ## No time for questions.
+        pass
+    else:
+        if input("Is this correct? [Y/n]") not in nfu.positive_answer_Y():
+            raise KeyboardInterrupt
+            
+    ## Up to this point, results will be saved whatever happens.
+    run_sweep(lab, params, experiment, fig, data, plan, ID, update_plot, pipeline)
     return
                     
 
 
 
+def check_hardware_inner(experiment, plan, pipeline):
+    """Raise a LabMasterError if the inner sweep_dim of the plan can't be executed in hardware. See scan()."""
+    if len(plan["shape"])==0:
+        raise LabMasterError("hardware_inner needs at least one sweep_dim.")
+    if plan["order"] not in ["ascending", "snake"]:
+        raise LabMasterError('hardware_inner works with the "ascending" and "snake" orders only, not "'+plan["order"]+'": the points of the inner sweep_dim must be visited one after the other.')
+    if pipeline:
+        raise LabMasterError("hardware_inner can't be pipelined.")
+    if not hasattr(experiment, "get_inner_data"):
+        raise LabMasterError("hardware_inner needs a get_inner_data(lab, params, fig, data, ID) function in "+experiment.__name__+".")
+    return
+    
+def check_pipeline(lab):
+    """Raise a LabMasterError if a memory instrument can't compile the next point while the current one runs. See scan() and classes.Instrument.pipeline_safe."""
+    unsafe = [instrument.name for instrument in lab.get_memory_instruments() if not instrument.pipeline_safe]
+    if unsafe!=[]:
+        raise LabMasterError("The scan can't be pipelined: "+", ".join(sorted(unsafe))+" may talk to the device while compiling. Set pipeline_safe to True on the instrument class once its instructions leave the device alone.")
+    return
+    
 def check_lab(lab):
     """
     Check if every instrument is conform to the rules.
@@ -153,6 +414,7 @@ def check_params(params):
     """
     Checks if every parameter is conform to the rules. 
     Convert lists to numpy arrays.
+    Compile the sweep layout of params (see Params.compile_layout()).
     
     - params: a Params instance.    
     """
@@ -166,7 +428,7 @@ def check_params(params):
         if param.sweep_dim < 0:
             raise LabMasterError(key+".sweep_dim is < 0.")
         if param.is_not_const():
-            ## Convert lists to numpy arrays.
+            ## Convert lists to numpy arrays. A Lazy_range is kept as is.
             if isinstance(param.value, list):
                 param.value = np.array(param.value)
             ## The length can't be zero.
@@ -175,9 +437,9 @@ def check_params(params):
             ## The dimension must be one.
             if param.value.ndim > 1:
                 raise LabMasterError(key+".value has a dimension higher than 1.")                
-            ## The length is restricted to 10^8. 
-            if len(param.value) > 1e6:
-                raise LabMasterError(param.name+" array will slow Python because it is too large.")
+            ## The length of arrays is restricted to 10^6. A Lazy_range holds no array.
+            if not isinstance(param.value, Lazy_range) and len(param.value) > 1e6:
+                raise LabMasterError(param.name+" array will slow Python because it is too large. Use a Lazy_range instead.")
 
     for i in range(1,params.get_dimension()+1):
         ## Empty sweep dimensions are forbidden.
@@ -188,6 +450,12 @@ def check_params(params):
         for l in range(len(lengths_by_ID)):
             if not lengths_by_ID[l] == lengths_by_ID[l-1]:
                 raise LabMasterError("Arrays programmed for sweep_dim="+str(i)+" have different lenghts.")  
+    ## The plan and the data array hold every point of the scan (see nfu.sweep_plan() and nfu.zeros()), even along a Lazy_range.
+    num_points = int(np.prod([len(params.get_current_sweeps(i)[0].value) for i in range(1, params.get_dimension()+1)]))
+    if num_points > 1e7:
+        raise LabMasterError("The scan has "+str(num_points)+" points, more than the limit of 10^7. The plan and the data array hold every point, Lazy_range included.")
+    ## Per-point lookups will read the compiled layout.
+    params.compile_layout()
     return
 
 def clean_reset(namespace):
@@ -354,6 +622,14 @@ def fill_experiment_functions(experiment):
     return 
     
     
+def flush(timeout=None):
+    """
+    Wait until the files of finished scans are saved. They are saved in the background (see run_sweep() and Lab.background_saving). 
+    The load functions call it, so scripts can load the result of a scan right after it.
+    Return True if everything is saved, False if the timeout (s) ran out first. If timeout is None, wait as long as needed.
+    """
+    return writer.flush(timeout)
+    
 def help_please():
     """
     Use ? after an object to get documentation. With ?? you get source code.
@@ -455,18 +731,33 @@ def load_sweep(date, ID):
             Good format example: 2016_06_24
     - ID: Number indicated after the date in file name.
     """
+    ## Files of the last scan may still be written in the background.
+    flush()
     ID = nfu.pad_ID(ID) ## Convert ID to correct format.
     file_format = nfu.filename_format(date, ID, script_name=False)
     main_saving_loc = saving_folders()[0] ## Load from the first element of saving_folders()
     
     try:
         ## Find the file matching date and ID
-        matching_file = [filename for filename in glob.glob(main_saving_loc+"sweep/"+date+"/*") if file_format in filename][0]
+        matching_file = [filename for filename in glob.glob(main_saving_loc+"sweep/"+date+"/*") if file_format in filename and not filename.endswith("_live.npy")][0]
     except IndexError:
         raise LabMasterError("Date or ID does not match any existing file.")
         
     return np.load(matching_file)
     
+def load_checkpoint(date, ID):
+    """
+    Load the checkpoint of an interrupted scan from checkpoint/ folder. See nfu.save_checkpoint() for its contents.
+    
+    - date: Date from file name. Has to follow this datetime format: %Y-%m-%d
+    - ID: Number indicated after the date in file name.
+    """
+    filename = nfu.checkpoint_filename(saving_folders()[0], date, ID)
+    if not os.path.exists(filename):
+        raise LabMasterError("No checkpoint for "+date+" "+nfu.pad_ID(ID)+". Completed scans have none.")
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+    
 def load_params(date, ID, output=None):
     """
     Load params from a .pickle file in params/ folder.
@@ -480,6 +771,8 @@ def load_params(date, ID, output=None):
     - output: If None, will return the whole params instance.
               If a string, will return the parameter from params with that name.
     """
+    ## Files of the last scan may still be written in the background.
+    flush()
     ID = nfu.pad_ID(ID) ## Convert ID to correct format.
     file_format = nfu.filename_format(date, ID, script_name=False)
     main_saving_loc = nfu.saving_folders()[0]
@@ -511,6 +804,8 @@ def load_plot(date, ID, experiment_name=None, fig=None):
     - experiment_name: Use create_plot and update_plot from this experiment instead.
     - fig: Plot the result on the given figure.
     """
+    ## Files of the last scan may still be written in the background.
+    flush()
     ID = nfu.pad_ID(ID) ## Convert ID to correct format.
     main_saving_loc = saving_folders()[0] ## Load from the first element of saving_folders()
     
@@ -556,6 +851,8 @@ def load_out(date, ID, fig=None, experiment_name=None):
     - ID: Number indicated after the date in file name.
     - experiment_name: Use a specific experiment module.
     """
+    ## Files of the last scan may still be written in the background.
+    flush()
     ID = nfu.pad_ID(ID) ## Convert ID to correct format.
     main_saving_loc = saving_folders()[0] ## Load from the first element of saving_folders()
 
@@ -665,7 +962,7 @@ def require_comments(*args):
     return
     
     
-def save_experiment(lab, params, experiment, ID, error_string):
+def save_experiment(lab, params, experiment, ID, error_string, date=None, script=None, summary=None):
     """
     Save info about scan under experiment/, such as:
     * Time launched, time ended, total duration.
@@ -680,12 +977,17 @@ def save_experiment(lab, params, experiment, ID, error_string):
     - ID: Number indicated after the date in file name.
     - error_string: Error message to save.
                     If error_string is 'first_time', will create a new file, save the launch time only.
+    - date, script: Date and script filename in the file name. Default is today and the running script. See resume_scan().
+    - summary: Output of nfu.experiment_summary(), written instead of a summary of lab, params, experiment and error_string, which can then be None. 
+               To save in the background while lab and params change (see run_sweep()).
     """
+    if date is None:
+        date = today()
     time_launched_string = "Time launched:  "
     datetime_format = "%Y-%b-%d %H:%M:%S"
     try:
         for saving_loc in saving_folders():
-            filename = saving_loc+"experiment/"+today()+"/"+nfu.filename_format(today(), ID)+".txt"
+            filename = saving_loc+"experiment/"+date+"/"+nfu.filename_format(date, ID, script=script)+".txt"
             if error_string == "first_time":
                 ## This is the first call to save_experiment().
                 with open(filename, "a") as f:    
@@ -701,16 +1003,15 @@ def save_experiment(lab, params, experiment, ID, error_string):
                     ## Write a whole bunch of useful stuff here.
                     time_ended = datetime.datetime.now().replace(microsecond=0)
                     f.write("Time ended:     "+time_ended.strftime(datetime_format)+"\n")
-                    f.write("Total duration: "+str(time_ended-time_launched)+"\n\n")
-                    f.write(error_string+"\n\n")
-                    f.write("### "+str(lab)+"\n\n")
-                    f.write("### Scheduled run \n"+str(params)+"\n")
-                    f.write("### Experiment: "+experiment.__name__+".py\n"+inspect.getsource(experiment))
+                    f.write("Total duration: "+str(time_ended-time_launched)+"\n")
+                    if summary is None:
+                        summary = nfu.experiment_summary(lab, params, experiment, error_string)
+                    f.write(summary)
     except:
         print("save_experiment() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
     return
     
-def save_params(params, ID):
+def save_params(params, ID, date=None, script=None):
     """ 
     Save params instance with pickle under saved/params/ folder.
     Extract them with ease using the load_params() function.
@@ -718,10 +1019,13 @@ def save_params(params, ID):
     Input
     - params: Params instance.
     - ID: Number indicated after the date in file name.
+    - date, script: Date and script filename in the file name. Default is today and the running script. See resume_scan().
     """
+    if date is None:
+        date = today()
     try:
         for saving_loc in nfu.saving_folders():
-            filename = saving_loc+"params/"+today()+"/"+nfu.filename_format(today(), ID)[:-3]+".pickle"
+            filename = saving_loc+"params/"+date+"/"+nfu.filename_format(date, ID, script=script)[:-3]+".pickle"
             with open(filename, "wb") as f:
                 pickle.dump(params, f, pickle.HIGHEST_PROTOCOL) # Pickle using the highest protocol available.
     except:
@@ -729,32 +1033,43 @@ def save_params(params, ID):
     return
 
 
-def save_script(ID):
+def save_script(ID, date=None, script=None):
     """
     Copy the script launched by %irun to script/
     
     - ID: Number indicated after the date in file name.
+    - date, script: Date and script filename in the file name. The script copied is that file. Default is today and the running script. See resume_scan().
     """
+    if date is None:
+        date = today()
+    if script is None:
+        script = nfu.get_script_filename()
     try:
         for saving_loc in saving_folders():
-            new_filename = saving_loc+"script/"+today()+"/"+nfu.filename_format(today(), ID)+".py"
+            new_filename = saving_loc+"script/"+date+"/"+nfu.filename_format(date, ID, script=script)+".py"
             ## Copy a file.
-            shutil.copy(nfu.get_script_filename(), new_filename)     
+            shutil.copy(script, new_filename)     
     except:
         print("save_script() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
     return
     
-def save_sweep(params, data, ID):
+def save_sweep(params, data, ID, plan=None, date=None, script=None):
     """
     Convert parameter values and data array into a numpy dtype array. Saved to sweep/ folder.
     
     - data: Numpy array to be saved.
     - params: Params instance.
     - ID: Number indicated after the date in file name.
+    - plan: Output of nfu.sweep_plan(). If given, the order and the visited points are saved under 'ORDER' and 'PLAN'.
+            For the adaptive order, the measured points are also saved as explicit lists: coordinates under 'POINTS' (one column per sweep_dim, first parameter by name) and results under 'VALUES'.
+            Its repeat statistics (plan["stats"]) and failed points (plan["failed"]) are saved as well, see below.
+    - date, script: Date and script filename in the file name. Default is today and the running script. See resume_scan().
     """
+    if date is None:
+        date = today()
     try:
         for saving_loc in saving_folders():
-            filename = saving_loc+"sweep/"+today()+"/"+nfu.filename_format(today(), ID)
+            filename = saving_loc+"sweep/"+date+"/"+nfu.filename_format(date, ID, script=script)
             ## An entry in the output array is dedicated to data. Access using 'DATA'.
             sweep_contents = [data]
             dtype_list = [('DATA', (data.dtype, data.shape))]
@@ -762,8 +1077,48 @@ def save_sweep(params, data, ID):
             sweep_dims = np.array([param.name+'='+str(param.sweep_dim) for param in params.get_sweeps()])
             sweep_contents += [sweep_dims]
             dtype_list += [('SWEEPS', (sweep_dims.dtype,sweep_dims.shape))]
+            if plan is not None:
+                ## Entries dedicated to the traversal order. Access using 'ORDER' and 'PLAN' (points in the order they were visited).
+                order = np.array(nfu.plan_description(plan))
+                sweep_contents += [order, plan["points"]]
+                dtype_list += [('ORDER', order.dtype), ('PLAN', (plan["points"].dtype, plan["points"].shape))]
+                if plan["order"]=="adaptive":
+                    coordinates = [sorted([(x.name, x) for x in params.get_current_sweeps(i+1)])[0][1].value for i in range(plan["points"].shape[1])]
+                    points = np.array([[coordinates[i][index] for i, index in enumerate(point)] for point in plan["points"]]).reshape(plan["points"].shape)
+                    values = data[tuple(plan["points"].T)]
+                    sweep_contents += [points, values]
+                    dtype_list += [('POINTS', (points.dtype, points.shape)), ('VALUES', (values.dtype, values.shape))]
+            for i in range(1, params.get_dimension()+1):
+                if params.get_point_list(i) is not None:
+                    ## Entries dedicated to a table of points (see Params.set_points()). Access using 'POINT_LIST' (one row per point) and 'POINT_LIST_NAMES' (one name per column).
+                    names, table = params.get_point_list(i)
+                    names = np.array(names)
+                    sweep_contents += [table, names]
+                    dtype_list += [('POINT_LIST', (table.dtype, table.shape)), ('POINT_LIST_NAMES', (names.dtype, names.shape))]
+                    break
+            failed = plan.get("failed", {}) if plan is not None else {}
+            if len(failed) > 0:
+                ## Entry dedicated to points that failed despite lab.retry_policy. Access using 'FAILED': the reason code of each point ("stage: error type"), "" for the others. Failed points are NaN in DATA.
+                codes = np.zeros(data.shape[:params.get_dimension()], dtype="U"+str(max([len(code) for code in failed.values()])))
+                for indices, code in failed.items():
+                    codes[indices] = code
+                sweep_contents += [codes]
+                dtype_list += [('FAILED', (codes.dtype, codes.shape))]
+            stats = plan.get("stats") if plan is not None else None
+            if stats is not None and stats.mean is data and stats.repeats > 1:
+                ## Entries dedicated to repeated shots. Access using 'VARIANCE' (sample variance of the shots, same shape as DATA) and 'COUNT' (shots at each point).
+                variance = stats.get_variance()
+                sweep_contents += [variance, stats.count]
+                dtype_list += [('VARIANCE', (variance.dtype, variance.shape)), ('COUNT', (stats.count.dtype, stats.count.shape))]
+                if stats.shots is not None:
+                    ## Last shots of each point, 'SHOTS'[n] being shot n modulo keep_shots.
+                    sweep_contents += [stats.shots]
+                    dtype_list += [('SHOTS', (stats.shots.dtype, stats.shots.shape))]
             for param in params.get_sweeps(): 
-                if not isinstance(param.value, np.ndarray): 
+                if isinstance(param.value, Lazy_range):
+                    ## Save the range, not its values. Rebuild it with Lazy_range.from_record().
+                    value = param.value.to_record()
+                elif not isinstance(param.value, np.ndarray): 
                     ## Convert lists to numpy arrays.
                     value = np.array(param.value)
                 else:
@@ -785,18 +1140,21 @@ def save_sweep(params, data, ID):
         print("save_sweep() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])   
     return
 
-def save_fig(fig, ID, ext="pdf"):
+def save_fig(fig, ID, ext="pdf", date=None, script=None):
     """
     Save matplotlib figure to fig/
     
     - fig: Matplotlib figure instance.
     - ID: Number indicated after the date in file name.
     - ext: Extension of the file to save. Supported formats: emf, eps, pdf, png, ps, raw, rgba, svg, svgz.
+    - date, script: Date and script filename in the file name. Default is today and the running script. See resume_scan().
     """
+    if date is None:
+        date = today()
     if fig != None:
         try:
             for saving_loc in saving_folders():
-                fig.savefig(saving_loc+"fig/"+today()+"/"+nfu.filename_format(today(), ID)+"."+ext)
+                fig.savefig(saving_loc+"fig/"+date+"/"+nfu.filename_format(date, ID, script=script)+"."+ext)
         except:
             print("save_fig() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
     return 
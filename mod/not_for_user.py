@@ -20,11 +20,120 @@ import inspect          ## Retrieve information on python objects
 import linecache        ## Required before some inspect functions.
 import datetime         ## Includes datetime objects to handle dates.
 import types            ## better type handling
+import contextlib       ## Hold many locks at once
+import pickle           ## Serialize any python object
+import hashlib          ## Digests of serialized objects
+import ctypes as ct     ## Size of ctypes arrays
+import concurrent.futures ## Worker threads
+import copy             ## Deep copies of python objects
+import copyreg          ## Rebuild pickled objects
+import io               ## In-memory files
+import itertools        ## Permutations of sweep dimensions
 ## Homemade modules
 from . import plotting
 from .units import *
 
   
+def acquire(lab, params, experiment, data, fig, file_ID, compiled, plan, after_first_launch=None, after_first_wait=None):
+    """
+    Run the compiled point until plan["stats"] has enough shots (see Running_stats.is_done()) and accumulate the results of experiment.get_data() in plan["stats"], which keeps their mean in the data array.
+    If the plan has no stats, run once and store the result in the data array.
+    Each repeat loads the memory of instruments again (uploads are skipped when the instrument still holds the sequence, see commit_point()), launches, waits for the end and reads data.
+    If the compiled program holds one shot per point of the inner sweep_dim (see compile_point()), experiment.get_inner_data() reads all of them at once, 
+    and the program runs again until every one of these points has enough shots.
+    Stages are retried according to lab.retry_policy (see run_stage()). If a stage still fails, the point is marked failed: NaN in the data array, and its reason code in plan["failed"]. 
+    
+    - compiled: Output of compile_point() for the current point.
+    - plan: Output of sweep_plan(), with the "stats" and "failed" of the scan (see main.scan()).
+    - after_first_launch, after_first_wait: Functions called without arguments right after the first launch and right after the first wait. See sweep_pipelined().
+    """
+    stats = plan.get("stats")
+    ## Taken from compiled, as the worker of sweep_pipelined() rebuilds lab.total_duration for the next point while this one runs.
+    duration = compiled["total_duration"]
+    shots = compiled.get("shots")
+    if shots is None:
+        all_indices = [params.get_data_indices()]
+    else:
+        all_indices = shots
+    
+    def read():
+        """Result of each shot of the program."""
+        if shots is None:
+            return [experiment.get_data(lab, params, fig, data, file_ID)]
+        results = experiment.get_inner_data(lab, params, fig, data, file_ID)
+        if len(results)!=len(shots):
+            raise LabMasterError(experiment.__name__+".get_inner_data() returned "+str(len(results))+" results for "+str(len(shots))+" shots.")
+        return results
+        
+    repeat = 0
+    launched = False
+    waited = False
+    ## Setters of experiment modules run in launch(), so the first launch of a point holds the cost of changing parameters. See measure_change_costs().
+    launch_duration = np.nan
+    try:
+        while (stats is None and repeat==0) or (stats is not None and not all([stats.is_done(indices) for indices in all_indices])):
+            ## Load memory of instruments who can't ping_pong.
+            run_stage(lab, "load_memory", commit_point, lab, compiled)
+            ## The starting pistol.
+            started = timeit.default_timer()
+            with lab.profiler.time("launch"):
+                run_stage(lab, "launch", experiment.launch, lab, params, fig, data, file_ID)
+            ## Save time at which the experiment starts.
+            lab.time_launched = timeit.default_timer()
+            if repeat==0:
+                launch_duration = lab.time_launched-started
+            if repeat==0 and after_first_launch is not None:
+                launched = True
+                after_first_launch()
+            ## Wait for the end of experiment. 
+            with lab.profiler.time("wait"):
+                lab.wakeup_lateness.append(wait_for_end(lab, duration))
+            ## The hardware ran until completion was confirmed, or for total_duration if it ended on the timer.
+            lab.profiler.add_running(min(timeit.default_timer()-lab.time_launched, duration))
+            if repeat==0 and after_first_wait is not None:
+                waited = True
+                after_first_wait()
+            ## Update data array.
+            with lab.profiler.time("get_data"):
+                results = run_stage(lab, "get_data", read)
+            for indices, result in zip(all_indices, results):
+                if data.dtype.names is not None:
+                    result = as_record(result, data.dtype)
+                if stats is None:
+                    data[indices] = result
+                elif not stats.is_done(indices):
+                    stats.add(indices, result)
+            repeat += 1
+    except PointFailedError as failure:
+        print("Point "+str(all_indices[0] if shots is None else all_indices)+" failed, the scan goes on. "+str(failure))
+        ## The hooks run once whatever happens, see sweep_pipelined().
+        if repeat==0 and after_first_launch is not None and not launched:
+            after_first_launch()
+        if repeat==0 and after_first_wait is not None and not waited:
+            after_first_wait()
+        for indices in all_indices:
+            data[indices] = nans((), data.dtype)
+            if plan.get("failed") is not None:
+                plan["failed"][indices] = failure.code
+    lab.launch_durations.append(launch_duration)
+    return
+    
+def as_record(result, dtype):
+    """
+    Return the output of experiment.get_data() as a single element of a structured data array (see data_dtype()).
+    
+    - result: Output of experiment.get_data(). One value per field, in the order of DATA_SCHEMA. A single field can also be returned alone.
+    - dtype: Structured dtype of the data array.
+    """
+    if isinstance(result, np.ndarray) and result.dtype.names is not None:
+        ## Already a record.
+        return result.astype(dtype)
+    if not isinstance(result, tuple):
+        result = tuple(result) if len(dtype.names) > 1 else (result,)
+    if len(result)!=len(dtype.names):
+        raise LabMasterError("get_data() returned "+str(len(result))+" values, but DATA_SCHEMA declares "+str(len(dtype.names))+" fields: "+", ".join(dtype.names)+".")
+    return np.array(result, dtype=dtype)
+    
 def auto_unit(value, unit, decimal=None):
     """ 
     Return value and unit as a compact string with automatic prefix. Ex: (50e9, "Hz") will output "50 GHz". 
@@ -90,16 +199,312 @@ def auto_unit(value, unit, decimal=None):
         result = result[:-1]
     return result
     
+def best_nesting(shape, order, costs):
+    """
+    Find the nesting of sweep dimensions that minimizes the total time spent changing parameter values. All nestings are tried.
+    Only the "ascending" and "snake" orders depend on the nesting in a predictable way.
+    
+    - shape: Number of points along each sweep_dim.
+    - order: Traversal order, see sweep_plan().
+    - costs: Time spent each time the index of a sweep_dim changes (s), for each sweep_dim. See change_costs().
+    
+    Output:
+    - The best nesting, as a tuple of sweep_dim indices (starting at 0) from the outer loop to the inner loop.
+    - Its total cost (s).
+    """
+    default = tuple(range(len(shape)))
+    if order not in ["ascending", "snake"]:
+        return default, nesting_cost(shape, order, costs, default)
+    candidates = [(nesting_cost(shape, order, costs, nesting), nesting) for nesting in itertools.permutations(default)]
+    ## min() keeps the first of equal costs, so the default nesting wins ties.
+    cost, nesting = min(candidates, key=lambda x: x[0])
+    return nesting, cost
+    
+def change_costs(params, experiment):
+    """
+    Return the time spent each time the index of a sweep_dim changes (s), for each sweep_dim, and the names of parameters with unknown cost.
+    The cost of a sweep_dim is the sum of its parameters' costs. 
+    The cost of a parameter is its change_cost attribute if it was declared, else the cost measured in previous scans of the same experiment (see measure_change_costs()), else 0.
+    """
+    measured = load_station_stats().get("change_cost", {}).get(experiment.__name__, {})
+    costs = []
+    unknown = []
+    for i in range(1, params.get_dimension()+1):
+        cost = 0
+        for param in params.get_current_sweeps(i):
+            if getattr(param, "change_cost", None) is not None:
+                cost += param.change_cost
+            elif param.name in measured:
+                cost += measured[param.name]
+            else:
+                unknown.append(param.name)
+        costs.append(cost)
+    return costs, unknown
+    
+def commit_point(lab, compiled):
+    """
+    Restore the lab state saved by compile_point() and load the memory of each memory instrument. 
+    This is the only step that touches instrument memory.
+    
+    - compiled: Output of compile_point().
+    """
+    restore_point(lab, compiled)
+    for instrument in lab.get_memory_instruments():
+        if compiled["memory"].get(instrument.name) is not None:
+            key = compiled["keys"][instrument.name]
+            if key is not None and key==getattr(instrument, "loaded_key", None):
+                ## The instrument will skip loading.
+                lab.sequence_cache.uploads_skipped += 1
+            with lab.profiler.time("load_memory "+instrument.name):
+                instrument.load_memory(compiled=compiled["memory"][instrument.name], key=key)
+        else:
+            with lab.profiler.time("load_memory "+instrument.name):
+                instrument.load_memory()
+    return
+
+def compile_point(lab, params, experiment, data, fig, file_ID, points=None):
+    """
+    For the current point in params:
+    1) Reset instructions related objects.
+    2) Execute experiment.sequence().
+    3) Translate instructions of each memory instrument with a compile_memory() method, without touching instrument memory.
+       If the instrument has a memory_key() method, the translation is looked up in lab.sequence_cache first.
+    
+    - points: If given, step 2 is done for each of these points (see sweep_plan()), one after the other in the same program: one shot per point. 
+              Each shot starts at the end of the previous one. params are left at the last point. See sweep_hardware_inner().
+    
+    Output:
+    - A dictionary with the lab state, the instructions and the compiled memory of each instrument, ready for commit_point().
+      With points, "shots" holds the data indices of each shot, else None.
+    """
+    ## Reset everything instructions related from lab, as well as the instructions of each memory instrument.
+    lab.reset_instructions()
+    started = timeit.default_timer()
+    ## Run the sequence function from experiment module (custom function defined by user) which should fill the instructions attribute of instruments with memory.
+    with lab.profiler.time("sequence"):
+        if points is None:
+            experiment.sequence(lab, params, fig, data, file_ID)
+            shots = None
+        else:
+            shots = []
+            previous = None
+            try:
+                for shot, point in enumerate(points):
+                    set_point(params, point, previous)
+                    previous = point
+                    ## Next shot after the end of the previous one. Instruments can tell it's not the first shot, ex: to keep the registers of earlier shots.
+                    lab.time_cursor = lab.total_duration
+                    lab.shot = shot
+                    experiment.sequence(lab, params, fig, data, file_ID)
+                    shots.append(params.get_data_indices())
+            finally:
+                lab.shot = None
+    compiled = {"time_cursor":lab.time_cursor, "total_duration":lab.total_duration, "free_evolution_time":lab.free_evolution_time, "shots":shots, "instructions":{}, "memory":{}, "keys":{}}
+    for instrument in lab.get_memory_instruments():
+        compiled["instructions"][instrument.name] = instrument.instructions
+        if hasattr(instrument, "compile_memory"):
+            key = None
+            if hasattr(instrument, "memory_key"):
+                digest = instrument.memory_key()
+                if digest is not None:
+                    key = (instrument.name, digest)
+            with lab.profiler.time("compile "+instrument.name):
+                memory = lab.sequence_cache.get(key)
+                if memory is None:
+                    memory = instrument.compile_memory()
+                    lab.sequence_cache.put(key, memory)
+            compiled["memory"][instrument.name] = memory
+            compiled["keys"][instrument.name] = key
+    ## One per program. See overheads().
+    lab.compile_durations.append(timeit.default_timer()-started)
+    return compiled
+
+def checkpoint_filename(saving_loc, date, ID):
+    """Where the checkpoint of a scan is saved. The script name is left out, so that a scan can be resumed from any script."""
+    return saving_loc+"checkpoint/"+date+"/"+filename_format(date, pad_ID(ID), script_name=False)[:-1]+".pickle"
+    
+def check_deadline(lab, params, plan):
+    """
+    Called by the sweeps after each point of a scan with a deadline (see main.scan()).
+    Return True if the deadline has passed: plan["stopped"] is set and the sweep stops, so the scan can be resumed later.
+    Else, set the number of shots of the points left (plan["stats"].repeats) to the most that fits before the deadline, up to plan["max_repeats"]. 
+    The fit uses the running time and the overheads measured so far in this scan (see overheads()), so it follows the actual pace of the scan.
+    """
+    if plan.get("deadline") is None:
+        return False
+    time_left = plan["deadline"]-time.time()
+    if time_left <= 0:
+        plan["stopped"] = True
+        return True
+    stats = plan.get("stats")
+    overhead = overheads(lab)
+    if stats is None or overhead is None or plan["max_repeats"] <= 1:
+        return False
+    if plan["order"]=="adaptive":
+        points_left = plan["budget"]-plan["position"]
+    else:
+        points_left = len(plan["points"])-plan["position"]
+    if points_left <= 0:
+        return False
+    if plan.get("hardware_inner"):
+        programs_left = int(np.ceil(points_left/plan["shape"][plan["nesting"][-1]]))
+    else:
+        programs_left = points_left
+    shot = overhead["running"]+overhead["shot"]
+    repeats = (time_left/programs_left-overhead["program"])/shot if shot > 0 else plan["max_repeats"]
+    stats.repeats = int(min(max(repeats, 1), plan["max_repeats"]))
+    return False
+    
+def copy_figure(fig):
+    """
+    Return a copy of a matplotlib figure, detached from pyplot and from any window, so it can be saved from another thread while the original stays on screen. 
+    See classes.Background_writer.
+    """
+    class Figure_pickler(pickle.Pickler):
+        """Pickle the figure without the mark that registers it with pyplot when unpickled, which only works from the main thread."""
+        def reducer_override(self, obj):
+            if obj is fig:
+                state = fig.__getstate__()
+                state.pop("_restore_to_pylab", None)
+                return (copyreg.__newobj__, (type(fig),), state)
+            return NotImplemented
+    buffer = io.BytesIO()
+    Figure_pickler(buffer, pickle.HIGHEST_PROTOCOL).dump(fig)
+    return pickle.loads(buffer.getvalue())
+    
 def create_todays_folder():
     """ Create those folders if they don't exist. """
     for saving_loc in saving_folders():
-        for section in ["experiment","fig","script","params","sweep","custom"]:
+        for section in ["experiment","fig","script","params","sweep","custom","checkpoint"]:
             folder_name = saving_loc+"/"+section+"/"+datetime.date.today().strftime("%Y-%m-%d")
             if not os.path.exists(folder_name):
                 os.makedirs(folder_name)
     return 
     
     
+def data_dtype(experiment, averaged=False):
+    """
+    Return the structured dtype declared by the DATA_SCHEMA of the experiment module, or None if the module has no DATA_SCHEMA.
+    DATA_SCHEMA lists the values returned by get_data, in order, as (name, dtype) or (name, dtype, length) for a vector of values at each point:
+        DATA_SCHEMA = [("counts", "int32"), ("lockin", "float32"), ("trace", "float32", 100)]
+    The data array then has one field per value, which can be accessed by name: data["counts"].
+    
+    - averaged: If True, integer and boolean fields become float fields, so they can hold the mean of repeated shots (see float_dtype()).
+    """
+    schema = getattr(experiment, "DATA_SCHEMA", None)
+    if schema is None:
+        return None
+    try:
+        dtype = np.dtype([tuple(field) for field in schema])
+    except (TypeError, ValueError):
+        raise LabMasterError("DATA_SCHEMA of "+experiment.__name__+" is not valid: "+str(sys.exc_info()[1])+"\nIt should be a list of (name, dtype) or (name, dtype, length), ex: [(\"counts\", \"int32\"), (\"trace\", \"float32\", 100)].")
+    if averaged:
+        dtype = float_dtype(dtype)
+    return dtype
+    
+def estimate_duration(lab, params, experiment, plan, repeats=1, fig=None, data=None, sample=20):
+    """
+    Estimate how long the points of the plan not done yet will take, without touching the instruments.
+    If every memory instrument is pipeline_safe (see classes.Instrument), its instructions leave the device alone, and experiment.sequence() is dry-run at up to sample points spread over the remaining points. 
+    lab.total_duration then gives the running time of each. 
+    Otherwise, the running time of each program comes from the last scan of the same experiment (see measure_overheads()), and the estimate is unknown if there was none.
+    The overhead of each program and of each shot comes from the last scan of the same experiment too. It is 0 if there was none.
+    params are left at the last point sampled, and instructions are reset. Errors will be printed, not raised.
+    
+    - plan: Output of sweep_plan().
+    - repeats: Number of shots at each point.
+    - fig, data: Passed to experiment.sequence().
+    - sample: Maximum number of points dry-run.
+    
+    Output:
+    - None if the dry run failed or couldn't be done, else a dictionary with keys:
+      "duration": Expected duration (s).
+      "running": Expected time (s) spent running sequences.
+      "shot": Expected duration (s) of one shot at every point not done yet, included in "duration" repeats times. See fit_deadline().
+      "points": Number of points not done yet.
+      "measured": True if the overheads were measured by a previous scan.
+    """
+    if plan["order"]=="adaptive":
+        candidates = plan["coarse"]
+        points = max(0, plan["budget"]-plan["position"])
+    else:
+        candidates = plan["points"][plan["position"]:]
+        points = len(candidates)
+    if len(candidates)==0:
+        return {"duration":0, "running":0, "shot":0, "points":0, "measured":True}
+    ## One program per point, or per pass of the inner sweep_dim. See sweep_hardware_inner().
+    if plan.get("hardware_inner"):
+        programs = int(np.ceil(points/plan["shape"][plan["nesting"][-1]]))
+    else:
+        programs = points
+    overhead = load_station_stats().get("overhead", {}).get(experiment.__name__)
+    if all([instrument.pipeline_safe for instrument in lab.get_memory_instruments()]):
+        durations = []
+        try:
+            for n in np.unique(np.linspace(0, len(candidates)-1, min(sample, len(candidates))).astype(int)):
+                set_point(params, candidates[n])
+                lab.reset_instructions()
+                experiment.sequence(lab, params, fig, data, None)
+                durations.append(lab.total_duration)
+            lab.reset_instructions()
+        except:
+            print("Dry run of "+experiment.__name__+".sequence() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+            lab.reset_instructions()
+            return None
+        running = np.mean(durations)*points
+    elif overhead is not None and "running" in overhead:
+        ## Measured per program.
+        running = overhead["running"]*programs
+    else:
+        return None
+    shot = running
+    duration = shot*repeats
+    if overhead is not None:
+        shot += overhead["shot"]*programs
+        duration += overhead["program"]*programs + overhead["shot"]*programs*repeats
+    return {"duration":float(duration), "running":float(running*repeats), "shot":float(shot), "points":points, "measured":overhead is not None}
+    
+def deadline_timestamp(deadline):
+    """
+    Return a deadline as a time.time() timestamp.
+    
+    - deadline: A datetime, a number of seconds from now, or a "HH:MM" string (the next time it is on the clock).
+    """
+    if isinstance(deadline, datetime.datetime):
+        return deadline.timestamp()
+    if isinstance(deadline, str):
+        try:
+            clock = datetime.datetime.strptime(deadline, "%H:%M").time()
+        except ValueError:
+            raise LabMasterError('A deadline string must be a time on the clock, such as "08:00", not "'+deadline+'".')
+        now = datetime.datetime.now()
+        moment = datetime.datetime.combine(now.date(), clock)
+        if moment <= now:
+            moment += datetime.timedelta(days=1)
+        return moment.timestamp()
+    return time.time()+float(deadline)
+    
+def experiment_summary(lab, params, experiment, error_string, stats=None):
+    """
+    Return what main.save_experiment() writes about a finished scan after its duration: reports of lab, error message, instruments, params and the source code of the experiment module.
+    
+    - error_string: Error message to save.
+    - stats: Running_stats of the scan (plan["stats"]), reported if there were repeated shots.
+    """
+    summary = wakeup_report(lab)+"\n"
+    summary += str(lab.sequence_cache)+"\n"
+    summary += str(lab.profiler)+"\n"
+    if lab.retry_policy is not None:
+        summary += str(lab.retry_policy)+"\n"
+    if stats is not None and stats.repeats > 1:
+        summary += str(stats)+"\n"
+    summary += "\n"
+    summary += error_string+"\n\n"
+    summary += "### "+str(lab)+"\n\n"
+    summary += "### Scheduled run \n"+str(params)+"\n"
+    summary += "### Experiment: "+experiment.__name__+".py\n"+inspect.getsource(experiment)
+    return summary
+    
 def detect_experiment_ID():
     """ Read the maximum ID from files under experiment/. Add one to this result and return it as a string with padded zeros if ID < 10000. """
     date = today()
@@ -123,6 +528,36 @@ def detect_experiment_ID():
         ID = pad_ID(max(second_purge)+1)
     return ID
     
+def digest(obj):
+    """Return a digest (string) of the serialized object. Return None if the object can't be serialized."""
+    try:
+        return hashlib.sha1(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)).hexdigest()
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+def duration_report(estimate, upper_bound=False):
+    """
+    Return a string with the expected duration and end of a scan, from the output of estimate_duration(). 
+    
+    - upper_bound: If True, the duration is a maximum (ex: shots stop early once a target is reached).
+    """
+    if estimate is None:
+        return "Estimated duration: unknown.\n"
+    ends = datetime.datetime.now()+datetime.timedelta(seconds=estimate["duration"])
+    string = "Estimated duration: "+("at most "*upper_bound)+format_duration(estimate["duration"])+" for "+str(estimate["points"])+" points"
+    if estimate["duration"] > 0:
+        string += " ("+"%.0f" % (100*estimate["running"]/estimate["duration"])+"% of it running sequences)"
+    string += ", ends around "+ends.strftime("%Y-%b-%d %H:%M")+".\n"
+    if not estimate["measured"]:
+        string += "The overhead of each point is unknown until a first scan of this experiment: the estimate only counts the time running sequences.\n"
+    return string
+    
+def format_duration(seconds):
+    """Return a duration (s) as a string: with auto_unit() under a minute, else as hours:minutes:seconds."""
+    if seconds < 60:
+        return auto_unit(seconds, "s", decimal=1)
+    return str(datetime.timedelta(seconds=int(seconds)))
+    
 def err_msg():
     """ Beginning of LabMaster error message. Unfortunately Windows doesn't support ASCII color commands. """
     if os.name=="nt":
@@ -138,10 +573,98 @@ def warn_msg():
         return "\033[33mWarning: \033[0m"
 
     
-def filename_format(date, ID, script_name=True):
-    """Format of a filename. Be aware that loading previous files with LabMaster load functions will not work if you edit this function."""
+def field(array, name):
+    """Return a field of a structured array. A None name returns the array itself, so plain and structured data arrays can be handled by the same loop."""
+    if name is None:
+        return array
+    return array[name]
+    
+def fit_deadline(lab, params, experiment, plan, deadline, fig=None, data=None, reorder=True):
+    """
+    Fit a scan before a deadline, before it starts. See main.scan(). 
+    The number of shots at each point (plan["stats"].repeats) is lowered to the most that fits according to estimate_duration(). 
+    If even one shot at each point doesn't fit, the points are visited coarse to fine (the "interleaved" order), so that the points done by the deadline span the whole scan.
+    The ascending, snake and random orders can be changed this way. Either way, the scan stops at the deadline, and check_deadline() adjusts the shots as the scan goes.
+    
+    - plan: Output of sweep_plan(). 
+    - deadline: A datetime, a number of seconds from now, or a "HH:MM" string (the next time it is on the clock).
+    - reorder: If False, the order is kept whatever happens (ex: a resumed scan).
+    
+    Output:
+    - The plan to use, with the deadline and the maximum number of shots (plan["stats"].repeats) recorded.
+    - A string describing what was done.
+    """
+    plan["deadline"] = deadline_timestamp(deadline)
+    plan["max_repeats"] = plan["stats"].repeats
+    ending = "Deadline: "+datetime.datetime.fromtimestamp(plan["deadline"]).strftime("%Y-%b-%d %H:%M")+". "
+    estimate = estimate_duration(lab, params, experiment, plan, 1, fig, data)
+    if estimate is None:
+        return plan, ending+"The duration is unknown: the scan will stop at the deadline.\n"
+    time_left = plan["deadline"]-time.time()
+    fixed = estimate["duration"]-estimate["shot"]
+    repeats = int((time_left-fixed)//estimate["shot"]) if estimate["shot"] > 0 else plan["max_repeats"]
+    if repeats >= plan["max_repeats"]:
+        return plan, ending+"The scan fits with "+str(plan["max_repeats"])+" shot"+"s"*(plan["max_repeats"] > 1)+" at each point.\n"
+    if repeats >= 1:
+        plan["stats"].repeats = repeats
+        return plan, ending+str(repeats)+" of "+str(plan["max_repeats"])+" shots at each point fit. Shots are adjusted as the scan goes.\n"
+    plan["stats"].repeats = 1
+    ending += "Even one shot at each point doesn't fit. "
+    if reorder and plan["order"] in ["ascending", "snake", "random"] and not plan.get("hardware_inner"):
+        coarse = sweep_plan(params, "interleaved", nesting=plan["nesting"])
+        for key in ["date", "script", "deadline", "max_repeats", "stats", "failed"]:
+            coarse[key] = plan[key]
+        plan = coarse
+        ending += "Points are visited coarse to fine (interleaved order) and "
+    else:
+        ending += "The "
+    return plan, ending+"the scan stops at the deadline, to be resumed later.\n"
+    
+def first_value(value):
+    """Return the first value of a data element: the signal used by adaptive sampling and early stopping. For a structured array, the first value of its first field."""
+    value = np.asarray(value)
+    if value.dtype.names is not None:
+        value = value[value.dtype.names[0]]
+    return np.ravel(value)[0]
+    
+def flatten_fields(data):
+    """
+    Return a float array holding the fields of a structured data array along a last axis, a vector field taking one column per element.
+    With a single scalar field, no axis is added. A plain array is returned as is. Used by the automatic plotting functions.
+    """
+    if data.dtype.names is None:
+        return data
+    columns = [data[name].reshape(data.shape+(-1,)).astype(float) for name in data.dtype.names]
+    flat = np.concatenate(columns, axis=-1)
+    if flat.shape[-1]==1:
+        flat = flat[...,0]
+    return flat
+    
+def float_dtype(dtype, precision=None):
+    """
+    Return the dtype with floats instead of integers and booleans, to hold means and variances. Structured dtypes are converted field by field.
+    
+    - precision: If given, every value is converted to this float type, ex: np.float64. 
+                 Else integers and booleans of 4 bytes or less become float32, larger ones become float64, and floats are kept.
+    """
+    if dtype.names is not None:
+        return np.dtype([(name, float_dtype(dtype[name].base, precision), dtype[name].shape) for name in dtype.names])
+    if precision is not None:
+        return np.dtype(precision)
+    if dtype.kind in "biu":
+        return np.dtype(np.float32 if dtype.itemsize <= 4 else np.float64)
+    return dtype
+    
+def filename_format(date, ID, script_name=True, script=None):
+    """
+    Format of a filename. Be aware that loading previous files with LabMaster load functions will not work if you edit this function.
+    
+    - script: Script filename to use instead of the running script. See main.resume_scan().
+    """
     ## Be aware that loading previous files with LabMaster load functions will not work if you edit this function.
-    return date+"_"+ID+"_"+script_name*get_script_filename()[:-3]
+    if script is None:
+        script = get_script_filename()
+    return date+"_"+ID+"_"+script_name*script[:-3]
 
     
 def get_notebook_line_format(delimiter=';'):
@@ -174,6 +697,17 @@ def get_ready(lab, params):
         ## Reset warnings
         if hasattr(instrument, "reset_warnings"):
             instrument.reset_warnings()
+    ## Forget wakeups from previous scans.
+    lab.wakeup_lateness = []
+    ## Cache counters are saved with each scan. Cached sequences are kept.
+    lab.sequence_cache.reset_counters()
+    lab.compile_durations = []
+    lab.launch_durations = []
+    lab.profiler.reset()
+    if lab.retry_policy is not None:
+        lab.retry_policy.reset()
+    ## Statistics of the previous scan, see main.run_sweep().
+    lab.stats = None
     return
     
 def get_script_filename():
@@ -185,6 +719,203 @@ def lastID():
     """Return last saved ID."""
     return pad_ID(int(detect_experiment_ID())-1)
      
+def live_filename(saving_loc, date, ID, script=None):
+    """Where the memory-mapped data array of a running scan is kept. See main.scan(). main.load_sweep() ignores it."""
+    return saving_loc+"sweep/"+date+"/"+filename_format(date, ID, script=script)+"_live.npy"
+    
+def load_station_stats():
+    """
+    Return the statistics measured by previous scans on this station, as a dictionary. See save_station_stats().
+    Return an empty dictionary if there are none yet. Errors will be printed, not raised.
+    """
+    stats = {}
+    filename = station_stats_filename()
+    if os.path.exists(filename):
+        try:
+            with open(filename, "rb") as f:
+                stats = pickle.load(f)
+        except:
+            print("Station statistics could not be loaded. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    return stats
+    
+def measure_change_costs(lab, params, experiment, plan):
+    """
+    Estimate the time spent each time the index of a sweep_dim changes, from the duration of the first experiment.launch() at each point of the last scan (lab.launch_durations).
+    Experiment modules call the setters of their parameters in launch() (ex: a laser current, then a sleep to let it settle). The sequence only starts running when launch() returns, so its running time is left out.
+    set_point() only changes values in params, so it is left out too.
+    A least squares fit of the durations against which sweep_dims changed at each point is used, so any order works. Points that failed before launching are left out.
+    Every point changes at least one sweep_dim, so the time of a point where nothing changes can't be told apart: it is included in the cost of the sweep_dims.
+    The cost of a sweep_dim is shared equally between its parameters, then saved in the station statistics under the experiment name.
+    Errors will be printed, not raised.
+    """
+    try:
+        if plan.get("hardware_inner"):
+            ## One launch per pass of the inner sweep_dim, not per point.
+            return
+        ## Points launched by this run. A resumed scan starts at plan["start"].
+        start = plan.get("start", 0)
+        points = plan["points"][start:start+len(lab.launch_durations)]
+        dimension = points.shape[1]
+        ## 1 where the index of a sweep_dim changed since the previous point.
+        changed = (np.diff(points, axis=0)!=0).astype(float)
+        durations = np.array(lab.launch_durations[1:len(points)])
+        launched = np.isfinite(durations)
+        changed, durations = changed[launched], durations[launched]
+        if dimension==0 or len(durations) < 2*dimension:
+            ## Not enough points for a meaningful fit.
+            return
+        fit = np.linalg.lstsq(changed, durations, rcond=None)[0]
+        stats = load_station_stats()
+        measured = stats.setdefault("change_cost", {}).setdefault(experiment.__name__, {})
+        for i in range(dimension):
+            if not changed[:,i].any():
+                ## This dimension has a single point.
+                continue
+            current_sweeps = params.get_current_sweeps(i+1)
+            for param in current_sweeps:
+                measured[param.name] = float(max(0, fit[i]))/len(current_sweeps)
+        save_station_stats(stats)
+    except:
+        print("measure_change_costs() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    return
+    
+def measure_overheads(lab, experiment):
+    """
+    Save the overheads of the last scan (see overheads()) in the station statistics under the experiment name, for estimate_duration().
+    Errors will be printed, not raised.
+    """
+    try:
+        overhead = overheads(lab)
+        if overhead is None:
+            return
+        stats = load_station_stats()
+        stats.setdefault("overhead", {})[experiment.__name__] = {"program":overhead["program"], "shot":overhead["shot"], "running":overhead["running"]}
+        save_station_stats(stats)
+    except:
+        print("measure_overheads() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    return
+    
+def nans(shape, dtype=float, filename=None):
+    """
+    Return an array filled with NaNs. For a structured dtype, float fields are NaN and the others zero.
+    
+    - filename: If given, the array is a memory map of a new .npy file, which can be read by other processes with np.load(filename, mmap_mode="r").
+    """
+    if filename is None:
+        array = np.zeros(shape, dtype=dtype)
+    else:
+        array = np.lib.format.open_memmap(filename, mode="w+", dtype=np.dtype(dtype), shape=tuple(shape))
+    if array.dtype.names is None:
+        array[...] = np.nan
+    else:
+        for name in array.dtype.names:
+            if array.dtype[name].base.kind in "fc":
+                array[name] = np.nan
+    return array
+    
+def nesting_cost(shape, order, costs, nesting):
+    """
+    Return the total time spent changing parameter values (s) for a plan with the specified order and nesting.
+    
+    - shape: Number of points along each sweep_dim.
+    - order: "ascending" or "snake", see sweep_plan().
+    - costs: Time spent each time the index of a sweep_dim changes (s), for each sweep_dim. See change_costs().
+    - nesting: Tuple of sweep_dim indices (starting at 0) from the outer loop to the inner loop.
+    """
+    total = 0
+    outer_points = 1
+    for k in nesting:
+        points = outer_points*shape[k]
+        if shape[k] > 1:
+            if order=="snake":
+                ## Moves one step each time, never moves when an outer dimension moves.
+                total += (points-outer_points)*costs[k]
+            else:
+                ## Also jumps back to the start each time an outer dimension moves.
+                total += (points-1)*costs[k]
+        outer_points = points
+    return total
+    
+def nesting_report(plan, costs, unknown, best, best_cost):
+    """
+    Return a string with the predicted time spent changing parameter values during the scan, and the saving offered by the best nesting.
+    Return an empty string if no cost is known.
+    
+    - plan: Output of sweep_plan().
+    - costs, unknown: Output of change_costs().
+    - best, best_cost: Output of best_nesting().
+    """
+    if not any(costs):
+        return ""
+    cost = nesting_cost(plan["shape"], plan["order"], costs, plan["nesting"])
+    default_nesting = tuple(range(len(plan["shape"])))
+    string = "Time spent changing parameter values: "+auto_unit(cost, "s", decimal=1)+"."
+    if plan["order"] not in ["ascending", "snake"]:
+        pass
+    elif plan["nesting"]!=best and best_cost < cost:
+        string += "\nNesting "+", ".join([str(k+1) for k in best])+" (outer to inner sweep_dim) would take "+auto_unit(best_cost, "s", decimal=1)+", saving "+auto_unit(cost-best_cost, "s", decimal=1)+'. Use nesting="apply" to use it.'
+    elif plan["nesting"]!=default_nesting:
+        default_cost = nesting_cost(plan["shape"], plan["order"], costs, default_nesting)
+        string += " Saves "+auto_unit(default_cost-cost, "s", decimal=1)+" compared to sweep_dim order."
+    if unknown!=[]:
+        string += "\nUnknown cost (counted as 0): "+", ".join(unknown)+"."
+    return string+"\n"
+    
+def overheads(lab):
+    """
+    Return the time spent outside of running sequences in the current or last scan, measured by lab.profiler, as a dictionary with keys:
+    - "shot": Time spent loading memory, launching, waiting past the end of the sequence and reading data, per launch (s).
+    - "program": The rest of the wall time (compiling, setting points, plotting, checkpoints...), per call of compile_point() (s).
+    - "running": Time spent running sequences, per launch (s).
+    Return None if nothing was launched yet.
+    """
+    profiler = lab.profiler
+    programs = len(lab.compile_durations)
+    launches = profiler.stages.get("launch", (0, 0, 0))[1]
+    if programs==0 or launches==0:
+        return None
+    shot_time = sum([total for stage, (total, calls, longest) in list(profiler.stages.items()) if stage.startswith("load_memory") or stage in ["launch", "wait", "get_data"]])
+    shot_time = max(0, shot_time-profiler.running_time)
+    program_time = max(0, profiler.get_wall_time()-profiler.running_time-shot_time)
+    return {"shot":shot_time/launches, "program":program_time/programs, "running":profiler.running_time/launches}
+    
+def plan_description(plan):
+    """Return the order of a plan from sweep_plan() as a string, with the seed for the random order and the nesting if it's not the default one."""
+    description = plan["order"]
+    if plan["seed"] is not None:
+        description += " (seed="+str(plan["seed"])+")"
+    if plan.get("budget") is not None:
+        description += " (budget="+str(plan["budget"])+" of "+str(int(np.prod(plan["shape"])))+" points)"
+    if plan["nesting"]!=tuple(range(len(plan["shape"]))):
+        description += ", nesting "+", ".join([str(k+1) for k in plan["nesting"]])+" (outer to inner sweep_dim)"
+    return description
+    
+def plan_without_points(plan):
+    """
+    Return a copy of the plan without its points, for checkpoints. They only depend on the shape, order, seed and nesting of the plan, and restore_points() builds them again.
+    The points of the adaptive order depend on the data, so they are kept.
+    """
+    if plan["order"]=="adaptive":
+        return plan
+    return {key:value for key, value in plan.items() if key!="points"}
+    
+def restore_points(plan):
+    """Build the points of a plan from a checkpoint again, see plan_without_points(). Checkpoints which hold their points are left as they are."""
+    if "points" not in plan:
+        plan["points"] = nested_points(plan["shape"], plan["nesting"], plan["order"], plan["seed"])[0]
+    return plan
+    
+def remove_checkpoint(plan, file_ID):
+    """Delete the checkpoint of a completed scan. Errors will be printed, not raised."""
+    for saving_loc in saving_folders():
+        try:
+            filename = checkpoint_filename(saving_loc, plan["date"], file_ID)
+            if os.path.exists(filename):
+                os.remove(filename)
+        except:
+            print("remove_checkpoint() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    return
+    
 def remove_nan(array):
     return array[np.logical_not(np.isnan(array))]
     
@@ -218,7 +949,7 @@ def positive_answer_Y():
     return positive_answer_N()+[""]
     
     
-def run_experiment(lab, params, experiment, data, fig, file_ID, update_plot):
+def run_experiment(lab, params, experiment, data, fig, file_ID, update_plot, plan):
     """ 
     Launchs one experiment. This function is called by sweep(), which is called from scan().
    
@@ -229,39 +960,124 @@ def run_experiment(lab, params, experiment, data, fig, file_ID, update_plot):
     4) Execute experiment.launch().
     5) Wait for end of experiment.
     6) Store the result of experiment.get_data() in data array.
+    Steps 3 to 6 are repeated plan["stats"].repeats times, and data holds the mean (see acquire()).
     7) Update figure.
+    The time spent in each step is added to lab.profiler.
     """
-    ## Reset everything instructions related from lab, as well as the instructions of each memory instrument.
-    lab.reset_instructions()
-    ## Run the sequence function from experiment module (custom function defined by user) which should fill the instructions attribute of instruments with memory.
-    experiment.sequence(lab, params, fig, data, file_ID)
-    ## Load memory of instruments who can't ping_pong.
-    for instrument in lab.get_memory_instruments():
-        instrument.load_memory()
-    ## The starting pistol.
-    experiment.launch(lab, params, fig, data, file_ID)
-    ## Save time at which the experiment starts.
-    lab.time_launched = timeit.default_timer()
-    ## Wait for the end of experiment. 
-    while (timeit.default_timer() < lab.time_launched + lab.total_duration + 20*ms): ## timeit.default_timer() worst case precision is roughly 20 ms. Should be microsecond precision on Windows.
-        pass 
-    ## Update data array.
-    data[params.get_data_indices()] = experiment.get_data(lab, params, fig, data, file_ID)
+    ## Run experiment.sequence() and translate instructions to the language of each memory instrument.
+    compiled = compile_point(lab, params, experiment, data, fig, file_ID)
+    ## Load memory, launch, wait and read data, once per repeat.
+    acquire(lab, params, experiment, data, fig, file_ID, compiled, plan)
     if update_plot and fig != None:
-        ## Update figure.
-        experiment.update_plot(lab, params, fig, data, file_ID)
-        ## Update the display.
-        plotting.plt.pause(1e-6)
+        with lab.profiler.time("update_plot"):
+            ## Update figure.
+            experiment.update_plot(lab, params, fig, data, file_ID)
+            ## Update the display.
+            plotting.plt.pause(1e-6)
     return 
 
+def restore_point(lab, compiled):
+    """
+    Put back the lab state and the instructions saved by compile_point(). 
+    
+    - compiled: Output of compile_point().
+    """
+    lab.time_cursor = compiled["time_cursor"]
+    lab.total_duration = compiled["total_duration"]
+    lab.free_evolution_time = compiled["free_evolution_time"]
+    lab.inner_shots = None if compiled.get("shots") is None else len(compiled["shots"])
+    for instrument in lab.get_memory_instruments():
+        instrument.instructions = compiled["instructions"].get(instrument.name, [])
+    return
+    
+def save_checkpoint(lab, params, experiment, data, plan, file_ID, force=False):
+    """
+    Save everything needed to resume the scan (see main.resume_scan()) under checkpoint/, if lab.checkpoint_interval has passed since the last checkpoint. 
+    The checkpoint holds the data array, the plan (order, seed, nesting and position, see plan_without_points()), params, the experiment module name and the names of connected instruments.
+    A memory-mapped data array (see main.scan()) is flushed to its file instead, and the checkpoint only holds the name of that file.
+    The file is replaced in one step, so an interruption while saving leaves the previous checkpoint intact. Errors will be printed, not raised.
+    
+    - plan: Output of sweep_plan(). plan["position"] is the number of points done.
+    - force: If True, save even if lab.checkpoint_interval has not passed.
+    """
+    now = timeit.default_timer()
+    if not force and now - plan.get("checkpoint_time", now) < lab.checkpoint_interval:
+        return
+    plan["checkpoint_time"] = now
+    started = timeit.default_timer()
+    if isinstance(data, np.memmap):
+        data.flush()
+        checkpoint = {"data":None, "data_file":data.filename}
+    else:
+        checkpoint = {"data":data}
+    checkpoint.update({"plan":plan_without_points(plan), "params":params, "experiment":experiment.__name__, "instruments":sorted(lab.get_names())})
+    for saving_loc in saving_folders():
+        try:
+            filename = checkpoint_filename(saving_loc, plan["date"], file_ID)
+            with open(filename+".tmp", "wb") as f:
+                pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(filename+".tmp", filename)
+        except:
+            print("save_checkpoint() failed. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    lab.profiler.add("checkpoint", timeit.default_timer()-started)
+    return
+    
+class PointFailedError(LabMasterError):
+    """ Raised by classes.Retry_policy when a stage of a point still fails after its retries. The point is then marked failed, see acquire(). """
+    def __init__(self, stage, error):
+        LabMasterError.__init__(self, stage+" failed: "+type(error).__name__+": "+str(error))
+        self.stage = stage
+        self.error = error
+        ## Reason code saved under 'FAILED' in the sweep file.
+        self.code = stage+": "+type(error).__name__
+    
+def run_stage(lab, stage, function, *args):
+    """
+    Return function(*args), a stage of a point: "load_memory", "launch" or "get_data". 
+    It is retried according to lab.retry_policy (see classes.Retry_policy), which may reconnect instruments, and raises a PointFailedError once the retries are exhausted. 
+    Without a retry policy, errors are raised right away.
+    """
+    if lab.retry_policy is None:
+        return function(*args)
+    return lab.retry_policy.run(lab, stage, function, *args)
+    
 def saving_folders():
     """Where to save all the juicy stuff."""
     subfolder = str(datetime.datetime.today().year)+"/LabMasterData/"
     return ["C:/Data/"+subfolder, "C:/Backup/"+subfolder]
     
+def save_station_stats(stats):
+    """
+    Save statistics measured on this station, which are used by later scans (see change_costs() and estimate_duration()). 
+    They are kept under the params/ folder of the first saving location. Errors will be printed, not raised.
+    
+    - stats: Dictionary, as returned by load_station_stats().
+    """
+    try:
+        with open(station_stats_filename(), "wb") as f:
+            pickle.dump(stats, f, pickle.HIGHEST_PROTOCOL)
+    except:
+        print("Station statistics could not be saved. ", sys.exc_info()[0].__name__+":",  sys.exc_info()[1])
+    return
+    
+def size_of(obj):
+    """Return an estimate of the memory used by an object and its contents (bytes). Numpy and ctypes arrays are counted by their buffer size."""
+    if isinstance(obj, np.ndarray):
+        size = obj.nbytes
+    elif isinstance(obj, (ct.Array, ct._SimpleCData)):
+        size = ct.sizeof(obj)
+    elif isinstance(obj, dict):
+        size = sys.getsizeof(obj) + sum([size_of(key)+size_of(value) for key, value in obj.items()])
+    elif isinstance(obj, (list, tuple, set)):
+        size = sys.getsizeof(obj) + sum([size_of(x) for x in obj])
+    else:
+        size = sys.getsizeof(obj)
+    return size
+    
 def size_of_get_data_return(experiment):
     """
     In experiment .py file, read the get_data function source code to find the size of get_data output.
+    Experiment modules can avoid this by declaring a DATA_SCHEMA (see data_dtype()).
     Thus the special rules for experiment.get_data: there can only be one return, and return values have to be separated by comas.
     """
     ## clear this cache or inspect.getsource() will not used last updated experiment.
@@ -282,39 +1098,337 @@ def size_of_get_data_return(experiment):
         raise LabMasterError("Could not extract the number of return values of "+experiment.__name__+".get_data().\nSpecial rules for experiment.get_data: there can only be one return, and return values have to be separated by comas.\n Look at source code (nfu.size_of_get_data_return??) to understand how the return value is read.")
     return size
   
-def sweep(lab, params, experiment, data, fig, current_sweep_dim, file_ID, update_plot):
+def snapshot(params, data, plan):
+    """
+    Return copies of params, of the data array and of the plan, to be saved in the background while the next scan changes them. plan["stats"] keeps the copied data as its mean.
+    A memory-mapped data array is flushed and kept as is: nothing writes to it once its scan is over.
+    """
+    if isinstance(data, np.memmap):
+        data.flush()
+        params, plan = copy.deepcopy((params, plan))
+        if plan.get("stats") is not None:
+            ## Not pickled, see Running_stats.__getstate__().
+            plan["stats"].mean = data
+        return params, data, plan
+    ## Copied together, so the copy of plan["stats"].mean is the copy of data.
+    return copy.deepcopy((params, data, plan))
+    
+def sweep(lab, params, experiment, data, fig, file_ID, update_plot, plan):
     """ 
-    Sweeps through all params the same way as for loops, starting with sweep_dim #1. 
-    for ... : (sweep #1)
+    Run an experiment for each point of the plan, in the order of the plan.
+    With the "ascending" order, this is the same as for loops starting with sweep_dim #1:
+    for ... : (sweep_dim #1)
         for ... : (sweep_dim #2)
             .....................
                 for ... : (sweep_dim #max)
-    This function is recursive. The number of 'for' loops depends on input parameters.
+    Only the parameters of dimensions whose index changed since the previous point are updated.
+    Points before plan["position"] are skipped: they were measured before (see main.resume_scan()).
+    
+    - plan: Output of sweep_plan().
     """
+    previous = None
+    for n in range(plan["position"], len(plan["points"])):
+        point = plan["points"][n]
+        with lab.profiler.time("set_point"):
+            set_point(params, point, previous)
+        previous = point
+        run_experiment(lab, params, experiment, data, fig, file_ID, update_plot, plan)
+        plan["position"] = n+1
+        save_checkpoint(lab, params, experiment, data, plan, file_ID)
+        if check_deadline(lab, params, plan):
+            break
+    return
 
-
-    if params.get_dimension()==0: 
-        ## This happens if every parameter is a constant. Run experiment only once.
-        run_experiment(lab, params, experiment, data, fig, file_ID, update_plot)
-    else:
-        current_sweeps = params.get_current_sweeps(current_sweep_dim)
-        ## Here goes one 'for loop' corresponding to current sweep_dim
-        for i in range(len(current_sweeps[0].value)): 
-            ## Update the current value in array (_v attribute)
-            update_params(current_sweeps, i) 
+    
+def sweep_adaptive(lab, params, experiment, data, fig, file_ID, update_plot, plan):
+    """
+    Run an experiment for each coarse point of the plan, then keep refining the grid cell with the largest loss until plan["budget"] points have been measured.
+    A cell is a segment (1D) or a rectangle (2D) whose corners are measured points. Refining a cell measures the middle of its sides and its center, which splits it in two or four.
+    The loss of a cell is hypot(size of the cell, change of signal between its corners), each normalized by its full range, so both large gaps and steep signals get refined.
+    The signal is the first value returned by experiment.get_data(). Unmeasured points stay NaN in the data array.
+    plan["points"] holds the points actually measured, in order. The first plan["position"] of them were measured before (see main.resume_scan()).
+    
+    - plan: Output of sweep_plan() with the "adaptive" order.
+    """
+    shape = plan["shape"]
+    measured = np.zeros(shape, dtype=bool)
+    points = [tuple(point) for point in plan["points"][:plan["position"]]]
+    for point in points:
+        measured[point] = True
+    previous = None
+    
+    def measure(point):
+        """Run an experiment at the specified point unless it was already measured or the budget is spent."""
+        nonlocal previous
+        if measured[point] or len(points) >= plan["budget"] or plan.get("stopped"):
+            return
+        with lab.profiler.time("set_point"):
+            set_point(params, point, previous)
+        previous = point
+        run_experiment(lab, params, experiment, data, fig, file_ID, update_plot, plan)
+        measured[point] = True
+        points.append(point)
+        ## Keep track of what was actually measured, for saving.
+        plan["points"] = np.array(points, dtype=int).reshape(len(points), len(shape))
+        plan["position"] = len(points)
+        save_checkpoint(lab, params, experiment, data, plan, file_ID)
+        check_deadline(lab, params, plan)
+        return
+    
+    def signal(point):
+        """First value returned by experiment.get_data() at the specified point."""
+        return first_value(data[point])
+        
+    def loss(cell, signal_range):
+        """Loss of a cell, given as a (start, stop) index pair for each dimension."""
+        values = np.array([signal(corner) for corner in itertools.product(*cell)])
+        values = values[np.isfinite(values)]
+        signal_change = (values.max()-values.min())/signal_range if len(values) > 1 else 0
+        sizes = [(stop-start)/max(size-1, 1) for (start, stop), size in zip(cell, shape)]
+        return np.sqrt(np.sum(np.square(sizes)) + signal_change**2)
+        
+    def split(cell):
+        """Return the cells on each side of the middle of the specified cell, along each dimension that can still be split."""
+        edges = [[start, (start+stop)//2, stop] if stop-start > 1 else [start, stop] for start, stop in cell]
+        return list(itertools.product(*[list(zip(edge[:-1], edge[1:])) for edge in edges]))
+        
+    for point in plan["coarse"]:
+        measure(tuple(point))
+    ## The coarse grid makes the first cells. A dimension with a single point makes a cell of zero size.
+    edges = [np.unique(plan["coarse"][:,k]) for k in range(len(shape))]
+    cells = list(itertools.product(*[list(zip(edge[:-1], edge[1:])) if len(edge) > 1 else [(edge[0], edge[0])] for edge in edges]))
+    ## A cell can be split if one of its sides holds unmeasured points.
+    cells = [cell for cell in cells if any([stop-start > 1 for start, stop in cell])]
+    while len(points) < plan["budget"] and cells!=[] and not plan.get("stopped"):
+        values = np.array([signal(point) for point in points])
+        values = values[np.isfinite(values)]
+        signal_range = values.max()-values.min() if len(values) > 1 and values.max() > values.min() else 1
+        cell = cells.pop(int(np.argmax([loss(cell, signal_range) for cell in cells])))
+        ## Measure the corners of the new cells, from the middle of the sides to the center.
+        for corner in sorted(itertools.product(*[sorted(set([start, (start+stop)//2, stop])) for start, stop in cell]), key=lambda c: sum([c[k] not in cell[k] for k in range(len(c))])):
+            measure(corner)
+        cells += [new_cell for new_cell in split(cell) if any([stop-start > 1 for start, stop in new_cell])]
+    return
+    
+def sweep_pipelined(lab, params, experiment, data, fig, file_ID, update_plot, plan):
+    """
+    Same points and same order as sweep() (starting at plan["position"]), but compile_point() for the next point runs in a worker thread while the current point is running.
+    Only commit_point() (loading instrument memory) is serialized with the experiment. Memory instruments must be pipeline_safe (see main.check_pipeline()).
+    While compiling, the worker holds the lock of every memory instrument (experiment.sequence() may talk to them), so completion polling skips them meanwhile.
+    The measured overlap between compiling and running is kept in lab.profiler.
+    """
+    start = plan["position"]
+    points = plan["points"][start:]
+    if len(points)==0:
+        return
+    def compile_next(point):
+        """Compile the point in the worker. Return the compiled point with its start and end times."""
+        with contextlib.ExitStack() as stack:
+            for instrument in lab.get_memory_instruments():
+                stack.enter_context(instrument.lock)
+            started = timeit.default_timer()
+            set_point(params, point)
+            compiled = compile_point(lab, params, experiment, data, fig, file_ID)
+        return compiled, started, timeit.default_timer()
+        
+    future = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as worker:
+        compiled, started, ended = compile_next(points[0])
+        lab.profiler.compile_time += ended-started
+        for n, point in enumerate(points):
+            set_point(params, point)
+            running = compiled
             
-            if current_sweep_dim==params.get_dimension():
-                ## If this is the last 'for' loop, it's time to run an experiment. End of recursion.
-                run_experiment(lab, params, experiment, data, fig, file_ID, update_plot) 
-            else:
-                ## Else, go for another 'for' loop at the next sweep_dim.
-                sweep(lab, params, experiment, data, fig, current_sweep_dim+1, file_ID, update_plot) 
+            def start_next():
+                """Compile the next point while this one is running."""
+                nonlocal future
+                if n+1 < len(points):
+                    future = worker.submit(compile_next, points[n+1])
+                    
+            def collect_next():
+                """Wait for the next point to be compiled, then go back to the current point for get_data() and update_plot()."""
+                nonlocal compiled
+                run_ended = timeit.default_timer()
+                if n+1 < len(points):
+                    compiled, started, ended = future.result()
+                    lab.profiler.compile_time += ended-started
+                    lab.profiler.overlap_time += max(0, min(ended, run_ended) - max(started, lab.time_launched))
+                    set_point(params, point)
+                    restore_point(lab, running)
+                    
+            ## Load memory, launch, wait and read data, once per repeat. The next point is compiled during the first repeat.
+            acquire(lab, params, experiment, data, fig, file_ID, running, plan, start_next, collect_next)
+            if update_plot and fig != None:
+                with lab.profiler.time("update_plot"):
+                    ## Update figure.
+                    experiment.update_plot(lab, params, fig, data, file_ID)
+                    ## Update the display.
+                    plotting.plt.pause(1e-6)
+            plan["position"] = start+n+1
+            save_checkpoint(lab, params, experiment, data, plan, file_ID)
+            if check_deadline(lab, params, plan):
+                break
+    return
 
+def sweep_hardware_inner(lab, params, experiment, data, fig, file_ID, update_plot, plan):
+    """
+    Same points and same order as sweep() (starting at plan["position"]), but each pass of the inner sweep_dim (the last of plan["nesting"]) is compiled into a single program, with one shot per point. 
+    The whole pass is loaded, launched and waited for once, and experiment.get_inner_data() reads the result of every shot in one transfer (ex: a counter in buffered mode).
+    The host overhead of each point (compile, load memory, launch, wait, read) is then paid once per pass instead.
+    lab.inner_shots holds the number of shots of the program loaded, so experiment.launch() can arm a buffered acquisition.
+    Only the "ascending" and "snake" orders visit the points of a pass one after the other. A checkpoint can be saved after each pass.
+    
+    - plan: Output of sweep_plan(), with plan["hardware_inner"] set to True.
+    """
+    n_inner = plan["shape"][plan["nesting"][-1]]
+    for n in range(plan["position"], len(plan["points"]), n_inner):
+        points = plan["points"][n:n+n_inner]
+        ## Load memory, launch, wait and read data of the whole pass, once per repeat.
+        compiled = compile_point(lab, params, experiment, data, fig, file_ID, points)
+        acquire(lab, params, experiment, data, fig, file_ID, compiled, plan)
+        if update_plot and fig != None:
+            with lab.profiler.time("update_plot"):
+                ## Update figure.
+                experiment.update_plot(lab, params, fig, data, file_ID)
+                ## Update the display.
+                plotting.plt.pause(1e-6)
+        plan["position"] = n+len(points)
+        save_checkpoint(lab, params, experiment, data, plan, file_ID)
+        if check_deadline(lab, params, plan):
+            break
     return
 
-   
+def sweep_shape(params):
+    """Return the number of points along each sweep_dim, as a tuple."""
+    return tuple([len(params.get_current_sweeps(i)[0].value) for i in range(1, params.get_dimension()+1)])
     
+def station_stats_filename():
+    """Where the station statistics are saved."""
+    return saving_folders()[0]+"params/station_stats.pickle"
     
+def sweep_plan(params, order="ascending", seed=None, nesting=None, budget=None):
+    """
+    Return the plan of a scan: every index tuple to visit, in the order they will be visited. Index i of a tuple is the index in the arrays of sweep_dim #i+1.
+    The plan is a dict with keys:
+    - "order": Traversal order (see below).
+    - "seed": Seed of the random order, None for other orders.
+    - "shape": Number of points along each sweep_dim.
+    - "nesting": Sweep_dim indices (starting at 0) from the outer loop to the inner loop.
+    - "budget": Maximum number of points of the adaptive order, None for other orders.
+    - "points": Integer array of shape (number of points, number of sweep_dims). If every parameter is a constant, it holds a single empty point.
+                For the adaptive order, the points measured so far. sweep_adaptive() appends to it.
+    - "coarse": The coarse points the adaptive order starts with. Not in the plan of other orders.
+    - "position": Number of points measured so far. Sweeps start at this point. See main.resume_scan().
+    - "date", "script": Date and script filename of the scan, as in file names. A resumed scan is saved under its original file names.
+    Scans with a deadline add "deadline", "max_repeats" and "stopped" (see fit_deadline() and check_deadline()). 
+    
+    - order: "ascending": Same as nested for loops, sweep_dim #1 being the outer loop. 
+             "snake": Same as ascending, but each dimension alternates between forward and backward passes, so only one index moves by one step from a point to the next (no jump back to the start of a dimension).
+             "interleaved": Coarse to fine. Start with the ends of each dimension, then keep halving the step size until every point has been visited. Gives a preview of the whole scan early on.
+             "random": Random order. 
+             "adaptive": Start with a coarse grid, then refine where the signal changes the most, until the budget is spent. See sweep_adaptive(). 1D and 2D scans only.
+    - seed: Seed of the random order. If None, a seed is drawn and recorded in the plan. Ignored for other orders.
+    - nesting: Tuple of sweep_dim indices (starting at 0) from the outer loop to the inner loop. See best_nesting().
+               If None, sweep_dim #1 is the outer loop and sweep_dim #max is the inner loop. The columns of points always follow sweep_dim numbering.
+    - budget: Maximum number of points measured by the adaptive order. Ignored for other orders.
+    """
+    shape = sweep_shape(params)
+    if nesting is None:
+        nesting = tuple(range(len(shape)))
+    nesting = tuple(nesting)
+    if sorted(nesting)!=list(range(len(shape))):
+        raise LabMasterError("Nesting "+str(nesting)+" is not a permutation of the "+str(len(shape))+" sweep dimensions.")
+    if order=="adaptive":
+        if len(shape) not in [1, 2]:
+            raise LabMasterError("The adaptive order works for 1D and 2D scans only, not "+str(len(shape))+"D.")
+        if not isinstance(budget, (int, np.integer)) or budget < 2**len(shape):
+            raise LabMasterError("The adaptive order needs an integer budget of at least "+str(2**len(shape))+" points, instead of "+str(budget)+".")
+    else:
+        budget = None
+    points, seed = nested_points(shape, nesting, order, seed, budget)
+    plan = {"order":order, "seed":seed, "shape":shape, "nesting":nesting, "budget":budget, "points":points, "position":0, "date":today(), "script":get_script_filename()}
+    if order=="adaptive":
+        plan["coarse"] = points
+        plan["points"] = np.zeros((0, len(shape)), dtype=int)
+    return plan
+    
+def nested_points(shape, nesting, order, seed, budget=None):
+    """
+    Return the points of a plan and the seed of the random order: plan_points() for the nested shape, with the columns put back in sweep_dim order. See sweep_plan().
+    The points only depend on the arguments, so a checkpoint doesn't hold them (see plan_without_points()).
+    """
+    nested_shape = tuple([shape[k] for k in nesting])
+    points, seed = plan_points(nested_shape, order, seed, budget)
+    return points[:, np.argsort(nesting)], seed
+    
+def plan_points(shape, order, seed, budget=None):
+    """
+    Return the index tuples of every point of the specified shape in the specified order, the first dimension being the outer loop, and the seed of the random order. See sweep_plan().
+    """
+    ## Nested for loops order. Without any dimension, a single empty point.
+    points = np.indices(shape, dtype=int).reshape(len(shape), int(np.prod(shape))).T
+    if order=="ascending":
+        seed = None
+    elif order=="snake":
+        seed = None
+        for k in range(1, len(shape)):
+            ## Dimension k goes backward when the outer dimensions, as a whole, have moved by an odd number of steps.
+            outer_steps = np.ravel_multi_index(points[:,:k].T, shape[:k])
+            backward = outer_steps%2==1
+            points[backward,k] = shape[k]-1-points[backward,k]
+    elif order=="interleaved":
+        seed = None
+        ## Stable sort keeps the ascending order within a level.
+        points = points[np.argsort(grid_levels(points, shape), kind="stable")]
+    elif order=="adaptive":
+        seed = None
+        levels = grid_levels(points, shape)
+        ## The finest complete grid that uses at most a third of the budget. The rest goes to refinement.
+        level = 0
+        while level < levels.max() and np.sum(levels<=level+1) <= budget//3:
+            level += 1
+        points = points[levels<=level]
+    elif order=="random":
+        if seed is None:
+            seed = np.random.randint(2**31)
+        points = points[np.random.RandomState(seed).permutation(len(points))]
+    else:
+        raise LabMasterError("Unknown sweep order: "+str(order)+'. Choose from "ascending", "snake", "interleaved" or "random".')
+    return points, seed
+    
+def grid_levels(points, shape):
+    """
+    Return the level of each point: the coarsest grid the point belongs to, where grid #0 holds the ends of each dimension and each next grid halves the step size.
+    
+    - points: Integer array of index tuples, as in sweep_plan().
+    - shape: Number of points along each dimension.
+    """
+    levels = np.zeros(len(points), dtype=int)
+    for k, size in enumerate(shape):
+        ## Index i belongs to the coarsest grid (level) whose step size divides i. Index 0 is on every grid.
+        bits = int(np.ceil(np.log2(size))) if size > 1 else 0
+        index = points[:,k]
+        trailing_zeros = np.zeros(len(points), dtype=int)
+        for b in range(bits):
+            trailing_zeros += (index % 2**(b+1))==0
+        level = np.where(index==0, 0, bits-trailing_zeros)
+        ## The last index closes the first grid, to span the whole dimension.
+        level[index==size-1] = 0
+        levels = np.maximum(levels, level)
+    return levels
+    
+def set_point(params, point, previous=None):
+    """
+    Update the swept parameters to the specified point.
+    
+    - point: Index tuple, as found in the points of sweep_plan().
+    - previous: Point the parameters are currently set to. If given, only the dimensions whose index changed are updated.
+    """
+    for i, index in enumerate(point):
+        if previous is None or previous[i]!=index:
+            update_params(params.get_current_sweeps(i+1), int(index))
+    return
+
 def today():
     """Format of the date in filename. Be aware that loading previous files with LabMaster load functions will not work if you edit this function."""
     ## Be aware that loading previous files with LabMaster load functions will not work if you edit this function.    
@@ -328,16 +1442,96 @@ def update_params(swept_params, i):
     
 
 
-def zeros(params, experiment):
+def wait_for_end(lab, duration=None):
+    """
+    Wait for the end of experiment, which is at lab.time_launched + duration + lab.end_margin at the latest.
+    If lab.detect_completion is True, memory instruments are polled every lab.poll_interval, and the wait ends as soon as they confirm their sequence is over (see completion_confirmed()). 
+    The timer is the fallback when no instrument can tell.
+    Sleep until lab.spin_window before the end, then spin until the end for precision. 
+    Sleeping doesn't hog the processor, so the figure and other threads keep running meanwhile.
+    
+    - duration: Duration of the running sequence (s). Default is lab.total_duration. 
+                Give it when lab.total_duration may already hold the next point (see sweep_pipelined()).
+    
+    Output:
+    - Lateness of the wakeup relative to the end of experiment (s). It is negative if the experiment ended on hardware completion.
+    """
+    if duration is None:
+        duration = lab.total_duration
+    deadline = lab.time_launched + duration + lab.end_margin
+    if lab.detect_completion:
+        instruments = lab.get_memory_instruments()
+        next_poll = timeit.default_timer()
+    else:
+        instruments = []
+        next_poll = np.inf
+    now = timeit.default_timer()
+    while now < deadline:
+        if now >= next_poll:
+            if completion_confirmed(instruments):
+                break
+            next_poll = now + lab.poll_interval
+        ## Sleep until the next poll, or until the spin window starts.
+        wake = min(deadline - lab.spin_window, next_poll)
+        if wake > now:
+            time.sleep(wake - now)
+        now = timeit.default_timer() ## timeit.default_timer() should be microsecond precision on Windows.
+    return now - deadline
+    
+def completion_confirmed(instruments):
+    """
+    Return True if every instrument that can tell says its sequence is over, and at least one of them can tell. See Instrument.is_done().
+    
+    - instruments: List of memory instruments to ask.
+    """
+    answers = []
+    for instrument in instruments:
+        ## An instrument busy with another thread can't tell for now.
+        if instrument.lock.acquire(blocking=False):
+            try:
+                answers.append(instrument.is_done())
+            finally:
+                instrument.lock.release()
+    answers = [answer for answer in answers if answer is not None]
+    return answers!=[] and all(answers)
+    
+def wakeup_report(lab):
+    """
+    Return a string summarizing how wait_for_end() woke up during the last scan. 
+    A large lateness means lab.spin_window is too short for this station. A tiny one means lab.end_margin can be tuned down.
+    """
+    if lab.wakeup_lateness==[]:
+        return "Wakeup lateness: no experiment was launched."
+    lateness = np.array(lab.wakeup_lateness)
+    on_timer = lateness[lateness >= 0]
+    on_completion = lateness[lateness < 0]
+    report = ""
+    if len(on_timer) > 0:
+        report += "Wakeup lateness: "+auto_unit(np.mean(on_timer), "s", decimal=1)+" mean, "+auto_unit(np.max(on_timer), "s", decimal=1)+" max over "+str(len(on_timer))+" points (end_margin = "+auto_unit(lab.end_margin, "s")+")."
+    if len(on_completion) > 0:
+        report += " "*(report!="")+str(len(on_completion))+" points ended on hardware completion, "+auto_unit(-np.mean(on_completion), "s", decimal=1)+" before the timer on average."
+    return report
+
+def zeros(params, experiment, averaged=False, filename=None):
     """ 
     Initializes data to NaNs. Size of array will depend on dimension of sweep, lenght of parameter values, and size of get_data return. 
     dim 1 is sweep_dim #1, dim 2 is sweep_dim #2 and so on.
+    If the experiment module declares a DATA_SCHEMA (see data_dtype()), the data array is a structured array with one field per value returned by get_data instead.
+    Its float fields are initialized to NaNs and its integer fields to zeros.
+    
+    - averaged: If True, the data array will hold the mean of repeated shots, so integer fields of DATA_SCHEMA are stored as floats.
+    - filename: If given, the data array is a memory map of a new .npy file (see live_filename()). Points are on disk as soon as they are stored.
     """
     ## dimension of the sweep
     dimension = params.get_dimension()
     ## Shape of the array depends on the length of parameters.
     array_shape = [len(params.get_current_sweeps(i)[0].value)  for i in range(1,dimension+1) ]
     
+    dtype = data_dtype(experiment, averaged)
+    if dtype is not None:
+        ## Values returned by get_data are fields of each element, no dimension is added.
+        return nans(array_shape if len(array_shape) > 0 else [1], dtype, filename)
+    
     ## size of the get_data output.
     get_data_size =  size_of_get_data_return(experiment)
     if get_data_size > 1:
@@ -346,12 +1540,10 @@ def zeros(params, experiment):
         
     if len(array_shape)==0:
         ## Only one element in the data array.
-        data = np.zeros(1)
-    else:
-        data = np.zeros(shape=array_shape)
+        array_shape = [1]
     
     ## Initialize all data elements to NaNs (NaNs are not plotted on matplotlib figures)
-    data[:] = np.nan
+    data = nans(array_shape, float, filename)
 
     return data
 
@@ -15,6 +15,7 @@ from scipy.optimize import curve_fit
 ## Homemade modules
 from .units import *
 from .not_for_user import LabMasterError
+from . import not_for_user as nfu
 
 
 ##-------------------------------  automatic plotting -----------------------------------------------##
@@ -23,7 +24,9 @@ def create_plot_auto(lab, params, fig, data, ID):
     """
     If one of create_plot or update_plot function is omitted from the experimented module, this function will be used instead.
     Create a simple XY plot based on parameter arrays and sweep dimensionality.
+    Fields of a structured data array are plotted as separate lines.
     """
+    data = nfu.flatten_fields(data)
     if len(data.shape) == 1:
         xlabel = sorted([x.name for x in params.get_current_sweeps(1)])[0]
         createfig_XY(fig, xlabel, "data", 1, "--o")
@@ -42,17 +45,26 @@ def update_plot_auto(lab, params, fig, data, ID):
     """
     if fig == None:
         return
+    ## Error bars if there are repeated shots. The scan in progress keeps its statistics in lab.stats (see main.run_sweep()).
+    stats = getattr(lab, "stats", None)
+    if stats is not None and stats.repeats > 1 and stats.mean is data:
+        error = stats.get_error()
+    else:
+        error = None
+    data = nfu.flatten_fields(data)
+    if error is not None:
+        error = nfu.flatten_fields(error)
     if len(data.shape) == 1:
         _, xparam = sorted([(x.name, x) for x in params.get_current_sweeps(1)])[0]
-        updatefig_XY(fig, xparam.value, data)
+        updatefig_XY(fig, xparam.value, data, yerr=error)
     elif len(data.shape) == 2 and params.get_dimension()==2:
         _, xparam = sorted([(x.name, x) for x in params.get_current_sweeps(1)])[0]
         _, yparam = sorted([(y.name, y) for y in params.get_current_sweeps(2)])[0]
-        updatefig_XY(fig, xparam.value, data[:,yparam.i], line_index=yparam.i)
+        updatefig_XY(fig, xparam.value, data[:,yparam.i], line_index=yparam.i, yerr=None if error is None else error[:,yparam.i])
     elif len(data.shape) == 2 and params.get_dimension()==1:
         _, xparam = sorted([(x.name, x) for x in params.get_current_sweeps(1)])[0]
         for i in range(data.shape[1]):
-            updatefig_XY(fig, xparam.value, data[:,i], line_index=i)
+            updatefig_XY(fig, xparam.value, data[:,i], line_index=i, yerr=None if error is None else error[:,i])
     return
 
     
@@ -90,14 +102,16 @@ def add_lines(fig, num_lines, *plot_args):
     for i in range(num_lines):
         ax.plot([], *plot_args)
 
-def updatefig_XY(fig, xdata, ydata, line_index=0):
+def updatefig_XY(fig, xdata, ydata, line_index=0, yerr=None):
     """
     Update a plot created using createfig_XY().
+    Points where ydata is NaN (not measured yet) are skipped, so that lines join the measured points.
     
     - fig: A figure object.
     - xdata: X array.
     - ydata: Y array.
     - line_index: index of the line to update.
+    - yerr: Y error array, drawn as error bars of the same color as the line. If None, no error bars.
     """
     ax = fig.axes[0]
     for child in [x for x in ax.get_children() if isinstance(x, mpl.text.Text)]:
@@ -105,8 +119,17 @@ def updatefig_XY(fig, xdata, ydata, line_index=0):
             child.remove()
         except NotImplementedError:
             pass          
-    ax.lines[line_index].set_xdata(xdata)
-    ax.lines[line_index].set_ydata(ydata)
+    finite = np.isfinite(ydata)
+    ax.lines[line_index].set_xdata(np.asarray(xdata)[finite])
+    ax.lines[line_index].set_ydata(np.asarray(ydata)[finite])
+    ## Error bars of this line are tagged so that they can be replaced.
+    gid = "errorbars_"+str(line_index)
+    for child in [x for x in ax.collections if x.get_gid()==gid]:
+        child.remove()
+    if yerr is not None:
+        finite = np.logical_and(finite, np.isfinite(yerr))
+        x, y, err = np.asarray(xdata)[finite], np.asarray(ydata)[finite], np.asarray(yerr)[finite]
+        ax.vlines(x, y-err, y+err, colors=ax.lines[line_index].get_color(), gid=gid)
     ax.relim()
     ax.autoscale()
     return
@@ -180,7 +203,7 @@ def updatefig_image(fig, array):
     """
     ax = fig.axes[0]
     ax.images[0].set_data(np.nan_to_num(array.T))            
-    ax.images[0].set_norm(mpl.colors.Normalize(vmin=np.min(array), vmax=np.max(array)))
+    ax.images[0].set_norm(mpl.colors.Normalize(vmin=np.nanmin(array), vmax=np.nanmax(array)))
     return
 
 
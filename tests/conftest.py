@@ -0,0 +1,59 @@
+"""
+Fake instruments and experiments to run the sweeps of not_for_user without hardware.
+"""
+import os
+import sys
+import types
+import timeit
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod.classes import Lab, Params, Instrument
+from mod import not_for_user as nfu
+
+
+class Fake_board(Instrument):
+    """A memory instrument which can't tell when its sequence is over. Records what was loaded."""
+    pipeline_safe = True
+    
+    def __init__(self, name, parent):
+        Instrument.__init__(self, name, parent, use_memory=True)
+        self.loaded = None
+        self.loaded_key = None
+        
+    def compile_memory(self):
+        return list(self.instructions)
+        
+    def load_memory(self, compiled=None, key=None):
+        self.loaded = compiled if compiled is not None else list(self.instructions)
+        self.loaded_key = key
+        
+    def abort(self):
+        pass
+        
+    def close(self):
+        pass
+        
+
+@pytest.fixture
+def lab():
+    """A Lab with a Fake_board named board, which ends each point on the timer."""
+    lab = Lab()
+    lab.board = Fake_board("board", lab)
+    lab.detect_completion = False
+    lab.end_margin = 0
+    lab.spin_window = 1e-3
+    lab.checkpoint_interval = np.inf
+    return lab
+    
+
+def run_sweep(sweep, lab, params, experiment):
+    """Run the sweep function over every point of params, in ascending order. Return the data array."""
+    nfu.get_ready(lab, params)
+    plan = nfu.sweep_plan(params)
+    data = np.zeros(nfu.sweep_shape(params))
+    sweep(lab, params, experiment, data, None, "0000", False, plan)
+    return data
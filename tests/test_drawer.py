@@ -0,0 +1,44 @@
+"""
+Drawer keeps a registry of its matching attributes, built again only when a matching attribute is set or deleted.
+"""
+import pickle
+
+from conftest import Fake_board
+from mod.classes import Params, Parameter
+
+
+def test_registry_follows_dict_writes(lab):
+    """Instruments and parameters replaced, added or deleted through __dict__ are listed as they are now, once registered."""
+    old = lab.board
+    lab.__dict__["board"] = Fake_board("board", lab)
+    lab.register("board")
+    assert lab.get_dict()["board"] is lab.board is not old
+    
+    params = Params("a", "b")
+    params.compile_layout()
+    params.__dict__["a"] = Parameter("a")
+    params.register("a")
+    params.__dict__["c"] = Parameter("c")
+    params.register("c")
+    del params.__dict__["b"]
+    params.register("b")
+    assert params.get_names() == ["a", "c"]
+    assert params.get_dict()["a"] is params.a
+    
+    
+def test_lookup_does_not_scan_attributes(monkeypatch):
+    """Once built, the registry is used as is. Setting other attributes doesn't make it dirty."""
+    params = Params("a", "b")
+    params.get_dict()
+    params.point_lists = {}
+    monkeypatch.setattr(Params, "is_object_type", lambda self, value: 1/0)
+    assert params.get_names() == ["a", "b"]
+    
+    
+def test_registry_survives_pickle():
+    """A pickled drawer lists its own copies, and one pickled before it had a registry builds it again."""
+    params = pickle.loads(pickle.dumps(Params("a", "b")))
+    assert params.get_dict()["a"] is params.a
+    del params.__dict__["_registry"]
+    del params.__dict__["_dirty"]
+    assert params.get_names() == ["a", "b"]
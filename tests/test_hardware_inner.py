@@ -0,0 +1,60 @@
+"""
+A program with one shot per point of the inner sweep_dim (see main.scan(hardware_inner=True)).
+"""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from mod.classes import Params
+from mod.units import *
+from mod import not_for_user as nfu
+
+## The instrument modules import visa.
+pytest.importorskip("visa")
+from mod.instruments.pulse_blasters import Pulse_blaster_DDSII300
+
+
+def fake_spinapi():
+    """A stand-in for the spinapi wrapper, which records the registers programmed on the board."""
+    spinapi = types.ModuleType("dll_spinapi")
+    spinapi.PULSE_PROGRAM, spinapi.FREQ_REGS, spinapi.TX_PHASE_REGS = 0, 1, 2
+    spinapi.TX_ENABLE, spinapi.TX_DISABLE = 1, 0
+    spinapi.NO_PHASE_RESET = 0
+    spinapi.ms = 1e6
+    spinapi.Inst = type("Enum", (), dict(CONTINUE=0, STOP=1, LOOP=2, END_LOOP=3, JSR=4, RTS=5, BRANCH=6, LONG_DELAY=7, WAIT=8, RTI=9))
+    spinapi.freqs = []
+    for name in ["pb_init", "pb_core_clock", "pb_select_dds", "pb_start_programming", "pb_stop_programming", "pb_set_phase", "pb_set_amp", "pb_stop", "pb_start", "pb_reset", "pb_inst_dds2"]:
+        setattr(spinapi, name, lambda *args: 0)
+    spinapi.pb_set_freq = lambda freq: spinapi.freqs.append(freq) or 0
+    return spinapi
+    
+
+def test_shots_keep_their_registers(lab, monkeypatch):
+    """Each shot resets the registers in sequence(), then pulses at its own frequency. Every shot of the program must still play its own frequency."""
+    spinapi = fake_spinapi()
+    monkeypatch.setitem(sys.modules, "mod.instruments.wrappers.dll_spinapi", spinapi)
+    lab.dds = Pulse_blaster_DDSII300("dds", lab)
+    params = Params("freq")
+    params.freq.value = np.array([1, 2, 3])*MHz
+    experiment = types.ModuleType("exp_registers")
+    
+    def sequence(lab, params, fig, data, ID):
+        lab.dds.reset_registers()
+        lab.dds.pulse(length=us, freq=params.freq.v)
+        lab.delay(us)
+        
+    experiment.sequence = sequence
+    nfu.get_ready(lab, params)
+    plan = nfu.sweep_plan(params)
+    compiled = nfu.compile_point(lab, params, experiment, None, None, "0000", plan["points"])
+    memory = compiled["memory"]["dds"]
+    
+    played = [memory["registers"]["RF1"]["freq"][RF1_params[0]] for TTL_params, RF1_params, RF2_params in memory["program"] if RF1_params[3]==spinapi.TX_ENABLE]
+    assert played==[1*MHz, 2*MHz, 3*MHz]
+    assert lab.shot is None
+    ## The registers indexed by the program are the ones programmed on the board.
+    spinapi.freqs.clear()
+    lab.dds.load_memory(compiled=memory)
+    assert spinapi.freqs==[freq*1e-6 for freq in memory["registers"]["RF1"]["freq"]+memory["registers"]["RF2"]["freq"]]
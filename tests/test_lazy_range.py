@@ -0,0 +1,27 @@
+"""
+classes.Lazy_range generates the values of a long sweep on demand.
+"""
+import numpy as np
+import pytest
+
+from mod.classes import Lazy_range
+
+
+@pytest.mark.parametrize("start, stop, step, num", [
+    (0, 1, 0.25, 5),
+    (0.1, 0.3, 0.1, 3),
+    (0, 1, 0.3, 4),
+    (5, 0, -0.5, 11),
+    (0, 0, 1, 1),
+    ## Stop is on the grid, but the division falls just below the last index.
+    (0, 0.28469999999999995, 2.8469999999999998e-09, 100000001),
+    (0, 0.1533, 1.533e-10, 1000000001),
+    ## Stop is off the grid by more than rounding errors.
+    (0, 1e8+0.4, 1, 100000001),
+    (0, 1e8-0.4, 1, 100000000),
+])
+def test_linear_range_includes_stop_on_grid(start, stop, step, num):
+    """stop is included when it's on the grid, whatever the size of the range, and no point is added past it."""
+    values = Lazy_range(start, stop, step)
+    assert len(values) == num
+    assert np.isclose(values[-1], start+(num-1)*step)
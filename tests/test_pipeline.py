@@ -0,0 +1,44 @@
+"""
+nfu.sweep_pipelined() compiles the next point while the current one runs.
+"""
+import timeit
+import types
+
+import numpy as np
+
+from conftest import run_sweep
+from mod.classes import Params
+from mod import not_for_user as nfu
+
+
+def test_wait_uses_duration_of_running_point(lab):
+    """Points alternate between a long and a short sequence. Each one is read after its own duration, not the duration of the point compiled meanwhile."""
+    params = Params("a")
+    params.a.value = np.arange(4)
+    durations = {0:0.2, 1:0.01, 2:0.2, 3:0.01}
+    launched = {}
+    read = {}
+    experiment = types.ModuleType("exp_durations")
+    
+    def sequence(lab, params, fig, data, ID):
+        lab.board.instructions.append(params.a.v)
+        lab.update_time_cursor(durations[params.a.v], None)
+        
+    def launch(lab, params, fig, data, ID):
+        launched[params.a.v] = timeit.default_timer()
+        
+    def get_data(lab, params, fig, data, ID):
+        read[params.a.v] = (timeit.default_timer()-launched[params.a.v], list(lab.board.loaded))
+        return params.a.v
+        
+    experiment.sequence = sequence
+    experiment.launch = launch
+    experiment.get_data = get_data
+    data = run_sweep(nfu.sweep_pipelined, lab, params, experiment)
+    
+    assert data.tolist()==[0, 1, 2, 3]
+    for a, duration in durations.items():
+        elapsed, loaded = read[a]
+        assert elapsed >= duration
+        assert loaded==[a]
+    assert abs(lab.profiler.running_time-sum(durations.values())) < 0.05
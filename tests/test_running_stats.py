@@ -0,0 +1,28 @@
+"""
+classes.Running_stats keeps the mean, variance and count of repeated shots, and stops a point at a target error or SNR.
+"""
+import numpy as np
+import pytest
+
+from mod.classes import Running_stats
+from mod import not_for_user as nfu
+
+
+@pytest.mark.parametrize("options", [{"target_error":0.1}, {"target_snr":10}, {"target_error":0.1, "repeats":5, "min_repeats":1}])
+def test_target_needs_two_shots(options):
+    """A target can't be tested with a single shot, since the variance needs two."""
+    with pytest.raises(nfu.LabMasterError):
+        Running_stats(np.zeros(3), 1, **options)
+        
+        
+def test_target_stops_point():
+    """A point stops once its standard error reaches the target, and not before min_repeats shots."""
+    stats = Running_stats(np.zeros(2), 1, repeats=10, target_error=0.5)
+    assert stats.min_repeats == 2
+    stats.add((0,), 1.0)
+    assert not stats.is_done((0,))
+    stats.add((0,), 1.0)
+    assert stats.is_done((0,))
+    for value in [0.0, 10.0]:
+        stats.add((1,), value)
+    assert not stats.is_done((1,))